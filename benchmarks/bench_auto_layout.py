@@ -0,0 +1,105 @@
+"""
+Accuracy and latency of automatic hits window detection (gtraid/auto_layout.py)
+
+Usage:
+    python benchmarks/bench_auto_layout.py test_images/2021-06-06/* test_images/rock/*
+
+For each screenshot of a resolution from dimensions.yaml hit boxes are found twice: in hits_window
+from the file and in the detected window. Boxes are compared in screenshot coordinates.
+The same is done for shifted copies of screenshots (a black bar on the left and on the top, like
+a notch or a UI shift) where the file coordinates don't fit: detected boxes must be the original
+ones shifted by the bar. Latency is the time of detect_hits_layout (without caching).
+"""
+import argparse
+import glob
+import logging
+import os
+import statistics
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid import DimensionsFile
+from gtraid.auto_layout import detect_hits_layout
+from gtraid.image_reco import crop_hits_window, find_hit_boxes
+
+
+def screen_boxes(img, crop_rects):
+    """Hit boxes found in the hits window of crop_rects as (x, y, width, height) in screenshot coordinates"""
+    window = crop_rects.hits_window
+    raid_hits_img = crop_hits_window(img, window.corners, debug=0)
+    boxes = find_hit_boxes(raid_hits_img, crop_rects.hit_image.min_width, crop_rects.hit_image.min_height, debug=0)
+    return sorted((window.x_start + box.x, window.y_start + box.y, box.width, box.height) for box in boxes)
+
+
+def shift(img, left, top):
+    """Adds black bars on the left and on the top"""
+    return cv2.copyMakeBorder(img, top, 0, left, 0, cv2.BORDER_CONSTANT, value=(0, 0, 0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='+', help="Screenshot files (wildcards allowed)")
+    parser.add_argument("--shift", type=int, default=64, help="Black bar size for shifted screenshots, px")
+    args = parser.parse_args()
+
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+    dimensions_file = DimensionsFile(os.path.join(root_dir, 'dimensions.yaml'))
+
+    # Detection functions log warnings for screenshots without hit boxes. Silence them
+    logging.disable(logging.WARNING)
+
+    screenshots = 0
+    latencies = []
+    matched = {"original": 0, "shifted": 0}
+    fixed_shifted_matched = 0
+    for user_input in args.inputs:
+        for file_name in glob.glob(user_input):
+            img = cv2.imread(file_name)
+            if img is None:
+                continue
+            height, width = img.shape[:2]
+            crop_rects = dimensions_file.get_dimensions(width, height)
+            if crop_rects is None or crop_rects.name != crop_rects.source_name:
+                continue        # Only resolutions from the file have reference boxes
+            screenshots += 1
+            expected = screen_boxes(img, crop_rects)
+
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            start = time.perf_counter()
+            layout = detect_hits_layout(img, gray)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            # Fresh DimensionsFile each time, so the detected layout is not taken from its cache
+            detecting_file = DimensionsFile(os.path.join(root_dir, 'dimensions.yaml'))
+            if layout is not None and screen_boxes(img, detecting_file.get_auto_crop_rects(img)) == expected:
+                matched["original"] += 1
+
+            shifted = shift(img, args.shift, args.shift)
+            shifted_expected = [(x + args.shift, y + args.shift, box_width, box_height)
+                                for x, y, box_width, box_height in expected]
+            detecting_file = DimensionsFile(os.path.join(root_dir, 'dimensions.yaml'))
+            try:
+                if screen_boxes(shifted, detecting_file.get_auto_crop_rects(shifted)) == shifted_expected:
+                    matched["shifted"] += 1
+            except KeyError:
+                pass
+            try:
+                if screen_boxes(shifted, dimensions_file.get_crop_rects(shifted)) == shifted_expected:
+                    fixed_shifted_matched += 1
+            except KeyError:
+                pass        # The resolution of the shifted screenshot is unknown
+
+
+    print("\n=====================================")
+    print(f"Screenshots: {screenshots}")
+    if latencies:
+        print(f"Detection latency, ms: mean={statistics.mean(latencies):.2f} "
+              f"median={statistics.median(latencies):.2f} max={max(latencies):.2f}")
+    print(f"{'screenshots':<12}{'file hits_window':>20}{'auto layout':>15}")
+    print(f"{'original':<12}{screenshots:>20}{matched['original']:>15}")
+    print(f"{'shifted':<12}{fixed_shifted_matched:>20}{matched['shifted']:>15}")
+    print("(number of screenshots where all hit boxes are found at the right place)")
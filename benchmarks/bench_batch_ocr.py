@@ -0,0 +1,77 @@
+"""
+Compares per-field OCR (one tesseract launch per name/damage/boss) with batched OCR
+(one tesseract launch per language per page of stitched fields).
+
+Usage:
+    python benchmarks/bench_batch_ocr.py -t /usr/bin/tesseract test_images/2021-06-06/*
+
+Reports the number of tesseract launches, wall time and fields where outputs differ.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import pytesseract
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid import DimensionsFile, recognize_screenshot
+
+
+launches = 0
+_run_tesseract = pytesseract.pytesseract.run_tesseract
+
+
+def counting_run_tesseract(*args, **kwargs):
+    """Wraps pytesseract launcher to count tesseract process launches"""
+    global launches
+    launches += 1
+    return _run_tesseract(*args, **kwargs)
+
+
+def run(images, dimensions_file, batch_ocr):
+    """Recognizes all images and returns (launches, seconds, [(name, damage, boss), ...])"""
+    global launches
+    launches = 0
+    fields = []
+    start = time.perf_counter()
+    for img in images:
+        result = recognize_screenshot(img, dimensions_file.get_crop_rects(img), debug=0, batch_ocr=batch_ocr)
+        fields.extend((hit.name, hit.damage, hit.boss) for hit in result.hit_records)
+    return launches, time.perf_counter() - start, fields
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='+', help="Screenshot files (wildcards allowed)")
+    parser.add_argument("-t", "--tesseract", default="tesseract", help="Full path to tesseract executable")
+    args = parser.parse_args()
+
+    pytesseract.pytesseract.tesseract_cmd = args.tesseract
+    pytesseract.pytesseract.run_tesseract = counting_run_tesseract
+
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+    dimensions_file = DimensionsFile(os.path.join(root_dir, 'dimensions.yaml'))
+
+    files = []
+    for user_input in args.inputs:
+        files.extend(glob.glob(user_input))
+    images = [img for img in (cv2.imread(file_name) for file_name in files) if img is not None]
+
+    per_field_launches, per_field_time, per_field = run(images, dimensions_file, batch_ocr=False)
+    batch_launches, batch_time, batch = run(images, dimensions_file, batch_ocr=True)
+
+    mismatches = [(a, b) for a, b in zip(per_field, batch) if a != b]
+
+    print("\n=====================================")
+    print(f"Screenshots: {len(images)}, hits: {len(per_field)}")
+    print(f"{'mode':<12}{'launches':>10}{'time, s':>10}{'s/image':>10}")
+    print(f"{'per-field':<12}{per_field_launches:>10}{per_field_time:>10.2f}{per_field_time/max(len(images), 1):>10.3f}")
+    print(f"{'batch':<12}{batch_launches:>10}{batch_time:>10.2f}{batch_time/max(len(images), 1):>10.3f}")
+    print(f"Saved launches: {per_field_launches - batch_launches}, speedup: {per_field_time/max(batch_time, 1e-9):.1f}x")
+    print(f"Hits with different output: {len(mismatches)}")
+    for per_field_hit, batch_hit in mismatches:
+        print(f"  per-field={per_field_hit!r} batch={batch_hit!r}")
@@ -0,0 +1,191 @@
+"""
+Binarization methods (gtraid/binarization.py) against the ground truth on changed screenshots
+
+Usage:
+    python benchmarks/bench_binarization.py
+    python benchmarks/bench_binarization.py -t /usr/bin/tesseract --glyphs gallery/damage_glyphs.npz
+
+Screenshots of benchmarks/ground_truth.yaml are changed the way screenshots of other devices and
+apps differ (darker, brighter, lower contrast, JPEG artifacts) and recognized up to preparation of
+fields with each configuration of CONFIGS, the way recognize_screenshot does it ('auto' thresholds
+are calibrated by the first screenshot of each changed set).
+
+Reported for each configuration and change:
+- screenshots with all hit boxes found
+- damages read by the glyph bank (--glyphs): right and confident, wrong and confident
+- names and damages recognized right by OCR (with -t)
+- CPU time of finding hit boxes and preparing fields per screenshot
+Then CPU time and peak memory of preparing fields with masks of the whole hits window (as it was done
+before thresholds could be configured) and with masks of field slices.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import pytesseract
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid import DimensionsFile
+from gtraid.binarization import DEFAULT_THRESHOLDS, ThresholdCalibration, ThresholdSettings
+from gtraid.digit_reader import GlyphBank
+from gtraid.image_reco import (box_region, find_hit_boxes, ocr_damage, ocr_name, prepare_hit_fields,
+                               prepare_name_from_mask, PreparedHitFields)
+
+# Thresholds of each configuration (steps which are not set are DEFAULT_THRESHOLDS)
+CONFIGS = {
+    "fixed": {},
+    "otsu": {step: ThresholdSettings('otsu') for step in ['name', 'damage', 'boss']},
+    "adaptive": {step: ThresholdSettings('adaptive', 0, 31, -20) for step in ['name', 'damage', 'boss']},
+    "auto": {step: settings._replace(method='auto') for step, settings in DEFAULT_THRESHOLDS.items()},
+}
+
+
+def jpeg(img, quality):
+    return cv2.imdecode(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1], cv2.IMREAD_COLOR)
+
+
+# How screenshots are changed
+CHANGES = {
+    "original": lambda img: img,
+    "darker": lambda img: cv2.convertScaleAbs(img, alpha=0.7),
+    "brighter": lambda img: cv2.convertScaleAbs(img, alpha=0.9, beta=30),
+    "low contrast": lambda img: cv2.convertScaleAbs(img, alpha=0.6, beta=50),
+    "jpeg q30": lambda img: jpeg(img, 30),
+}
+
+
+def prepare(img, crop_rects, config, calibration):
+    """Hit boxes and PreparedHitFields of a screenshot as recognize_screenshot finds them"""
+    window = crop_rects.hits_window.crop(img)
+    gray = cv2.cvtColor(window, cv2.COLOR_BGR2GRAY)
+    thresholds = calibration.thresholds(crop_rects.name, dict(DEFAULT_THRESHOLDS, **config), gray)
+    hit_rects = crop_rects.hit_image
+    boxes = sorted(find_hit_boxes(window, hit_rects.min_width, hit_rects.min_height, debug=0, gray=gray,
+                                  threshold=thresholds['boxes']), key=lambda box: box.y)
+    return boxes, prepare_hit_fields(gray, boxes, hit_rects, thresholds=thresholds)
+
+
+def whole_window_fields(img, crop_rects):
+    """Fields prepared with default thresholds applied to the whole hits window"""
+    window = crop_rects.hits_window.crop(img)
+    gray = cv2.cvtColor(window, cv2.COLOR_BGR2GRAY)
+    hit_rects = crop_rects.hit_image
+    boxes = find_hit_boxes(window, hit_rects.min_width, hit_rects.min_height, debug=0, gray=gray)
+    inverted_mask = cv2.threshold(gray, 160, 255, cv2.THRESH_BINARY_INV)[1]
+    only_name_mask = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY)[1]
+    return [PreparedHitFields(name=prepare_name_from_mask(box_region(gray, box, hit_rects.name_rect),
+                                                          box_region(only_name_mask, box, hit_rects.name_rect)),
+                              damage=box_region(inverted_mask, box, hit_rects.damage_rect),
+                              boss=box_region(inverted_mask, box, hit_rects.lvBoss_rect)
+                              if hit_rects.lvBoss_rect else None)
+            for box in boxes]
+
+
+def slice_fields(img, crop_rects):
+    """Fields prepared with default thresholds applied to field slices (as prepare_hit_fields does)"""
+    window = crop_rects.hits_window.crop(img)
+    gray = cv2.cvtColor(window, cv2.COLOR_BGR2GRAY)
+    hit_rects = crop_rects.hit_image
+    boxes = find_hit_boxes(window, hit_rects.min_width, hit_rects.min_height, debug=0, gray=gray)
+    return prepare_hit_fields(gray, boxes, hit_rects)
+
+
+def score(screenshots, config, glyph_bank, use_ocr):
+    """(screenshots with all boxes, glyphs right, glyphs wrong, OCR names right, OCR damages right, CPU ms)"""
+    calibration = ThresholdCalibration()
+    counts = [0, 0, 0, 0, 0]
+    times = []
+    for img, crop_rects, expected_hits in screenshots:
+        start = time.process_time()
+        boxes, prepared = prepare(img, crop_rects, config, calibration)
+        times.append((time.process_time() - start) * 1000)
+        counts[0] += len(boxes) == len(expected_hits)
+        for fields, expected in zip(prepared, expected_hits):
+            expected_damage = f"{int(expected['damage']):,}"
+            reading = glyph_bank.read(fields.damage)
+            if reading.confident:
+                counts[1 if reading.text == expected_damage else 2] += 1
+            if use_ocr:
+                counts[3] += ocr_name(fields.name) == str(expected['name'])
+                counts[4] += ocr_damage(fields.damage) == expected_damage
+    return counts + [statistics.mean(times)]
+
+
+def measure(function, screenshots, repeat):
+    """Returns (mean CPU ms per screenshot, mean peak KB per screenshot)"""
+    times = []
+    peaks = []
+    for img, crop_rects, _ in screenshots:
+        start = time.process_time()
+        for _ in range(repeat):
+            function(img, crop_rects)
+        times.append((time.process_time() - start) / repeat * 1000)
+
+        tracemalloc.start()
+        function(img, crop_rects)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+    return statistics.mean(times), statistics.mean(peaks)
+
+
+if __name__ == "__main__":
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--glyphs", default=os.path.join(root_dir, "gallery", "damage_glyphs.npz"), help="Glyph bank")
+    parser.add_argument("--truth", default=os.path.join(root_dir, "benchmarks", "ground_truth.yaml"),
+                        help="Ground truth file")
+    parser.add_argument("-t", "--tesseract", default="", help="Full path to tesseract executable to recognize "
+                                                              "names and damages (default - don't)")
+    parser.add_argument("-n", "--repeat", type=int, default=20, help="How many times to prepare each screenshot "
+                                                                     "for the memory comparison")
+    args = parser.parse_args()
+
+    if args.tesseract:
+        pytesseract.pytesseract.tesseract_cmd = args.tesseract
+    with open(args.truth, encoding="utf-8") as truth_file:
+        truth = yaml.safe_load(truth_file)
+    dimensions_file = DimensionsFile(os.path.join(root_dir, 'dimensions.yaml'))
+    glyph_bank = GlyphBank.load(args.glyphs)
+
+    originals = []
+    for truth_key, expected_hits in truth.items():
+        img = cv2.imread(os.path.join(root_dir, "test_images", *truth_key.split("/")))
+        originals.append((img, dimensions_file.get_crop_rects(img), expected_hits))
+    total_hits = sum(len(expected_hits) for _, _, expected_hits in originals)
+
+    results = []
+    for change_name, change in CHANGES.items():
+        screenshots = [(change(img), crop_rects, expected_hits) for img, crop_rects, expected_hits in originals]
+        for config_name, config in CONFIGS.items():
+            results.append((change_name, config_name, score(screenshots, config, glyph_bank, bool(args.tesseract))))
+
+    masks = {name: measure(function, originals, args.repeat) for name, function in [("whole window",
+                                                                                     whole_window_fields),
+                                                                                    ("field slices", slice_fields)]}
+    mismatches = sum(not np.array_equal(old, new)
+                     for img, crop_rects, _ in originals
+                     for old_fields, new_fields in zip(whole_window_fields(img, crop_rects),
+                                                       slice_fields(img, crop_rects))
+                     for old, new in zip(old_fields, new_fields))
+
+    print("\n=====================================")
+    print(f"{len(originals)} screenshots, {total_hits} hits")
+    print(f"{'change':<14}{'config':<10}{'all boxes':>10}{'glyphs ok':>11}{'wrong':>7}"
+          f"{'OCR names':>11}{'OCR damages':>13}{'CPU ms':>8}")
+    for change_name, config_name, (boxes, right, wrong, names, damages, cpu_ms) in results:
+        ocr = f"{names:>11}{damages:>13}" if args.tesseract else f"{'-':>11}{'-':>13}"
+        print(f"{change_name:<14}{config_name:<10}{boxes:>10}{right:>11}{wrong:>7}{ocr}{cpu_ms:>8.2f}")
+    print("(all boxes - screenshots with all hit boxes found, glyphs ok / wrong - damages read by glyph templates")
+    print(" confidently right / wrong, CPU ms - finding boxes and preparing fields of a screenshot)")
+    print(f"\nDefault thresholds, prepared images which differ: {mismatches}")
+    print(f"{'masks of':<14}{'CPU ms/screenshot':>20}{'peak KB/screenshot':>20}")
+    for name, (cpu_ms, peak_kb) in masks.items():
+        print(f"{name:<14}{cpu_ms:>20.2f}{peak_kb:>20.0f}")
@@ -0,0 +1,114 @@
+"""
+Damage reading by glyph templates (gtraid/digit_reader.py) against the ground truth
+
+Usage:
+    python benchmarks/bench_digit_reader.py
+    python benchmarks/bench_digit_reader.py -t /usr/bin/tesseract --glyphs gallery/damage_glyphs.npz
+
+Damage images of all screenshots of benchmarks/ground_truth.yaml are prepared the way recognize_screenshot
+prepares them (hit boxes from the top to the bottom) and labeled by the ground truth.
+
+Reported:
+- the bank (--glyphs) on all damages: right and confident, right but not confident (sent to OCR),
+  wrong and confident (wrong damage in the results), and the lowest glyph confidences
+- holdout: a bank made of every other screenshot and tested on the other screenshots
+- latency (median of --repeat runs) of reading one damage and of OCR of it (with -t)
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+import pytesseract
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid import DimensionsFile
+from gtraid.digit_reader import GlyphBank
+from gtraid.image_reco import find_hit_boxes, ocr_damage, prepare_hit_fields
+
+
+def latency(function, repeat):
+    """Median time of function calls, ms"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def damage_fields(truth, test_images_dir, dimensions_file):
+    """[(screenshot, [(prepared damage image, expected text like "6,603,170")])] of the ground truth screenshots"""
+    screenshots = []
+    for truth_key, expected_hits in truth.items():
+        img = cv2.imread(os.path.join(test_images_dir, *truth_key.split("/")))
+        crop_rects = dimensions_file.get_crop_rects(img)
+        window = crop_rects.hits_window.crop(img)
+        window_gray = cv2.cvtColor(window, cv2.COLOR_BGR2GRAY)
+        hit_rects = crop_rects.hit_image
+        boxes = sorted(find_hit_boxes(window, hit_rects.min_width, hit_rects.min_height, debug=0, gray=window_gray),
+                       key=lambda box: box.y)
+        screenshots.append((truth_key, [(fields.damage, f"{int(expected['damage']):,}") for fields, expected
+                                        in zip(prepare_hit_fields(window_gray, boxes, hit_rects), expected_hits)]))
+    return screenshots
+
+
+def score(glyph_bank, fields):
+    """(right and confident, right not confident, wrong and confident, wrong not confident, glyph confidences)"""
+    counts = [0, 0, 0, 0]
+    confidences = []
+    for damage_img, expected in fields:
+        reading = glyph_bank.read(damage_img)
+        counts[(reading.text != expected) * 2 + (not reading.confident)] += 1
+        confidences.extend(reading.confidences)
+    return counts, confidences
+
+
+if __name__ == "__main__":
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--glyphs", default=os.path.join(root_dir, "gallery", "damage_glyphs.npz"), help="Glyph bank")
+    parser.add_argument("--truth", default=os.path.join(root_dir, "benchmarks", "ground_truth.yaml"),
+                        help="Ground truth file")
+    parser.add_argument("-t", "--tesseract", default="", help="Full path to tesseract executable to time OCR "
+                                                              "of damage (default - don't)")
+    parser.add_argument("--repeat", type=int, default=200, help="Number of runs of each read")
+    args = parser.parse_args()
+
+    with open(args.truth, encoding="utf-8") as truth_file:
+        truth = yaml.safe_load(truth_file)
+    dimensions_file = DimensionsFile(os.path.join(root_dir, 'dimensions.yaml'))
+    screenshots = damage_fields(truth, os.path.join(root_dir, "test_images"), dimensions_file)
+    all_fields = [field for _, fields in screenshots for field in fields]
+
+    glyph_bank = GlyphBank.load(args.glyphs)
+    holdout_bank = GlyphBank()
+    for damage_img, expected in [field for _, fields in screenshots[::2] for field in fields]:
+        holdout_bank.add(damage_img, expected)
+    results = [("bank", len(glyph_bank), score(glyph_bank, all_fields)),
+               ("holdout", len(holdout_bank), score(holdout_bank, [field for _, fields in screenshots[1::2]
+                                                                   for field in fields]))]
+
+    damage_img = all_fields[0][0]
+    timings = [("read one damage", latency(lambda: glyph_bank.read(damage_img), args.repeat))]
+    if args.tesseract:
+        pytesseract.pytesseract.tesseract_cmd = args.tesseract
+        timings.append(("OCR of one damage", latency(lambda: ocr_damage(damage_img), max(args.repeat // 20, 3))))
+
+    print("\n=====================================")
+    print(f"{len(all_fields)} damages of {len(screenshots)} screenshots")
+    print(f"{'':<10}{'templates':>10}{'right':>8}{'to OCR':>8}{'wrong':>8}{'wrong, OCR':>12}"
+          f"{'min conf':>10}{'p1 conf':>9}")
+    for title, templates, (counts, confidences) in results:
+        print(f"{title:<10}{templates:>10}{counts[0]:>8}{counts[1]:>8}{counts[2]:>8}{counts[3]:>12}"
+              f"{min(confidences):>10.3f}{np.percentile(confidences, 1):>9.3f}")
+    print("(right - right and confident, to OCR - right but not confident, wrong - wrong and confident,")
+    print(" wrong, OCR - wrong and not confident, so OCR recognizes it)")
+    for title, milliseconds in timings:
+        print(f"{title:<24}{milliseconds:>10.3f} ms")
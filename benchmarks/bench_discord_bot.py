@@ -0,0 +1,166 @@
+"""
+Discord bot under a burst of uploads, without network (gtraid/discord_bot.py)
+
+Usage:
+    python benchmarks/bench_discord_bot.py -t /usr/bin/tesseract -j 4
+    python benchmarks/bench_discord_bot.py -t /usr/bin/tesseract --officers 30 --screenshots 200 --max-pending 100
+
+Officers of a few guilds post screenshots of test_images at the same moment, up to 10 attachments
+per message (the Discord limit). Messages and attachments are fakes with the same interface as
+discord.Message and discord.Attachment: save() copies the file after a download delay, reply() records
+the time of the reply. ScreenshotIngestor gets the messages as RaidBot.on_message does.
+
+Reported: time until all replies, screenshots/s, rejected messages, when the last reply of each guild
+came, and event loop lag (delay of a 10 ms ticker) - how responsive the bot stays while recognizing.
+With --kill-worker a recognition process is killed after this number of seconds: the bot restarts
+the pool and recognizes the screenshots of the dead pool again, so nothing should fail.
+"""
+import argparse
+import asyncio
+import glob
+import logging
+import os
+import random
+import shutil
+import signal
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid.discord_bot import BotOptions, create_ingestor
+from gtraid.output import create_output
+from gtraid.pipeline import PipelineOptions
+
+# Discord limit of attachments in a message
+MAX_ATTACHMENTS = 10
+
+
+class FakeAttachment:
+    """discord.Attachment: save() copies a local file after a download delay"""
+
+    def __init__(self, source, download_delay):
+        self.source = source
+        self.filename = os.path.basename(source)
+        self.size = os.path.getsize(source)
+        self.content_type = "image/png" if source.endswith(".png") else "image/jpeg"
+        self.download_delay = download_delay
+
+    async def save(self, file_name):
+        await asyncio.sleep(self.download_delay)
+        await asyncio.to_thread(shutil.copyfile, self.source, file_name)
+
+
+class FakeMessage:
+    """discord.Message: reply() records the text and the time"""
+
+    def __init__(self, message_id, guild_id, officer, attachments):
+        self.id = message_id
+        self.guild = SimpleNamespace(id=guild_id)
+        self.channel = SimpleNamespace(id=guild_id * 100)
+        self.author = SimpleNamespace(bot=False, name=officer)
+        self.attachments = attachments
+        self.replies = []
+
+    async def reply(self, text):
+        self.replies.append((time.perf_counter(), text))
+
+
+async def measure_lag(lags, interval=0.01):
+    """Event loop lag: how late a ticker wakes up"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - start - interval) * 1000)
+
+
+async def kill_worker(ingestor, delay):
+    """Kills a recognition process of the ingestor pool after delay seconds (as out of memory would)"""
+    await asyncio.sleep(delay)
+    pid = next(iter(ingestor.executor._processes))
+    os.kill(pid, signal.SIGKILL)
+
+
+async def simulate(ingestor, messages, kill_delay=None):
+    lags = []
+    lag_task = asyncio.create_task(measure_lag(lags))
+    kill_task = asyncio.create_task(kill_worker(ingestor, kill_delay)) if kill_delay is not None else None
+    start = time.perf_counter()
+    results = await asyncio.gather(*(ingestor.handle_message(message) for message in messages))
+    elapsed = time.perf_counter() - start
+    lag_task.cancel()
+    if kill_task:
+        await kill_task
+    return start, elapsed, results, lags
+
+
+if __name__ == "__main__":
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='*', help="Screenshot files (default: test_images/2021-06-06 and rock)")
+    parser.add_argument("-t", "--tesseract", default="tesseract", help="Full path to tesseract executable")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="Number of recognition processes")
+    parser.add_argument("--officers", type=int, default=30, help="Number of officers posting at once")
+    parser.add_argument("--guilds", type=int, default=3, help="Number of guilds (servers) of the officers")
+    parser.add_argument("--screenshots", type=int, default=200, help="Number of screenshots of all officers")
+    parser.add_argument("--max-pending", type=int, default=500, help="BotOptions.max_pending")
+    parser.add_argument("--per-guild", type=int, default=0, help="BotOptions.per_guild (0 - as many as --jobs)")
+    parser.add_argument("--download-delay", type=float, default=0.2, help="Seconds to download an attachment")
+    parser.add_argument("--kill-worker", type=float, default=None,
+                        help="Kill a recognition process after this number of seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR, format="%(message)s")
+    random.seed(args.seed)
+
+    sources = []
+    for user_input in args.inputs or [os.path.join(root_dir, "test_images", "2021-06-06", "*"),
+                                      os.path.join(root_dir, "test_images", "rock", "*")]:
+        sources.extend(sorted(glob.glob(user_input)))
+
+    # Screenshots of each officer are split to messages of up to 10 attachments
+    messages = []
+    per_officer = [args.screenshots // args.officers + (officer < args.screenshots % args.officers)
+                   for officer in range(args.officers)]
+    for officer, count in enumerate(per_officer):
+        screenshots = [random.choice(sources) for _ in range(count)]
+        for start in range(0, count, MAX_ATTACHMENTS):
+            attachments = [FakeAttachment(source, args.download_delay)
+                           for source in screenshots[start:start + MAX_ATTACHMENTS]]
+            messages.append(FakeMessage(len(messages) + 1, officer % args.guilds + 1, f"officer{officer}", attachments))
+    random.shuffle(messages)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output = create_output("jsonl", os.path.join(temp_dir, "hits.jsonl"))
+        try:
+            ingestor = create_ingestor(args.tesseract, os.path.join(root_dir, "dimensions.yaml"), [output],
+                                       BotOptions(inbox_dir=os.path.join(temp_dir, "inbox"), jobs=args.jobs,
+                                                  max_pending=args.max_pending, per_guild=args.per_guild),
+                                       PipelineOptions(report_dir="", thumbnails=False), log_level=logging.ERROR)
+        except OSError as ex:
+            parser.error(f"can't run tesseract '{args.tesseract}': {ex}")
+        start, elapsed, results, lags = asyncio.run(simulate(ingestor, messages, args.kill_worker))
+        ingestor.close()
+
+    print("\n=====================================")
+    screenshots = ingestor.stats["screenshots"]
+    print(f"Messages: {len(messages)} from {args.officers} officers of {args.guilds} guilds, "
+          f"screenshots: {sum(len(message.attachments) for message in messages)}, jobs: {args.jobs}")
+    print(f"All replies in {elapsed:.1f} s, recognized {screenshots} screenshots ({screenshots / elapsed:.2f}/s), "
+          f"{ingestor.stats['hits']} hits, {ingestor.stats['failed']} failed, "
+          f"{ingestor.stats['pool_restarts']} pool restarts")
+    print(f"Rejected messages: {ingestor.stats['rejected']} (max pending {args.max_pending})")
+    for guild_id in range(1, args.guilds + 1):
+        reply_times = [message.replies[-1][0] - start for message in messages
+                       if message.guild.id == guild_id and message.replies]
+        if reply_times:
+            print(f"Guild {guild_id}: first reply {min(reply_times):.1f} s, last reply {max(reply_times):.1f} s")
+    if lags:
+        lags.sort()
+        print(f"Event loop lag, ms: median={statistics.median(lags):.1f} p99={lags[int(len(lags) * 0.99)]:.1f} "
+              f"max={lags[-1]:.1f}")
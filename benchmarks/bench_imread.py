@@ -0,0 +1,108 @@
+"""
+Ways to read screenshots: time and memory (gtraid/image_io.py)
+
+Usage:
+    python benchmarks/bench_imread.py
+    python benchmarks/bench_imread.py test_images/rock/* --repeat 20
+
+For each screenshot (median of --repeat reads):
+- header      - read_image_size: size from the PNG/JPEG header, enough to find crop parameters
+- cv2         - cv2.imread of the whole screenshot (what the pipeline does)
+- pillow      - Pillow decode of the whole screenshot
+- pillow rows - Pillow decode of the rows down to the bottom of the hits window (PNG only: the decoder is
+                stopped there). Rows above the window still have to be decoded
+- cv2 1/2     - cv2.IMREAD_REDUCED_COLOR_2: JPEG is decoded at half size (DCT scaling). For reference only,
+                text is too small for OCR at this size
+
+Memory: the decoded screenshot and the copy of the hits window which the pipeline keeps instead of it
+during recognition (when report and debug images are off).
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid import DimensionsFile
+from gtraid.image_io import read_image_size
+
+
+def timed_median(function, repeat):
+    """Median time of function calls, ms"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def pillow_decode(file_name):
+    from PIL import Image
+    with Image.open(file_name) as img:
+        return np.asarray(img.convert("RGB"))
+
+
+def pillow_decode_rows(file_name, rows):
+    """Decodes rows of the image from the top (PNG): the decoder tile is cut, so decoding stops after rows"""
+    from PIL import Image
+    with Image.open(file_name) as img:
+        codec, extents, offset, args = img.tile[0]
+        img.tile = [(codec, (0, 0, img.width, rows), offset, args)]
+        img._size = (img.width, rows)
+        return np.asarray(img.convert("RGB"))
+
+
+if __name__ == "__main__":
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='*', help="Screenshot files (default: test_images/2021-06-06, rock and "
+                                                  "GT_Alter_Raid_6-1-phone-SS)")
+    parser.add_argument("--repeat", type=int, default=10, help="Number of reads of each file")
+    args = parser.parse_args()
+
+    dimensions_file = DimensionsFile(os.path.join(root_dir, 'dimensions.yaml'))
+    files = []
+    for user_input in args.inputs or [os.path.join(root_dir, "test_images", folder, "*")
+                                      for folder in ["2021-06-06", "rock", "GT_Alter_Raid_6-1-phone-SS"]]:
+        files.extend(sorted(glob.glob(user_input)))
+
+    rows = []           # (format, resolution, header, cv2, pillow, pillow rows, cv2 1/2, screenshot MB, window MB)
+    for file_name in files:
+        size = read_image_size(file_name)
+        crop_rects = dimensions_file.get_dimensions(*size) if size else None
+        if crop_rects is None:
+            continue
+        window = crop_rects.hits_window
+        is_png = file_name.lower().endswith(".png")
+        img = cv2.imread(file_name)
+        rows.append(("PNG" if is_png else "JPEG", crop_rects.name,
+                     timed_median(lambda: read_image_size(file_name), args.repeat),
+                     timed_median(lambda: cv2.imread(file_name), args.repeat),
+                     timed_median(lambda: pillow_decode(file_name), args.repeat),
+                     timed_median(lambda: pillow_decode_rows(file_name, window.y_end), args.repeat) if is_png else None,
+                     timed_median(lambda: cv2.imread(file_name, cv2.IMREAD_REDUCED_COLOR_2), args.repeat)
+                     if not is_png else None,
+                     img.nbytes / 1024 / 1024, window.crop(img).copy().nbytes / 1024 / 1024,
+                     window.y_end / img.shape[0]))
+
+    print("\n=====================================")
+    print("Median read time of a screenshot, ms, and memory, MB")
+    print(f"{'format':<7}{'resolution':<12}{'files':>6}{'header':>8}{'cv2':>8}{'pillow':>8}{'pil rows':>10}"
+          f"{'cv2 1/2':>9}{'screenshot':>12}{'window':>8}{'rows':>6}")
+    for key in sorted({(row[0], row[1]) for row in rows}):
+        group = [row for row in rows if (row[0], row[1]) == key]
+
+        def mean(index):
+            values = [row[index] for row in group if row[index] is not None]
+            return f"{statistics.mean(values):.2f}" if values else "-"
+        print(f"{key[0]:<7}{key[1]:<12}{len(group):>6}{mean(2):>8}{mean(3):>8}{mean(4):>8}{mean(5):>10}{mean(6):>9}"
+              f"{mean(7):>12}{mean(8):>8}{float(mean(9)):>6.0%}")
+    print("(rows - part of screenshot rows down to the bottom of the hits window)")
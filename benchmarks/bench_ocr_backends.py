@@ -0,0 +1,102 @@
+"""
+Micro-benchmark of OCR backends: per-field (name, damage, boss) latency
+
+Usage:
+    python benchmarks/bench_ocr_backends.py -t /usr/bin/tesseract test_images/2021-06-06/*
+
+Field images are cropped and prepared once, then every backend recognizes the same images.
+Backends which can't be created (e.g. tesserocr is not installed) are skipped.
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import pytesseract
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid import DimensionsFile
+from gtraid.image_reco import crop_hits_window, find_hits, crop_hit_image, prepare_name, prepare_damage, prepare_boss
+from gtraid.ocr_backend import ocr_backend_names, create_ocr_backend
+
+FIELDS = ["name", "damage", "boss"]
+
+
+def prepare_fields(img, crop_rects):
+    """Returns {field: [prepared images]} for all hits of the screenshot"""
+    fields = {field: [] for field in FIELDS}
+    raid_hits_img = crop_hits_window(img, crop_rects.hits_window.corners, debug=0)
+    hit_rects = crop_rects.hit_image
+    lvBoss_rect = hit_rects.lvBoss_rect.corners if hit_rects.lvBoss_rect else None
+    for index, hit_image in enumerate(find_hits(raid_hits_img, hit_rects.min_width, hit_rects.min_height, debug=0)):
+        name_img, party_img, boss_img, damage_img, lvBoss_img = crop_hit_image(
+            hit_image, index, hit_rects.name_rect.corners, hit_rects.party_rect.corners,
+            hit_rects.damage_rect.corners, hit_rects.boss_rect.corners, lvBoss_rect)
+        fields["name"].append(prepare_name(name_img))
+        fields["damage"].append(cv2.cvtColor(prepare_damage(damage_img), cv2.COLOR_GRAY2RGB))
+        if lvBoss_img is not None:
+            fields["boss"].append(cv2.cvtColor(prepare_boss(lvBoss_img), cv2.COLOR_GRAY2RGB))
+    return fields
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='+', help="Screenshot files (wildcards allowed)")
+    parser.add_argument("-t", "--tesseract", default="tesseract", help="Full path to tesseract executable")
+    parser.add_argument("-n", "--repeat", type=int, default=1, help="How many times to recognize each image")
+    args = parser.parse_args()
+
+    pytesseract.pytesseract.tesseract_cmd = args.tesseract
+
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+    dimensions_file = DimensionsFile(os.path.join(root_dir, 'dimensions.yaml'))
+
+    field_images = {field: [] for field in FIELDS}
+    for user_input in args.inputs:
+        for file_name in glob.glob(user_input):
+            img = cv2.imread(file_name)
+            if img is None:
+                continue
+            for field, images in prepare_fields(img, dimensions_file.get_crop_rects(img)).items():
+                field_images[field].extend(images)
+
+    results = {}
+    for backend_name in ocr_backend_names:
+        try:
+            backend = create_ocr_backend(backend_name, args.tesseract)
+        except Exception as ex:
+            print(f"Skipping backend '{backend_name}': {ex}")
+            continue
+
+        # The first call may load traineddata. Measure it separately
+        start = time.perf_counter()
+        for field in FIELDS:
+            if field_images[field]:
+                backend.image_to_string(field_images[field][0], field)
+        warmup = time.perf_counter() - start
+
+        latencies = {}
+        for field in FIELDS:
+            latencies[field] = []
+            for _ in range(args.repeat):
+                for img in field_images[field]:
+                    start = time.perf_counter()
+                    backend.image_to_string(img, field)
+                    latencies[field].append(time.perf_counter() - start)
+        results[backend_name] = (warmup, latencies)
+
+    print("\n=====================================")
+    print(f"Field images: " + ", ".join(f"{field}={len(field_images[field])}" for field in FIELDS))
+    print(f"{'backend':<14}{'field':<8}{'mean, ms':>10}{'median, ms':>12}{'max, ms':>10}")
+    for backend_name, (warmup, latencies) in results.items():
+        for field in FIELDS:
+            if not latencies[field]:
+                continue
+            values = [value * 1000 for value in latencies[field]]
+            print(f"{backend_name:<14}{field:<8}{statistics.mean(values):>10.1f}"
+                  f"{statistics.median(values):>12.1f}{max(values):>10.1f}")
+        print(f"{backend_name:<14}{'warmup':<8}{warmup * 1000:>10.1f}")
@@ -0,0 +1,86 @@
+"""
+OCR memo (gtraid/ocr_memo.py) on damages which differ by one digit
+
+Usage:
+    python benchmarks/bench_ocr_memo.py
+
+Damage crops of benchmarks/ground_truth.yaml are changed by replacing a glyph with another glyph of
+the same width (another digit, the damage is different), the original crop is added to an OcrMemo
+and the changed one is looked up. The check fails (exit code 1) if any changed damage gets the text
+of the original.
+
+Also reported: how many of the changed damages the pixel check alone (MAX_PIXEL_DIFFERENCE) would
+take for the original, and the hit rate of name and boss lookups over all screenshots.
+"""
+import argparse
+import itertools
+import os
+import sys
+
+import cv2
+import numpy as np
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid import DimensionsFile
+from gtraid.digit_reader import segment_glyphs
+from gtraid.image_reco import find_hit_boxes, prepare_hit_fields
+from gtraid.ocr_memo import binarize, MAX_PIXEL_DIFFERENCE, OcrMemo
+
+
+def one_digit_changes(mask):
+    """Damage images with one glyph replaced by another glyph of the same width (which is different)"""
+    glyphs, _ = segment_glyphs(mask)
+    for (x0, x1), (other_x0, other_x1) in itertools.permutations(glyphs, 2):
+        if x1 - x0 == other_x1 - other_x0:
+            changed = mask.copy()
+            changed[:, x0:x1] = mask[:, other_x0:other_x1]
+            if not np.array_equal(changed, mask):
+                yield changed
+
+
+if __name__ == "__main__":
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--truth", default=os.path.join(root_dir, "benchmarks", "ground_truth.yaml"),
+                        help="Ground truth file")
+    args = parser.parse_args()
+
+    with open(args.truth, encoding="utf-8") as truth_file:
+        truth = yaml.safe_load(truth_file)
+    dimensions_file = DimensionsFile(os.path.join(root_dir, 'dimensions.yaml'))
+
+    memo = OcrMemo()
+    changes = wrong_reuses = pixel_matches = 0
+    for truth_key, expected_hits in truth.items():
+        img = cv2.imread(os.path.join(root_dir, "test_images", *truth_key.split("/")))
+        crop_rects = dimensions_file.get_crop_rects(img)
+        window = crop_rects.hits_window.crop(img)
+        gray = cv2.cvtColor(window, cv2.COLOR_BGR2GRAY)
+        hit_rects = crop_rects.hit_image
+        boxes = sorted(find_hit_boxes(window, hit_rects.min_width, hit_rects.min_height, debug=0, gray=gray),
+                       key=lambda box: box.y)
+        for fields, expected in zip(prepare_hit_fields(gray, boxes, hit_rects), expected_hits):
+            for field, text in [("name", str(expected['name'])), ("boss", str(expected.get('boss')))]:
+                img_field = getattr(fields, field)
+                if img_field is not None and memo.lookup(field, img_field) is None:
+                    memo.add(field, img_field, text)
+
+            damage_memo = OcrMemo()
+            damage_memo.add("damage", fields.damage, str(expected['damage']))
+            original = binarize(fields.damage)
+            for changed in one_digit_changes(fields.damage):
+                changes += 1
+                wrong_reuses += damage_memo.lookup("damage", changed) is not None
+                pixel_matches += (binarize(changed) != original).sum() <= MAX_PIXEL_DIFFERENCE * original.size
+
+    print("\n=====================================")
+    print(f"{changes} damages changed by one digit")
+    print(f"given the text of the original damage: {wrong_reuses}")
+    print(f"within MAX_PIXEL_DIFFERENCE of the original: {pixel_matches} ({pixel_matches / max(changes, 1):.0%})")
+    print(f"names and bosses: {memo.stats}")
+    if wrong_reuses:
+        print("FAILED: a different damage reuses the OCR result of a remembered one")
+        sys.exit(1)
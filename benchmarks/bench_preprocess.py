@@ -0,0 +1,120 @@
+"""
+Compares preprocessing of hits (everything before OCR) per hit vs batched for all hits of a screenshot
+
+Usage:
+    python benchmarks/bench_preprocess.py test_images/2021-06-06/*
+
+per-hit - the way it was done before: the whole screenshot is copied for the debug image, every hit image
+          is copied to draw crop rectangles, every field is converted to grayscale and thresholded separately
+batched - the hits window is converted to grayscale once, thresholds are applied to it once
+          and field images are slices of it (prepare_hit_fields). Debug images are not made
+
+Reports CPU time and peak memory allocated (tracemalloc) per screenshot and checks that
+prepared name, damage and boss images are the same.
+"""
+import argparse
+import glob
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid import DimensionsFile
+from gtraid.image_reco import (crop_hits_window, find_hits, find_hit_boxes, crop_hit_image, prepare_name,
+                               prepare_damage, prepare_boss, prepare_hit_fields)
+
+
+def per_hit(img, crop_rects):
+    """Preprocessing as it was done before batching. Returns [(name, damage, boss)] prepared images"""
+    window_rect = crop_rects.hits_window.corners
+    cv2.rectangle(img.copy(), window_rect[0], window_rect[1], (255, 0, 0), 2)     # debug image
+    raid_hits_img = crop_hits_window(img, window_rect, debug=0)
+    hit_rects = crop_rects.hit_image
+    prepared = []
+    for index, hit_image in enumerate(find_hits(raid_hits_img, hit_rects.min_width, hit_rects.min_height, debug=0)):
+        rects = [getattr(hit_rects, key).corners for key in ["name_rect", "party_rect", "damage_rect", "boss_rect",
+                                                               "lvBoss_rect"]]
+        debug_image = hit_image.copy()
+        for start, end in rects:
+            cv2.rectangle(debug_image, start, end, (255, 0, 0), 2)
+        name_img, party_img, boss_img, damage_img, lvBoss_img = crop_hit_image(hit_image, index, *rects)
+        prepared.append((prepare_name(name_img), prepare_damage(damage_img), prepare_boss(lvBoss_img)))
+    return prepared
+
+
+def batched(img, crop_rects):
+    """Preprocessing as in recognize_screenshot. Returns [(name, damage, boss)] prepared images"""
+    raid_hits_img = crop_hits_window(img, crop_rects.hits_window.corners, debug=0)
+    raid_hits_gray = cv2.cvtColor(raid_hits_img, cv2.COLOR_BGR2GRAY)
+    hit_rects = crop_rects.hit_image
+    hit_boxes = find_hit_boxes(raid_hits_img, hit_rects.min_width, hit_rects.min_height, debug=0,
+                               gray=raid_hits_gray)
+    rects = [getattr(hit_rects, key).corners for key in ["name_rect", "party_rect", "damage_rect", "boss_rect",
+                                                           "lvBoss_rect"]]
+    for index, box in enumerate(hit_boxes):
+        crop_hit_image(raid_hits_img[box.y:box.y + box.height, box.x:box.x + box.width], index, *rects)
+    return [tuple(fields) for fields in prepare_hit_fields(raid_hits_gray, hit_boxes, hit_rects)]
+
+
+def measure(function, images, repeat):
+    """Returns (mean ms per screenshot, mean peak KB per screenshot)"""
+    times = []
+    peaks = []
+    for img, crop_rects in images:
+        start = time.process_time()
+        for _ in range(repeat):
+            function(img, crop_rects)
+        times.append((time.process_time() - start) / repeat * 1000)
+
+        tracemalloc.start()
+        function(img, crop_rects)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+    return statistics.mean(times), statistics.mean(peaks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='+', help="Screenshot files (wildcards allowed)")
+    parser.add_argument("-n", "--repeat", type=int, default=20, help="How many times to process each screenshot")
+    args = parser.parse_args()
+
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+    dimensions_file = DimensionsFile(os.path.join(root_dir, 'dimensions.yaml'))
+
+    # Preprocessing functions log warnings for screenshots without hit boxes. Silence them
+    logging.disable(logging.WARNING)
+
+    images = []
+    for user_input in args.inputs:
+        for file_name in glob.glob(user_input):
+            img = cv2.imread(file_name)
+            if img is None:
+                continue
+            try:
+                crop_rects = dimensions_file.get_crop_rects(img)
+            except KeyError:
+                continue
+            if crop_rects.hit_image.lvBoss_rect is not None:     # Not all resolutions have it yet
+                images.append((img, crop_rects))
+
+    mismatches = 0
+    for img, crop_rects in images:
+        for old_fields, new_fields in zip(per_hit(img, crop_rects), batched(img, crop_rects)):
+            mismatches += sum(not np.array_equal(old, new) for old, new in zip(old_fields, new_fields))
+
+    results = {name: measure(function, images, args.repeat) for name, function in [("per-hit", per_hit),
+                                                                                    ("batched", batched)]}
+
+    print("\n=====================================")
+    print(f"Screenshots: {len(images)}, prepared images which differ: {mismatches}")
+    print(f"{'mode':<10}{'CPU ms/screenshot':>20}{'peak KB/screenshot':>20}")
+    for name, (cpu_ms, peak_kb) in results.items():
+        print(f"{name:<10}{cpu_ms:>20.2f}{peak_kb:>20.0f}")
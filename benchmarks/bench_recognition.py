@@ -0,0 +1,357 @@
+"""
+Accuracy and speed of screenshot recognition over test_images against the ground truth
+
+Usage:
+    python benchmarks/bench_recognition.py -t /usr/bin/tesseract -o before.json
+    python benchmarks/bench_recognition.py -t /usr/bin/tesseract -b -o after.json --baseline before.json
+
+Screenshots are listed in benchmarks/ground_truth.yaml (all of them by default, or give files
+and wildcards). Each screenshot is read and recognized by recognize_screenshot in this process,
+as gt.py does without --jobs. Recognized hits are compared with the ground truth from the top
+of the list to the bottom: name exactly, damage by its digits, boss without "Lv.80".
+
+Reported and saved to JSON (-o):
+- accuracy of each field, boxes found vs expected and mismatched fields
+- throughput (screenshots/s), latency of a screenshot (imread + recognition), time of each stage
+- OCR backend calls, field images sent to OCR, tesseract launches and OCR memo hits
+- confidence of fields: how many are below --min-confidence ("unsure") and how many wrong fields
+  are unsure (caught by the highlighting and --reocr) or sure. Fields recognized again with --reocr
+- peak RSS of the process
+
+With --baseline (JSON of a previous run) the run fails (exit code 1) if throughput drops by more
+than --max-slowdown, accuracy of a field drops by more than --max-accuracy-drop or peak memory
+grows by more than --max-memory-growth.
+"""
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import cv2
+import pytesseract
+import yaml
+
+try:
+    import resource
+except ImportError:        # Windows
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid import DimensionsFile, recognize_screenshot
+from gtraid.ocr_backend import OcrBackend, ocr_backend_names, set_ocr_backend, get_ocr_backend
+from gtraid.ocr_memo import OcrMemo, set_ocr_memo
+from gtraid.stage_timer import StageTimer, set_stage_timer, timed
+from gtraid.digit_reader import GlyphBank
+from gtraid.template_gallery import TemplateGallery
+from gtraid import reocr
+
+FIELDS = ("name", "damage", "boss")
+
+launches = 0
+_run_tesseract = pytesseract.pytesseract.run_tesseract
+
+
+def counting_run_tesseract(*args, **kwargs):
+    """Wraps pytesseract launcher to count tesseract process launches"""
+    global launches
+    launches += 1
+    return _run_tesseract(*args, **kwargs)
+
+
+class CountingOcrBackend(OcrBackend):
+    """Counts calls of the OCR backend and field images sent to it"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self.calls = 0
+        self.fields = 0
+
+    def image_to_string(self, img, field):
+        self.calls += 1
+        self.fields += 1
+        return self.backend.image_to_string(img, field)
+
+    def image_to_text(self, img, field, psm=None):
+        self.calls += 1
+        self.fields += 1
+        return self.backend.image_to_text(img, field, psm)
+
+    def batch_image_to_string(self, images, fields):
+        self.calls += 1
+        self.fields += len(images)
+        return self.backend.batch_image_to_string(images, fields)
+
+    def batch_image_to_text(self, images, fields):
+        self.calls += 1
+        self.fields += len(images)
+        return self.backend.batch_image_to_text(images, fields)
+
+
+def normalize(field, text):
+    """Recognized or expected value of a field in the form they are compared"""
+    text = " ".join(str(text or "").split())
+    if field == "damage":
+        return re.sub(r"\D", "", text)
+    if field == "boss":
+        return re.sub(r"^Lv\.?\s*\d*\s*", "", text)
+    return text
+
+
+def peak_rss_mb():
+    """Peak RSS of this process in MB (None if it is not known)"""
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024 / 1024 if sys.platform == "darwin" else peak_rss / 1024     # bytes on macOS, KB on linux
+
+
+def git_commit(root_dir):
+    """Current commit of the repository ("" if git is not available)"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def score(hit_records, expected_hits, truth_key, accuracy, mismatches, min_confidence):
+    """
+    Compares recognized hits of a screenshot with the ground truth (both from the top to the bottom)
+    and adds the results to accuracy and mismatches. Fields with confidence below min_confidence are unsure
+    """
+    recognized = sorted(hit_records, key=lambda hit: hit.box.y if hit.box is not None else 0)
+    accuracy["boxes"]["expected"] += len(expected_hits)
+    accuracy["boxes"]["found"] += len(recognized)
+    accuracy["boxes"]["screenshots_right"] += len(recognized) == len(expected_hits)
+    if len(recognized) != len(expected_hits):
+        mismatches.append({"file": truth_key, "hit": None, "field": "boxes",
+                           "expected": len(expected_hits), "recognized": len(recognized)})
+
+    for index, expected in enumerate(expected_hits):
+        hit = recognized[index] if index < len(recognized) else None
+        all_right = hit is not None
+        for field in FIELDS:
+            expected_value = normalize(field, expected[field])
+            recognized_value = normalize(field, getattr(hit, field)) if hit is not None else None
+            right = recognized_value == expected_value
+            accuracy[field]["total"] += 1
+            accuracy[field]["right"] += right
+            confidence = getattr(hit.confidence, field) if hit is not None and hit.confidence is not None else None
+            unsure = confidence is not None and confidence < min_confidence
+            accuracy[field]["unsure"] += unsure
+            accuracy[field]["unsure_wrong"] += unsure and not right
+            accuracy[field]["sure_wrong"] += not unsure and not right
+            all_right = all_right and right
+            if hit is not None and not right:
+                mismatches.append({"file": truth_key, "hit": index, "field": field,
+                                   "expected": expected_value, "recognized": recognized_value})
+        accuracy["hit"]["total"] += 1
+        accuracy["hit"]["right"] += all_right
+
+
+def run(files, truth, test_images_dir, dimensions_file, args):
+    """Recognizes all files args.repeat times. Returns (results for JSON, StageTimer)"""
+    backend = CountingOcrBackend(get_ocr_backend())
+    set_ocr_backend(backend)
+    memo = OcrMemo() if args.ocr_memo else None
+    set_ocr_memo(memo)
+    timer = StageTimer()
+    set_stage_timer(timer)
+    gallery = TemplateGallery(args.gallery) if args.gallery else None
+    glyph_bank = GlyphBank.load(args.glyphs) if args.glyphs else None
+
+    accuracy = {field: {"right": 0, "total": 0} for field in FIELDS + ("hit",)}
+    for field in FIELDS:
+        accuracy[field].update(unsure=0, unsure_wrong=0, sure_wrong=0)
+    accuracy["boxes"] = {"found": 0, "expected": 0, "screenshots_right": 0, "screenshots": 0}
+    mismatches = []
+    latencies = []
+    not_in_truth = set()
+
+    start = time.perf_counter()
+    for repeat in range(args.repeat):
+        for file_name in files:
+            file_start = time.perf_counter()
+            with timed("imread"):
+                img = cv2.imread(file_name)
+            if img is None:
+                logging.error("Can't read image: %s", file_name)
+                continue
+            result = recognize_screenshot(img, dimensions_file.get_crop_rects(img), name=file_name, debug=0,
+                                          batch_ocr=args.batch_ocr, gallery=gallery,
+                                          glyph_bank=glyph_bank, min_confidence=args.reocr, with_confidence=True)
+            latencies.append((time.perf_counter() - file_start) * 1000)
+
+            # Accuracy doesn't change between repeats (except with OCR memo), the first pass is scored
+            if repeat > 0:
+                continue
+            truth_key = os.path.relpath(os.path.abspath(file_name), test_images_dir).replace(os.sep, "/")
+            if truth_key not in truth:
+                not_in_truth.add(file_name)
+                continue
+            accuracy["boxes"]["screenshots"] += 1
+            score(result.hit_records, truth[truth_key], truth_key, accuracy, mismatches,
+                  args.reocr if args.reocr is not None else args.min_confidence)
+    wall_time = time.perf_counter() - start
+    set_stage_timer(None)
+
+    for field_accuracy in accuracy.values():
+        if "total" in field_accuracy:
+            field_accuracy["accuracy"] = round(field_accuracy["right"] / max(field_accuracy["total"], 1), 4)
+
+    latencies.sort()
+    results = {
+        "screenshots": len(latencies),
+        "not_in_ground_truth": sorted(not_in_truth),
+        "wall_time_s": round(wall_time, 3),
+        "screenshots_per_s": round(len(latencies) / wall_time, 3) if wall_time else 0,
+        "latency_ms": {"mean": round(statistics.mean(latencies), 2) if latencies else 0,
+                       "p50": round(latencies[len(latencies) // 2], 2) if latencies else 0,
+                       "p95": round(latencies[int(len(latencies) * 0.95)], 2) if latencies else 0,
+                       "max": round(latencies[-1], 2) if latencies else 0},
+        "ocr": {"backend_calls": backend.calls, "fields": backend.fields, "tesseract_launches": launches,
+                "memo_hits": memo.stats.hits if memo is not None else 0,
+                "reocr_fields": reocr.stats.fields, "reocr_improved": reocr.stats.improved,
+                "reocr_variants": reocr.stats.variants},
+        "peak_rss_mb": round(peak_rss_mb(), 1) if resource is not None else None,
+        "accuracy": accuracy,
+        "stages": timer.summary_dict(),
+        "mismatches": mismatches,
+    }
+    return results, timer
+
+
+def compare(results, baseline, args):
+    """
+    Checks results against the baseline run
+    :return: list of (check, baseline value, value, passed)
+    """
+    checks = []
+    base_speed, speed = baseline["screenshots_per_s"], results["screenshots_per_s"]
+    checks.append(("screenshots/s", base_speed, speed, speed >= base_speed * (1 - args.max_slowdown)))
+    for field in FIELDS + ("hit",):
+        base_value, value = baseline["accuracy"][field]["accuracy"], results["accuracy"][field]["accuracy"]
+        checks.append((f"{field} accuracy", base_value, value, value >= base_value - args.max_accuracy_drop))
+    base_memory, memory = baseline.get("peak_rss_mb"), results["peak_rss_mb"]
+    if base_memory is not None and memory is not None:
+        checks.append(("peak RSS, MB", base_memory, memory, memory <= base_memory * (1 + args.max_memory_growth)))
+    return checks
+
+
+if __name__ == "__main__":
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='*', help="Screenshot files (wildcards allowed). "
+                                                  "Default: all screenshots of the ground truth")
+    parser.add_argument("--truth", default=os.path.join(root_dir, "benchmarks", "ground_truth.yaml"),
+                        help="Ground truth file")
+    parser.add_argument("-t", "--tesseract", default="tesseract", help="Full path to tesseract executable")
+    parser.add_argument("--ocr", choices=ocr_backend_names, default="pytesseract", help="OCR backend")
+    parser.add_argument("-b", "--batch-ocr", action="store_true", help="Recognize all fields of a screenshot at once")
+    parser.add_argument("--no-ocr-memo", dest="ocr_memo", action="store_false",
+                        help="Don't reuse OCR results for near-identical field images")
+    parser.add_argument("--gallery", default="",
+                        help="Recognize bosses by reference images of this gallery config (gallery.yaml)")
+    parser.add_argument("--glyphs", default="",
+                        help="Read damage by glyph templates of this bank (gallery/damage_glyphs.npz)")
+    parser.add_argument("--min-confidence", type=float, default=reocr.MIN_CONFIDENCE,
+                        help="Fields with lower confidence are counted as unsure")
+    parser.add_argument("--reocr", type=float, default=None,
+                        help="Recognize fields with confidence below this again (see gtraid/reocr.py)")
+    parser.add_argument("--repeat", type=int, default=1, help="Recognize all screenshots this number of times")
+    parser.add_argument("--label", default="", help="Name of the run saved to JSON (e.g. what was changed)")
+    parser.add_argument("-o", "--output", default="bench_recognition.json", help="JSON file for the results")
+    parser.add_argument("--baseline", default="", help="JSON of a previous run to compare with")
+    parser.add_argument("--max-slowdown", type=float, default=0.1,
+                        help="Max drop of screenshots/s against the baseline (0.1 = 10%%)")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.0,
+                        help="Max drop of accuracy of any field against the baseline (0.01 = 1 point)")
+    parser.add_argument("--max-memory-growth", type=float, default=0.2,
+                        help="Max growth of peak RSS against the baseline (0.2 = 20%%)")
+    parser.add_argument("--show-mismatches", type=int, default=20, help="Number of mismatched fields to print")
+    args = parser.parse_args()
+
+    # Recognition logs warnings for screenshots without hit boxes, they are counted as missing boxes
+    logging.basicConfig(level=logging.ERROR, format="%(message)s")
+
+    pytesseract.pytesseract.tesseract_cmd = args.tesseract
+    pytesseract.pytesseract.run_tesseract = counting_run_tesseract
+    set_ocr_backend(args.ocr)
+
+    test_images_dir = os.path.join(root_dir, "test_images")
+    with open(args.truth, encoding="utf-8") as truth_file:
+        truth = yaml.safe_load(truth_file)
+    files = []
+    for user_input in args.inputs:
+        files.extend(sorted(glob.glob(user_input)))
+    if not args.inputs:
+        files = [os.path.join(test_images_dir, *key.split("/")) for key in truth]
+
+    dimensions_file = DimensionsFile(os.path.join(root_dir, 'dimensions.yaml'))
+    results = {
+        "label": args.label,
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(root_dir),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": {"ocr": args.ocr, "batch_ocr": args.batch_ocr, "ocr_memo": args.ocr_memo, "repeat": args.repeat,
+                    "gallery": args.gallery, "glyphs": args.glyphs, "reocr": args.reocr},
+    }
+    run_results, timer = run(files, truth, test_images_dir, dimensions_file, args)
+    results.update(run_results)
+    with open(args.output, "w", encoding="utf-8") as json_file:
+        json.dump(results, json_file, indent=2, ensure_ascii=False)
+
+    print("\n=====================================")
+    print(f"Screenshots: {results['screenshots']} ({results['screenshots_per_s']:.2f}/s), "
+          f"latency ms: mean={results['latency_ms']['mean']:.1f} p50={results['latency_ms']['p50']:.1f} "
+          f"p95={results['latency_ms']['p95']:.1f}")
+    ocr = results["ocr"]
+    print(f"OCR: {ocr['backend_calls']} backend calls, {ocr['fields']} fields, "
+          f"{ocr['tesseract_launches']} tesseract launches, {ocr['memo_hits']} memo hits")
+    if args.reocr is not None:
+        print(f"Re-OCR: {ocr['reocr_fields']} fields below {args.reocr}, {ocr['reocr_improved']} got a more "
+              f"confident text, {ocr['reocr_variants']} extra OCR calls")
+    if results["peak_rss_mb"] is not None:
+        print(f"Peak RSS: {results['peak_rss_mb']:.0f} MB")
+    boxes = results["accuracy"]["boxes"]
+    print(f"Boxes: {boxes['found']} found of {boxes['expected']}, "
+          f"right number in {boxes['screenshots_right']} of {boxes['screenshots']} screenshots")
+    for field in FIELDS + ("hit",):
+        field_accuracy = results["accuracy"][field]
+        print(f"{field + ' accuracy':<18}{field_accuracy['accuracy']:>8.1%} "
+              f"({field_accuracy['right']} of {field_accuracy['total']})"
+              + (f", unsure {field_accuracy['unsure']} (wrong {field_accuracy['unsure_wrong']}), "
+                 f"wrong but sure {field_accuracy['sure_wrong']}" if field != "hit" else ""))
+    if results["not_in_ground_truth"]:
+        print(f"Not in ground truth (not scored): {len(results['not_in_ground_truth'])}")
+    for mismatch in results["mismatches"][:args.show_mismatches]:
+        print(f"  {mismatch['file']} #{mismatch['hit']} {mismatch['field']}: "
+              f"expected={mismatch['expected']!r} recognized={mismatch['recognized']!r}")
+    print()
+    print(timer.format_summary())
+    print(f"Results are written to '{args.output}'")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        checks = compare(results, baseline, args)
+        print(f"\nAgainst baseline '{args.baseline}' ({baseline.get('label') or baseline.get('commit')}):")
+        print(f"{'check':<18}{'baseline':>10}{'this run':>10}")
+        for check, base_value, value, passed in checks:
+            print(f"{check:<18}{base_value:>10}{value:>10}  {'ok' if passed else 'FAIL'}")
+        if not all(passed for *_, passed in checks):
+            print("FAIL")
+            sys.exit(1)
+        print("PASS")
@@ -0,0 +1,129 @@
+"""
+Raid results database on a made up archive of seasons (gtraid/results_db.py)
+
+Usage:
+    python benchmarks/bench_results_db.py
+    python benchmarks/bench_results_db.py --seasons 10 --players 30 --images
+
+A guild of --players players makes --hits-per-day hits each day of each season (SEASON_DAYS days),
+screenshots have 5 hits and each screenshot overlaps the previous one by 2 hits (as if the list was
+scrolled by less than a page). All screenshots are ingested twice: the second time nothing must be added.
+
+Reported: ingest time, database size, and latency (median of --repeat runs) of a season leaderboard,
+a leaderboard of a boss on a day, history of a player in a season and of all seasons, and time to write
+the xlsx of a season from the database.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid.output import create_output
+from gtraid.pipeline import CompactHitRecord, NO_THUMBNAIL, ProcessedFile, Thumbnail
+from gtraid.results_db import ResultsDatabase, SEASON_DAYS, SEASON_FIRST_DAY
+
+HITS_PER_SCREENSHOT = 5
+OVERLAP = 2
+BOSSES = ["Lv.80 Goblin Chief", "Lv.80 Invader Commander", "Lv.80 Sandmonster", "Lv.80 Marina"]
+
+
+def random_thumbnail(width, height):
+    """JPEG of noise, about the size of a real thumbnail"""
+    img = np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+    return Thumbnail(cv2.imencode(".jpg", img)[1].tobytes(), width, height)
+
+
+def make_screenshots(seasons, players, hits_per_day, images):
+    """ProcessedFile-s of all days, overlapping like a scrolled list"""
+    names = [f"Player{index:02}" for index in range(players)]
+    thumbnails = [random_thumbnail(120, 20), random_thumbnail(90, 20), random_thumbnail(400, 100)] if images else []
+    screenshots = []
+    for day_index in range(seasons * SEASON_DAYS):
+        day = SEASON_FIRST_DAY + timedelta(days=day_index)
+        hits = [(name, f"{random.randint(500000, 9000000):,}", random.choice(BOSSES))
+                for name in names for _ in range(hits_per_day)]
+        random.shuffle(hits)
+        step = HITS_PER_SCREENSHOT - OVERLAP
+        for index, start in enumerate(range(0, max(len(hits) - OVERLAP, 1), step)):
+            file_name = f"Screenshot_{day:%Y%m%d}-{10 + index // 3600:02}{index // 60 % 60:02}{index % 60:02}.jpg"
+            hit_records = []
+            for hit_index, (name, damage, boss) in enumerate(hits[start:start + HITS_PER_SCREENSHOT]):
+                name_img, damage_img, hit_img = thumbnails or [NO_THUMBNAIL] * 3
+                hit_records.append(CompactHitRecord(hit_index, name, damage, boss, name_img, damage_img, NO_THUMBNAIL,
+                                                    NO_THUMBNAIL, NO_THUMBNAIL, hit_img))
+            screenshots.append(ProcessedFile(file_name, os.path.splitext(file_name)[0], "w1080h2220", hit_records, ""))
+    return screenshots
+
+
+def latency(query, repeat):
+    """Median time of a query, ms"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        query()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seasons", type=int, default=10, help="Number of seasons")
+    parser.add_argument("--players", type=int, default=30, help="Number of players")
+    parser.add_argument("--hits-per-day", type=int, default=3, help="Hits of a player per day")
+    parser.add_argument("--images", action="store_true", help="Store thumbnails (as gt.py does with -f db)")
+    parser.add_argument("--repeat", type=int, default=20, help="Number of runs of each query")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    screenshots = make_screenshots(args.seasons, args.players, args.hits_per_day, args.images)
+    unique_hits = args.seasons * SEASON_DAYS * args.players * args.hits_per_day
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        database = ResultsDatabase(os.path.join(temp_dir, "results.db"))
+        ingest_times = []
+        added = []
+        for _ in range(2):
+            start = time.perf_counter()
+            added.append(sum(database.ingest(screenshot) for screenshot in screenshots))
+            database.commit()
+            ingest_times.append(time.perf_counter() - start)
+        db_size = os.path.getsize(database.file_name)
+
+        season = database.last_season()
+        player = "Player00"
+        queries = [
+            ("leaderboard of a season", lambda: database.leaderboard(season)),
+            # The season name is its first day
+            ("leaderboard of a boss on a day", lambda: database.leaderboard(day=season, boss="Goblin")),
+            ("player hits in a season", lambda: database.player_hits(player, season)),
+            ("player hits of all seasons", lambda: database.player_hits(player)),
+            ("all seasons summary", lambda: database.seasons()),
+        ]
+        latencies = [(title, latency(query, args.repeat)) for title, query in queries]
+
+        start = time.perf_counter()
+        exported = database.export([create_output("xlsx", os.path.join(temp_dir, "season.xlsx"), streaming=True)],
+                                   season)
+        export_time = time.perf_counter() - start
+        database.close()
+
+    print("\n=====================================")
+    print(f"{len(screenshots)} screenshots, {sum(len(s.hit_records) for s in screenshots)} hits in them, "
+          f"{unique_hits} unique hits in {args.seasons} seasons of {SEASON_DAYS} days, {args.players} players")
+    print(f"Ingest: {ingest_times[0]:.2f} s ({len(screenshots) / ingest_times[0]:.0f} screenshots/s), "
+          f"{added[0]} hits added; again: {ingest_times[1]:.2f} s, {added[1]} hits added")
+    print(f"Database size: {db_size / 1024 / 1024:.1f} MB")
+    for title, milliseconds in latencies:
+        print(f"{title:<32}{milliseconds:>8.2f} ms")
+    print(f"xlsx of a season ({exported} hits): {export_time:.2f} s")
@@ -0,0 +1,146 @@
+"""
+Name lookup in a roster (gtraid/roster.py): accuracy and latency for rosters of many guilds
+
+Usage:
+    python benchmarks/bench_roster.py
+    python benchmarks/bench_roster.py --sizes 100 1000 5000 --queries 2000
+
+Rosters are made of names of benchmarks/ground_truth.yaml and random names (latin with digits or
+hangul, 3-12 characters) of --sizes. Queries are roster names misread the way OCR misreads them
+(1-2 confusable or random characters replaced, dropped or added) and names which are not in the roster.
+
+Reported for each roster size:
+- members: snapped to the right name, to a wrong name, left unknown
+- strangers (not in the roster): left unknown (right) or snapped to a member (wrong)
+- latency of a lookup (mean and 99th percentile): bigram index (NameIndex), a memoized repeated
+  lookup and a linear scan of all names with full Levenshtein distance (on a sample of queries)
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid.roster import Roster, levenshtein
+
+# Characters OCR confuses
+CONFUSIONS = {"l": "I1", "I": "l1", "1": "lI", "O": "0Q", "0": "O", "o": "0", "B": "8", "8": "B", "S": "5",
+              "5": "S", "e": "c", "c": "e", "i": "l", "g": "q", "Z": "2", "2": "Z"}
+
+LATIN = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+
+def random_name(rng):
+    length = rng.randint(3, 12)
+    if rng.random() < 0.3:
+        return "".join(chr(rng.randint(0xAC00, 0xD7A3)) for _ in range(max(length // 2, 2)))
+    return "".join(rng.choice(LATIN) for _ in range(length))
+
+
+def misread(name, rng, edits):
+    """Name with edits OCR-like errors"""
+    chars = list(name)
+    for _ in range(edits):
+        position = rng.randrange(len(chars))
+        kind = rng.random()
+        if chars[position] in CONFUSIONS and kind < 0.6:
+            chars[position] = rng.choice(CONFUSIONS[chars[position]])
+        elif kind < 0.8:
+            chars[position] = rng.choice(LATIN)
+        elif kind < 0.9 and len(chars) > 3:
+            chars.pop(position)
+        else:
+            chars.insert(position, rng.choice(LATIN))
+    return "".join(chars)
+
+
+def linear_match(names, name, max_distance):
+    """The closest of names by full Levenshtein distance (None if it is not within max_distance or a tie)"""
+    distances = sorted((levenshtein(name, roster_name, len(name) + len(roster_name)), roster_name)
+                       for roster_name in names)
+    if distances[0][0] <= max_distance and (len(distances) == 1 or distances[0][0] < distances[1][0]):
+        return distances[0][1]
+    return None
+
+
+def latency(function, queries):
+    """(mean, 99th percentile) of function calls with each query, us"""
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        function(query)
+        times.append((time.perf_counter() - start) * 1e6)
+    return statistics.mean(times), float(np.percentile(times, 99))
+
+
+if __name__ == "__main__":
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--truth", default=os.path.join(root_dir, "benchmarks", "ground_truth.yaml"),
+                        help="Ground truth file (names of its hits are roster names)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 2000], help="Roster sizes")
+    parser.add_argument("--queries", type=int, default=1000, help="Number of misread members (and strangers)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.truth, encoding="utf-8") as truth_file:
+        truth = yaml.safe_load(truth_file)
+    truth_names = sorted({str(hit['name']) for hits in truth.values() for hit in hits})
+
+    results = []
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        names = list(truth_names)
+        while len(names) < size:
+            name = random_name(rng)
+            if name not in names:
+                names.append(name)
+        roster = Roster()
+        for index, name in enumerate(names):
+            roster.add(name, f"Guild {index // 30}")
+
+        members = []
+        for _ in range(args.queries):
+            name = rng.choice(names)
+            members.append((misread(name, rng, rng.choice([1, 1, 2]) if len(name) > 4 else 1), name))
+        strangers = []
+        while len(strangers) < args.queries:
+            name = random_name(rng)
+            if name not in roster.guilds:
+                strangers.append(name)
+
+        right = wrong = unknown = 0
+        for query, expected in members:
+            match = roster.match(query)
+            right += match.name == expected
+            wrong += match.name is not None and match.name != expected
+            unknown += match.name is None
+        strangers_snapped = sum(roster.match(query).name is not None for query in strangers)
+
+        queries = [query for query, _ in members] + strangers
+        fresh = Roster()
+        for index, name in enumerate(names):
+            fresh.add(name, f"Guild {index // 30}")
+        index_latency = latency(fresh.match, list(dict.fromkeys(queries)))
+        memo_latency = latency(fresh.match, queries)
+        linear_latency = latency(lambda query: linear_match(names, query, roster.max_distance(query)),
+                                 queries[::max(len(queries) // 50, 1)])
+        results.append((size, right, wrong, unknown, strangers_snapped, index_latency, memo_latency, linear_latency))
+
+    print("\n=====================================")
+    print(f"{args.queries} misread members and {args.queries} strangers for each roster")
+    print(f"{'names':>6}{'right':>7}{'wrong':>7}{'unknown':>9}{'strangers snapped':>19}"
+          f"{'index us':>16}{'memo us':>14}{'linear us':>18}")
+    for size, right, wrong, unknown, snapped, index, memo, linear in results:
+        print(f"{size:>6}{right:>7}{wrong:>7}{unknown:>9}{snapped:>19}"
+              f"{index[0]:>8.1f} p99 {index[1]:<6.0f}{memo[0]:>5.1f} p99 {memo[1]:<5.0f}"
+              f"{linear[0]:>8.0f} p99 {linear[1]:<6.0f}")
+    print("(right / wrong / unknown - misread members snapped to the right name, to another name, not snapped;")
+    print(" strangers snapped - names not in the roster snapped to a member)")
@@ -0,0 +1,131 @@
+"""
+Accuracy and cost of scroll sequence stitching (gtraid/stitching.py)
+
+Usage:
+    python benchmarks/bench_stitching.py test_images/2021-06-06/* test_images/rock/*
+
+Test screenshots are taken by a page, they don't overlap. So scroll bursts are made up:
+full hit boxes of all screenshots of a resolution are stacked into one long list, and screenshots
+are made of the first screenshot of the resolution with its hits window replaced by the list
+scrolled by random 30-80% of the window height (saved as JPEG, as phones do).
+
+For each burst: how many offsets are found right, how many hit boxes would be recognized
+without stitching (sum over screenshots) and with it (boxes of strips) against the number of
+unique boxes in the burst. Latency is the time of estimate_scroll_offset.
+"""
+import argparse
+import glob
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid import DimensionsFile
+from gtraid.image_reco import find_hit_boxes
+from gtraid.stitching import ScrollSequence, estimate_scroll_offset
+
+
+def box_rows(img, crop_rects):
+    """Rows (with the dark gap below) of full hit boxes of a screenshot, from the top to the bottom"""
+    window = crop_rects.hits_window.crop(img)
+    boxes = sorted(find_hit_boxes(window, crop_rects.hit_image.min_width, crop_rects.hit_image.min_height, debug=0),
+                   key=lambda box: box.y)
+    full_height = max((box.height for box in boxes), default=0)
+    rows = []
+    for box, next_box in zip(boxes, boxes[1:]):
+        if box.height == full_height:
+            rows.append(window[box.y:next_box.y])
+    return rows
+
+
+def count_boxes(window, crop_rects):
+    """Number of hit boxes found in a hits window"""
+    return len(find_hit_boxes(window, crop_rects.hit_image.min_width, crop_rects.hit_image.min_height, debug=0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='+', help="Screenshot files (wildcards allowed)")
+    parser.add_argument("--bursts", type=int, default=5, help="Number of bursts for each resolution")
+    parser.add_argument("--length", type=int, default=10, help="Number of screenshots in a burst")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+    dimensions_file = DimensionsFile(os.path.join(root_dir, 'dimensions.yaml'))
+    random.seed(args.seed)
+
+    # Detection functions log warnings for screenshots without hit boxes. Silence them
+    logging.disable(logging.WARNING)
+
+    # Screenshots by resolution
+    resolutions = {}
+    for user_input in args.inputs:
+        for file_name in glob.glob(user_input):
+            img = cv2.imread(file_name)
+            if img is not None:
+                crop_rects = dimensions_file.get_crop_rects(img)
+                resolutions.setdefault(crop_rects.name, (img, crop_rects, []))[2].extend(box_rows(img, crop_rects))
+
+    results = []        # (resolution, right offsets, wrong offsets, offsets, boxes per file, stitched, unique boxes)
+    latencies = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for resolution, (base_img, crop_rects, rows) in resolutions.items():
+            window = crop_rects.hits_window
+            margin = crop_rects.hits_window.crop(base_img)[:window.height // 50]
+            list_img = np.vstack([margin] + rows)
+            for burst in range(args.bursts):
+                # Scroll positions of the burst, the list is long enough for a few bursts
+                steps = [random.randint(int(window.height * 0.3), int(window.height * 0.8))
+                         for _ in range(args.length - 1)]
+                start = random.randint(0, max(len(list_img) - window.height - sum(steps), 0))
+                positions = [start + sum(steps[:index]) for index in range(args.length)]
+                positions = [position for position in positions if position + window.height <= len(list_img)]
+
+                windows = []
+                for index, position in enumerate(positions):
+                    img = base_img.copy()
+                    img[window.rows, window.cols] = list_img[position:position + window.height]
+                    file_name = os.path.join(temp_dir, f"{resolution}_{burst}_{index}.jpg")
+                    cv2.imwrite(file_name, img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+                    windows.append(window.crop(cv2.imread(file_name)))
+                grays = [cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) for crop in windows]
+
+                right = wrong = 0
+                for index in range(1, len(windows)):
+                    start_time = time.perf_counter()
+                    offset = estimate_scroll_offset(grays[index - 1], grays[index])
+                    latencies.append((time.perf_counter() - start_time) * 1000)
+                    right += offset == positions[index] - positions[index - 1]
+                    wrong += offset is not None and offset != positions[index] - positions[index - 1]
+
+                sequences = [ScrollSequence("0", crop_rects, windows[0], grays[0])]
+                for index in range(1, len(windows)):
+                    if not sequences[-1].append(str(index), crop_rects, windows[index], grays[index]):
+                        sequences.append(ScrollSequence(str(index), crop_rects, windows[index], grays[index]))
+                stitched = sum(count_boxes(sequence.build_strip()[0], crop_rects) for sequence in sequences)
+                per_file = sum(count_boxes(crop, crop_rects) for crop in windows)
+
+                # Unique boxes: the part of the list which was seen by the burst
+                unique = count_boxes(list_img[positions[0]:positions[-1] + window.height], crop_rects)
+                results.append((resolution, right, wrong, len(windows) - 1, per_file, stitched, unique))
+
+    print("\n=====================================")
+    if latencies:
+        print(f"estimate_scroll_offset latency, ms: mean={statistics.mean(latencies):.2f} "
+              f"median={statistics.median(latencies):.2f} max={max(latencies):.2f}")
+    print(f"{'resolution':<14}{'offsets right':>15}{'wrong':>7}{'boxes per file':>16}{'stitched':>10}{'unique':>8}")
+    for resolution in resolutions:
+        rows = [result for result in results if result[0] == resolution]
+        print(f"{resolution:<14}{sum(r[1] for r in rows):>8} of {sum(r[3] for r in rows):<4}{sum(r[2] for r in rows):>7}"
+              f"{sum(r[4] for r in rows):>16}{sum(r[5] for r in rows):>10}{sum(r[6] for r in rows):>8}")
+    print("(offsets which are not right and not wrong are not found: a new sequence is started)")
+    print("(boxes per file and stitched - hit boxes which are recognized, unique - hit boxes in the bursts)")
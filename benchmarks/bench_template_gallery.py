@@ -0,0 +1,129 @@
+"""
+Boss recognition by reference images (gtraid/template_gallery.py) against the ground truth
+
+Usage:
+    python benchmarks/bench_template_gallery.py
+    python benchmarks/bench_template_gallery.py -t /usr/bin/tesseract --gallery gallery.yaml
+
+Boss crops of all screenshots of benchmarks/ground_truth.yaml are taken the way recognize_screenshot
+takes them (hit boxes from the top to the bottom) and labeled by the ground truth.
+
+Reported:
+- accuracy of the gallery (--gallery) on all crops: right, wrong and unknown (below min_score)
+- holdout accuracy: a gallery is made of different crops of every other screenshot (as
+  "python -m gtraid.template_gallery extract" does) and tested on the other screenshots
+- latency (median of --repeat runs) of matching one crop and all crops of a screenshot,
+  and of OCR of the lvBoss crop which the gallery replaces (resolutions with lvBoss_rect)
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import pytesseract
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid import DimensionsFile
+from gtraid.image_reco import box_region, find_hit_boxes, ocr_boss, prepare_boss
+from gtraid.template_gallery import TemplateGallery, TemplateIndex, DEFAULT_SIZES
+
+
+def latency(function, repeat):
+    """Median time of function calls, ms"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def boss_crops(truth, test_images_dir, dimensions_file):
+    """[(screenshot, [(boss crop, lvBoss crop or None, expected boss)])] of the ground truth screenshots"""
+    screenshots = []
+    for truth_key, expected_hits in truth.items():
+        img = cv2.imread(os.path.join(test_images_dir, *truth_key.split("/")))
+        crop_rects = dimensions_file.get_crop_rects(img)
+        window = crop_rects.hits_window.crop(img)
+        hit_rects = crop_rects.hit_image
+        boxes = sorted(find_hit_boxes(window, hit_rects.min_width, hit_rects.min_height, debug=0),
+                       key=lambda box: box.y)
+        screenshots.append((truth_key, [(box_region(window, box, hit_rects.boss_rect),
+                                         box_region(window, box, hit_rects.lvBoss_rect)
+                                         if hit_rects.lvBoss_rect else None,
+                                         expected["boss"])
+                                        for box, expected in zip(boxes, expected_hits)]))
+    return screenshots
+
+
+def score(index, crops):
+    """(right, wrong, unknown) of matching crops [(boss crop, lvBoss crop, expected)] with index"""
+    matches = index.match([crop for crop, _, _ in crops])
+    right = sum(match.label == expected for match, (_, _, expected) in zip(matches, crops))
+    unknown = sum(not match.label for match in matches)
+    return right, len(crops) - right - unknown, unknown
+
+
+def holdout_index(screenshots, min_score, max_similar=0.9):
+    """Index of different crops of every other screenshot"""
+    index = TemplateIndex(DEFAULT_SIZES['bosses'], min_score)
+    taken = TemplateIndex(DEFAULT_SIZES['bosses'], max_similar)
+    for _, crops in screenshots[::2]:
+        for crop, _, expected in crops:
+            if taken.match([crop])[0].label:
+                continue
+            taken.add(expected, crop)
+            index.add(expected, crop)
+    return index
+
+
+if __name__ == "__main__":
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gallery", default=os.path.join(root_dir, "gallery.yaml"), help="Gallery config")
+    parser.add_argument("--truth", default=os.path.join(root_dir, "benchmarks", "ground_truth.yaml"),
+                        help="Ground truth file")
+    parser.add_argument("-t", "--tesseract", default="", help="Full path to tesseract executable to time OCR "
+                                                              "of lvBoss (default - don't)")
+    parser.add_argument("--repeat", type=int, default=200, help="Number of runs of each match")
+    args = parser.parse_args()
+
+    with open(args.truth, encoding="utf-8") as truth_file:
+        truth = yaml.safe_load(truth_file)
+    dimensions_file = DimensionsFile(os.path.join(root_dir, 'dimensions.yaml'))
+    screenshots = boss_crops(truth, os.path.join(root_dir, "test_images"), dimensions_file)
+    all_crops = [crop for _, crops in screenshots for crop in crops]
+
+    start = time.perf_counter()
+    gallery = TemplateGallery(args.gallery)
+    load_time = (time.perf_counter() - start) * 1000
+    gallery_score = score(gallery.bosses, all_crops)
+
+    holdout = holdout_index(screenshots, gallery.bosses.min_score)
+    holdout_score = score(holdout, [crop for _, crops in screenshots[1::2] for crop in crops])
+
+    one_crop = [all_crops[0][0]]
+    screenshot_crops = [crop for crop, _, _ in screenshots[0][1]]
+    timings = [("match one crop", latency(lambda: gallery.recognize_bosses(one_crop), args.repeat)),
+               (f"match a screenshot ({len(screenshot_crops)} crops)",
+                latency(lambda: gallery.recognize_bosses(screenshot_crops), args.repeat))]
+    if args.tesseract:
+        pytesseract.pytesseract.tesseract_cmd = args.tesseract
+        lvBoss_img = next(lvBoss for _, lvBoss, _ in all_crops if lvBoss is not None)
+        timings.append(("OCR of one lvBoss crop", latency(lambda: ocr_boss(prepare_boss(lvBoss_img)),
+                                                          max(args.repeat // 20, 3))))
+
+    print("\n=====================================")
+    print(f"{len(all_crops)} boss crops of {len(screenshots)} screenshots")
+    print(f"Gallery '{args.gallery}': {len(gallery.bosses)} reference images, loaded in {load_time:.1f} ms")
+    for title, (right, wrong, unknown) in [("gallery", gallery_score), (f"holdout ({len(holdout)} references)",
+                                                                         holdout_score)]:
+        total = right + wrong + unknown
+        print(f"{title:<28}right {right} of {total} ({right / total:.1%}), wrong {wrong}, unknown {unknown}")
+    for title, milliseconds in timings:
+        print(f"{title:<34}{milliseconds * 1000:>10.1f} us")
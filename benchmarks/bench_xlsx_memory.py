@@ -0,0 +1,111 @@
+"""
+Peak memory of Excel output: default (in memory) vs streaming mode
+
+Usage:
+    python benchmarks/bench_xlsx_memory.py
+    python benchmarks/bench_xlsx_memory.py --screenshots 100 1000 10000 --hits 5
+
+Screenshots are synthetic: compact records with JPEG thumbnails of the same sizes as thumbnails
+of real w2220h1080 screenshots (~53KB per hit). Each thumbnail is unique (xlsxwriter stores
+identical images once). Every run is made in a separate process, its peak RSS (ru_maxrss) is reported.
+Modes: default, streaming (--streaming) and streaming+shards (--streaming --max-rows 5000)
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from gtraid.pipeline import ProcessedFile, CompactHitRecord, Thumbnail
+from gtraid.xlsx_output import XlsxOutput
+
+# Thumbnail sizes of a real hit box (width, height)
+THUMBNAIL_SIZES = {
+    "name_img": (115, 17),
+    "damage_img": (103, 21),
+    "party_img": (180, 40),
+    "boss_img": (97, 44),
+    "lvBoss_img": (215, 24),
+    "hit_img": (932, 110),
+}
+
+
+class ThumbnailFactory:
+    """Makes unique JPEG thumbnails: a noisy background (like a game UI) with a unique number on it"""
+
+    def __init__(self):
+        random = np.random.default_rng(0)
+        self.backgrounds = {}
+        for field, (width, height) in THUMBNAIL_SIZES.items():
+            noise = random.integers(0, 255, (height, width, 3), dtype=np.uint8)
+            self.backgrounds[field] = cv2.GaussianBlur(noise, (3, 3), 0)
+        self.count = 0
+
+    def make(self, field):
+        self.count += 1
+        img = self.backgrounds[field].copy()
+        cv2.putText(img, str(self.count), (2, img.shape[0] - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        is_success, buffer = cv2.imencode(".jpg", img)
+        return Thumbnail(data=buffer.tobytes(), width=img.shape[1], height=img.shape[0])
+
+
+def synthetic_files(screenshots, hits):
+    """Yields ProcessedFile-s one by one, like process_files does"""
+    factory = ThumbnailFactory()
+    for file_index in range(screenshots):
+        day = 1 + file_index * 30 // screenshots
+        file_name = f"Screenshot_202106{day:02}-120000_{file_index}.jpg"
+        records = [CompactHitRecord(hit_index=hit_index, name=f"Player{hit_index}", damage=f"{file_index * 10 + hit_index:,}",
+                                    boss="Marina", **{field: factory.make(field) for field in THUMBNAIL_SIZES})
+                   for hit_index in range(hits)]
+        yield ProcessedFile(file_name=file_name, image_base_name=os.path.splitext(file_name)[0], resolution="w2220h1080",
+                            hit_records=records, error="")
+
+
+def run_child(screenshots, hits, streaming, max_rows, output_dir):
+    """Writes synthetic files and prints: peak RSS in MB, seconds, total output size in MB"""
+    start = time.perf_counter()
+    output = XlsxOutput(os.path.join(output_dir, "result.xlsx"), streaming=streaming, max_rows=max_rows)
+    for processed_file in synthetic_files(screenshots, hits):
+        output.write(processed_file)
+    output.close()
+    elapsed = time.perf_counter() - start
+    size = sum(os.path.getsize(file_name) for file_name in output.file_names)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024     # KB on linux
+    print(f"{peak_rss:.0f} {elapsed:.1f} {size / 1024 / 1024:.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--screenshots", type=int, nargs="+", default=[100, 1000, 10000], help="Numbers of screenshots")
+    parser.add_argument("--hits", type=int, default=5, help="Hits per screenshot")
+    parser.add_argument("--max-rows", type=int, default=5000, help="Rows per workbook in streaming+shards mode")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        mode, screenshots, output_dir = args.child
+        run_child(int(screenshots), args.hits, mode != "default", args.max_rows if mode == "streaming+shards" else 0,
+                  output_dir)
+        sys.exit(0)
+
+    print(f"{'screenshots':>12}{'hits':>8}{'mode':>18}{'peak RSS, MB':>14}{'time, s':>10}{'output, MB':>12}")
+    for screenshots in args.screenshots:
+        for mode in ["default", "streaming", "streaming+shards"]:
+            with tempfile.TemporaryDirectory() as output_dir:
+                result = subprocess.run([sys.executable, __file__, "--hits", str(args.hits), "--max-rows", str(args.max_rows),
+                                         "--child", mode, str(screenshots), output_dir],
+                                        capture_output=True, text=True)
+            if result.returncode:
+                peak_rss, elapsed, size = f"failed ({result.returncode})", "-", "-"
+            else:
+                peak_rss, elapsed, size = result.stdout.split()
+            print(f"{screenshots:>12}{screenshots * args.hits:>8}{mode:>18}{peak_rss:>14}{elapsed:>10}{size:>12}",
+                  flush=True)
@@ -1,266 +1,319 @@
 import argparse
+import logging
 import math
 import os
-import io
-
-import cv2
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import pytesseract
-from gtraid import recognize_screenshot, DimensionsFile, RecognizedImage, RecognizedHitRecord
-import xlsxwriter
+from gtraid import DimensionsFile, DimensionsFileError
 import glob
 
-from gtraid.image_reco import auto_crop
+from gtraid.pipeline import PipelineOptions, process_files, process_stitched_files, init_worker, setup_ocr_memo, \
+    setup_hit_deduplicator, setup_stage_timer, LOG_FORMAT
+from gtraid.hit_dedup import HitDeduplicator
+from gtraid.partial_hits import PartialHitMerger
+from gtraid.screenshot_time import screenshot_order_key
+from gtraid.ocr_memo import OcrMemoStats
+from gtraid.recognition_cache import RecognitionCache
+from gtraid.ocr_backend import ocr_backend_names, set_ocr_backend
+from gtraid.digit_reader import GlyphBank, set_glyph_bank
+from gtraid.template_gallery import TemplateGallery, TemplateGalleryError, set_template_gallery
+from gtraid.output import output_format_names, output_file_name, create_output
+from gtraid.reocr import MIN_CONFIDENCE
+from gtraid.roster import Roster, RosterError
+from gtraid.stage_timer import StageTimer, get_stage_timer, timed
+from gtraid.watch_folder import FolderWatcher, ProcessedManifest
+
+logger = logging.getLogger(__name__)
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('inputs', nargs='+', help="File name (wildcards allowed)")
+    parser.add_argument('inputs', nargs='+', help="File name (wildcards allowed) or folder to watch with --watch")
     parser.add_argument("-d", "--debug", type=int, choices=[0, 1, 2], default=0,
-                        help="Enable debugging output. 0-none, 1-prings, 2-showimg")
+                        help="Enable debugging output. 0-none, 1-debug log, 2-showimg")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO",
+                        help="Logging level (--debug 1 or 2 sets DEBUG)")
     parser.add_argument("-r", "--report", default="report", help="Report folder (set blank for no report)")
-    parser.add_argument("-o", "--output", default="result.xlsx", help="File name of resulting xlsx")
+    parser.add_argument("-o", "--output", default="result.xlsx",
+                        help="File name of resulting xlsx (other formats get their extension)")
+    parser.add_argument("-f", "--format", default="xlsx",
+                        help=f"Comma separated output formats: {','.join(output_format_names)}. "
+                             f"csv, jsonl, parquet have text fields only and are much faster, "
+                             f"db adds hits to a results database of all runs")
+    parser.add_argument("--append", action="store_true",
+                        help="Add results to existing csv, jsonl or parquet output instead of overwriting it")
+    parser.add_argument("--image-dir", default="",
+                        help="Save thumbnails to this folder and write their paths to csv, jsonl or parquet")
     parser.add_argument("-t", "--tesseract", default=r"C:\Program Files\Tesseract-OCR\tesseract.exe",
                         help="Full path to tesseract.exe")
+    parser.add_argument("-b", "--batch-ocr", action="store_true",
+                        help="Recognize all fields of a screenshot with one tesseract call (faster)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of parallel processes to recognize screenshots")
+    parser.add_argument("--ocr", choices=ocr_backend_names, default="pytesseract",
+                        help="OCR backend. tesserocr keeps tesseract loaded in process (pip install tesserocr)")
+    parser.add_argument("--cache-file", default="",
+                        help="Recognition cache file. Default is <output>.cache.sqlite next to the output")
+    parser.add_argument("--cache-size", type=float, default=500, help="Recognition cache size limit in MB")
+    parser.add_argument("--no-cache", action="store_true", help="Don't use recognition cache")
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="Recognize all screenshots again and refill recognition cache")
+    parser.add_argument("--no-ocr-memo", action="store_true",
+                        help="Don't reuse OCR results for near-identical name/boss images")
+    parser.add_argument("--auto-layout", action="store_true",
+                        help="Detect hits window in screenshots instead of taking it from dimensions.yaml")
+    parser.add_argument("--partial-hits", action="store_true",
+                        help="Recognize hits cut at the top or bottom of the list and merge them with adjacent screenshots")
+    parser.add_argument("--stitch", action="store_true",
+                        help="Glue overlapping screenshots of a scrolled list into one list and recognize each hit once")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Find the same hit boxes in different screenshots by image, recognize and write them once")
+    parser.add_argument("--gallery", default="",
+                        help="Recognize bosses and heroes by reference images of this gallery config (gallery.yaml) "
+                             "instead of OCR")
+    parser.add_argument("--glyphs", default="",
+                        help="Read damage by glyph templates of this bank (gallery/damage_glyphs.npz), "
+                             "OCR only damages it is not sure of")
+    parser.add_argument("--min-confidence", type=float, default=None,
+                        help="Get confidence of recognized fields. Fields with lower confidence (0..1) are "
+                             f"highlighted in Excel and recognized again with --reocr ({MIN_CONFIDENCE} with --reocr)")
+    parser.add_argument("--reocr", action="store_true",
+                        help="Recognize fields with confidence below --min-confidence again: upscaled, "
+                             "with other thresholds and page segmentation modes")
+    parser.add_argument("--roster", default="",
+                        help="Snap recognized names to the closest names of this roster of guild members "
+                             "(YAML: guild -> list of names) and highlight unknown names")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Write Excel with constant memory (for thousands of screenshots)")
+    parser.add_argument("--max-rows", type=int, default=0,
+                        help="Start a new Excel file after this number of rows (0 - no limit)")
+    parser.add_argument("--split-by-day", action="store_true",
+                        help="Separate Excel file for each day (screenshot time is taken from file names)")
+    parser.add_argument("--season", default="",
+                        help="Season name of hits added to db output (default - by screenshot time)")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and recognize new screenshots as they appear in the input folders")
+    parser.add_argument("--manifest", default="",
+                        help="File with screenshots processed in --watch mode. Default is <output>.manifest.jsonl")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="--watch: a new file is read when it didn't change for this number of seconds")
+    parser.add_argument("--poll-interval", type=float, default=10.0,
+                        help="--watch: scan folders every this number of seconds if file events can't be watched")
+    parser.add_argument("--timings", default="",
+                        help="Time processing stages and write the summary to this JSON file")
+    parser.add_argument("--trace", default="",
+                        help="Write processing stages to this Chrome trace file (chrome://tracing, Perfetto, speedscope)")
 
     args = parser.parse_args()
 
+    # OCR confidence takes image_to_data instead of image_to_string, so it is got only if it is used
+    if args.reocr and args.min_confidence is None:
+        args.min_confidence = MIN_CONFIDENCE
+
+    # Logging. Worker processes are set up with the same level
+    log_level = logging.DEBUG if args.debug else getattr(logging, args.log_level)
+    logging.basicConfig(level=log_level, format=LOG_FORMAT)
+
     # Setup tesseract executable
     pytesseract.pytesseract.tesseract_cmd = args.tesseract
+    set_ocr_backend(args.ocr)
 
     # Dimensions file
     df_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'dimensions.yaml')
-    print(f"Opening dimensions file: '{df_path}'")
-    dimensions_file = DimensionsFile(df_path)
+    logger.info("Opening dimensions file: '%s'", df_path)
+    try:
+        dimensions_file = DimensionsFile(df_path)
+    except DimensionsFileError as ex:
+        parser.error(str(ex))
+
+    # Boss and hero reference images. Worker processes load them from options.gallery
+    if args.gallery:
+        try:
+            set_template_gallery(TemplateGallery(args.gallery))
+        except TemplateGalleryError as ex:
+            parser.error(str(ex))
+    if args.glyphs:
+        try:
+            set_glyph_bank(GlyphBank.load(args.glyphs))
+        except (OSError, ValueError, KeyError) as ex:
+            parser.error(f"can't load glyph bank '{args.glyphs}': {ex}")
+
+    # Roster of guild members. Names are snapped to it in this process after recognition
+    roster = None
+    if args.roster:
+        try:
+            roster = Roster.load(args.roster)
+        except RosterError as ex:
+            parser.error(str(ex))
+
+    # Watch mode writes hits as they come, so outputs must be appendable
+    output_formats = list(dict.fromkeys(args.format.split(",")))
+    if args.watch:
+        if "xlsx" in output_formats:
+            parser.error("--watch can't add hits to xlsx. Use -f db (and make xlsx with "
+                         "python -m gtraid.results_db result.db --export result.xlsx) or -f csv, jsonl, parquet")
+        if args.stitch:
+            parser.error("--watch can't be used with --stitch")
+        for folder in args.inputs:
+            if not os.path.isdir(folder):
+                parser.error(f"--watch: '{folder}' is not a folder")
+        args.append = True
 
     # Create "report" directory
     if args.report and not os.path.isdir(args.report):
         os.mkdir(args.report)
 
-    # Create an new Excel file and add a worksheet.
-    workbook = xlsxwriter.Workbook(args.output)
-    worksheet = workbook.add_worksheet()
-
-    # Parsed name column
-    worksheet.set_column('A:A', 15)
-
-    # Damage column
-    worksheet.set_column('C:C', 15)
-
-    # Boss column
-    worksheet.set_column('H:H', 15)
-    worksheet.set_column('I:I', 15)
-
-    # Format output for a damage
-    damage_num_format = workbook.add_format({'num_format': '#,##0.', 'align': 'left'})
-    damage_exists_format = workbook.add_format({'num_format': '#,##0.', 'bg_color': '#ffb3b3', 'align': 'left'})   # #ffb3b3 - light red
-
-    # this map is used to track doublicated hits
-    damage_name_map = {}
-
-    # iterable showing current row to fill
-    cur_row = 1
-
-    # width for pictures column
-    max_name_width = 100
-    max_damage_width = 100
-    max_party_width = 100
-    max_boss_width = 50
-    max_hit_width = 100
-    max_LvBoss_width = 100
-
-    worksheet.set_column("B:B", max_name_width)      # Name image column
-    worksheet.set_column("D:D", max_damage_width)    # Damage image  column
-    worksheet.set_column("E:E", max_party_width)     # Party image column
-    worksheet.set_column("F:F", max_boss_width)      # Boss image column
-    worksheet.set_column("G:G", max_LvBoss_width)    # Testing Boss Text
-    worksheet.set_column("L:L", 400)
-    worksheet.set_column("J:J", max_hit_width)
-
-    # worksheet.set_column_pixels("B:B", max_name_width)      # Name image column
-    # worksheet.set_column_pixels("D:D", max_damage_width)    # Damage image  column
-    # worksheet.set_column_pixels("E:E", max_party_width)     # Party image column
-    # worksheet.set_column_pixels("F:F", max_boss_width)      # Boss image column
-    # worksheet.set_column_pixels("G:G", max_LvBoss_width)    # Testing Boss Text
-    # worksheet.set_column_pixels("L:L", 400)
-    # worksheet.set_column_pixels("J:J", max_hit_width)
-
-    # What files to process
+    # Outputs. Excel streaming mode keeps memory constant for thousands of screenshots
+    outputs = []
+    for output_format in output_formats:
+        try:
+            outputs.append(create_output(output_format, output_file_name(args.output, output_format),
+                                         append=args.append, image_dir=args.image_dir, streaming=args.streaming,
+                                         max_rows=args.max_rows, split_by_day=args.split_by_day,
+                                         dedup_sources=args.dedup, season=args.season,
+                                         min_confidence=args.min_confidence))
+        except (ValueError, ImportError) as ex:
+            parser.error(str(ex))
+
+    # What files to process (in watch mode they are given by FolderWatcher)
     files = []
-    for user_input in args.inputs:
+    for user_input in [] if args.watch else args.inputs:
         # use Glob to convert something like some_dir/* to file names
         files.extend([file_path for file_path in glob.glob(user_input)])
 
-    # Iterate over screenshot files
-    for file_name in files:
-        print("\n=====================================")
-        print(" P R O C E S S I N G :")
-        print(file_name)
-
-        img = cv2.imread(file_name)
-        if img is None:
-            print(f"(!!!) ERROR (!!!): Can't open file: {file_name}")
-            continue
-
-        crop_rects = dimensions_file.get_crop_rects(img)
-        image_base_name = os.path.splitext(os.path.basename(file_name))[0]
-
-        # do we need to fill a report?
-        report_path = f"{args.report}/{image_base_name}_" if args.report else ""
-
-        # RECOGNIZE SCREENSHOT
-        result = recognize_screenshot(img, crop_rects, report_path=report_path, debug=args.debug)
-        print(f"Recognized f{len(result.hit_records)} hits")
-
-        # Iterate over hits
-        for hit_index, hit_record in enumerate(result.hit_records):
-            print(f"  {hit_record.name} {hit_record.damage}")
-
-            # Add name to worksheet
-            worksheet.write(f'A{cur_row}', hit_record.name)
-            worksheet.write(f'I{cur_row}', hit_record.boss)
-            # Parse damage and add to worksheet
-            if hit_record.damage:
-                try:
-                    damage = int(hit_record.damage
-                                 .replace(',', '')
-                                 .replace(' ', '')
-                                 .replace('.', '')
-                                 .replace('\'', ''))
-
-                    damage_name_pair = hit_record.damage + hit_record.name
-
-                    # There was no such damage before for this name?
-                    if damage_name_pair not in damage_name_map.keys():
-                        # Just add to the cell then
-                        damage_name_map[damage_name_pair] = damage
-                        worksheet.write_number(f'C{cur_row}', damage, damage_num_format)
-                    else:
-                        # Probably image overlap!
-                        worksheet.write(f'C{cur_row}', damage, damage_exists_format)
-                except ValueError as ex:
-                    print(f"WARNING: can't convert damage '{hit_record.damage}' to integer! {ex}")
-            else:
-                print(f"WARNING: Damage is empty for hit# {hit_index} name: '{hit_record.name}'")
-
-            if hit_record.boss:
-                boss = hit_record.boss
-                if boss.find('Goblin') != -1: 
-                    boss = 'Goblin'
-                elif boss.find('Commander') != -1:
-                    boss = 'Invader'
-                elif boss.find('Sandmonster') != -1:
-                    boss = 'Sandy'
-                elif boss.find('Marina') != -1:
-                    boss = 'Marina'
-                worksheet.write(f'H{cur_row}', boss)
-
-            # "SO Shadow Beast " "SO Invader Commander " "SO Furious Minotaur " "SO Cyborg Erina "
-            # if hit_record.boss:
-            #     boss = hit_record.boss
-            #     if boss.find('Beast') != -1: 
-            #         boss = 'Beast'
-            #     elif boss.find('Commander') != -1:
-            #         boss = 'Commander'
-            #     elif boss.find('Minotaur') != -1:
-            #         boss = 'Minotaur'
-            #     elif boss.find('Erina') != -1:
-            #         boss = 'Erina'
-            #     worksheet.write(f'H{cur_row}', boss)
-
-            # if hit_record.boss:
-            #     boss = hit_record.boss
-            #     if boss.find('Marina') != -1: 
-            #         boss = 'Marina'
-            #     elif boss.find('Goblin') != -1:
-            #         boss = 'Goblin'
-            #     elif boss.find('Slime') != -1:
-            #         boss = 'Lava'
-            #     elif boss.find('monster') != -1:
-            #         boss = 'Sandy'
-            #     worksheet.write(f'H{cur_row}', boss)
-
-            # NAME image
-            name_img = 255 - auto_crop(255-hit_record.name_rec_img)   # crop empty edges
-            name_img = cv2.resize(name_img, (0, 0), fx=0.4, fy=0.4)  # resize to 40%
-            name_height, name_width = name_img.shape
-            is_success, buffer = cv2.imencode(".jpg", name_img)
-            if name_width > max_name_width:
-                max_name_width = name_width
-                #worksheet.set_column("B:B", max_name_width+10)
-                worksheet.set_column_pixels("B:B", max_name_width+10)
-            worksheet.insert_image(f'B{cur_row}', f'name{cur_row}', {'image_data': io.BytesIO(buffer), 'object_position': 1})
-
-            # Damage image
-            damage_img = 255 - auto_crop(255 - hit_record.damage_rec_img)  # crop empty edges
-            damage_img = cv2.resize(damage_img, (0, 0), fx=0.5, fy=0.5)      # resize to 50%
-            damage_height, damage_width = damage_img.shape
-            is_success, buffer = cv2.imencode(".jpg", damage_img)
-            if damage_width > max_damage_width:
-                max_damage_width = damage_width
-                #orksheet.set_column("D:D", max_damage_width+10)
-                worksheet.set_column_pixels("D:D", max_damage_width+10)
-            worksheet.insert_image(f'D{cur_row}', f'damage{cur_row}', {'image_data': io.BytesIO(buffer)})
-
-            # Party image
-            party_img = cv2.resize(hit_record.party_img, (0, 0), fx=0.5, fy=0.5)
-            party_height, party_width, _ = party_img.shape
-            is_success, buffer = cv2.imencode(".jpg", party_img)
-            if party_width > max_party_width:
-                max_party_width = party_width
-                #worksheet.set_column("E:E", max_party_width+10)
-                worksheet.set_column_pixels("E:E", max_party_width+10)
-            worksheet.insert_image(f'E{cur_row}', f'party{cur_row}', {'image_data': io.BytesIO(buffer)})
-
-            # Boss image
-            boss_img = cv2.resize(hit_record.boss_img, (0, 0), fx=0.5, fy=0.5)
-            boss_height, boss_width, _ = boss_img.shape
-            is_success, buffer = cv2.imencode(".jpg", boss_img)
-            if boss_width > max_boss_width:
-                max_boss_width = boss_width
-                #worksheet.set_column("E:E", max_party_width+10)
-                worksheet.set_column_pixels("F:F", max_boss_width+10)
-            worksheet.insert_image(f'F{cur_row}', f'boss{cur_row}', {'image_data': io.BytesIO(buffer)})
-
-            # lvBoss Text image lvBoss
-            lvBoss_img = cv2.resize(hit_record.lvBoss_img, (0, 0), fx=0.5, fy=0.5)
-            lvBoss_height, lvBoss_width, _ = lvBoss_img.shape
-            is_success, buffer = cv2.imencode(".jpg", lvBoss_img)
-            if lvBoss_width > max_LvBoss_width:
-                max_LvBoss_width = lvBoss_width
-                #worksheet.set_column("G:G", max_LvBoss_width+10)
-                worksheet.set_column_pixels("G:G", max_LvBoss_width+10)
-            worksheet.insert_image(f'G{cur_row}', f'boss{cur_row}', {'image_data': io.BytesIO(buffer)})
-
-            # Hit image
-            hit_img = cv2.resize(hit_record.original_img, (0, 0), fx=0.7, fy=0.7)  # resize to 70%
-            hit_height, hit_width, _ = hit_img.shape
-            hit_image_scale = 0.3                       # we will scale in excel
-            hit_width = hit_width*hit_image_scale
-            hit_height = hit_height*hit_image_scale
-            is_success, buffer = cv2.imencode(".jpg", hit_img)
-            if hit_width > max_hit_width:
-                max_hit_width = hit_width
-                #worksheet.set_column("J:J", max_hit_width + 10)
-                worksheet.set_column_pixels("J:J", max_hit_width + 10)
-            worksheet.insert_image(f'J{cur_row}', f'hit{cur_row}', {'image_data': io.BytesIO(buffer), 'x_scale': hit_image_scale, 'y_scale': hit_image_scale})
-
-            # Now what is row height?
-            row_height = max(name_height, damage_height, party_height, boss_height, hit_height)
-            worksheet.set_row(cur_row - 1, row_height)
-            # worksheet.set_row_pixels(cur_row - 1, row_height)
-
-            # Add file name
-            worksheet.write(f'L{cur_row}', image_base_name)
-            worksheet.write(f'K{cur_row}', hit_index)
-            
-            cur_row += 1
-
-
-    # close work book
-    workbook.close()
-
-
-
-
+    # Partial hits are merged with adjacent screenshots and stitched screenshots must follow the scrolling,
+    # so they go in the order they were taken
+    if args.partial_hits or args.stitch:
+        files.sort(key=screenshot_order_key)
+
+    options = PipelineOptions(report_dir=args.report, debug=args.debug, batch_ocr=args.batch_ocr,
+                              ocr_backend=args.ocr, ocr_memo=not args.no_ocr_memo, dedup=args.dedup,
+                              thumbnails=any(output.needs_thumbnails for output in outputs),
+                              auto_layout=args.auto_layout, partial_hits=args.partial_hits, stitch=args.stitch,
+                              timing="trace" if args.trace else "stages" if args.timings else "",
+                              gallery=args.gallery, glyphs=args.glyphs,
+                              reocr=args.min_confidence if args.reocr else None,
+                              confidence=args.min_confidence is not None)
+
+    # Stage timings of all files (from this and worker processes) are collected by the run timer
+    setup_stage_timer(options)
+    run_timer = StageTimer(trace=bool(args.trace)) if options.timing else None
+    run_start = time.perf_counter()
+
+    # Recognition cache, so already processed screenshots are not recognized again.
+    # Stitched screenshots are recognized together with their neighbours, so they are not cached
+    cache = None
+    if args.stitch and (args.jobs > 1 or not args.no_cache):
+        logger.warning("--stitch: screenshots are recognized in one process without recognition cache")
+    if not args.no_cache and not args.stitch:
+        cache_file = args.cache_file or os.path.splitext(args.output)[0] + ".cache.sqlite"
+        cache = RecognitionCache(cache_file, dimensions_file, max_size_mb=args.cache_size, rebuild=args.rebuild_cache)
+
+    # OCR memo reuses OCR results of the same hits from overlapping screenshots (and previous runs)
+    memo_entries = cache.get_ocr_memo_entries(args.ocr) if cache and options.ocr_memo else []
+    setup_ocr_memo(options, memo_entries)
+    ocr_memo_stats = OcrMemoStats()
+
+    # Hit boxes deduplication. Unique boxes are collected over all screenshots
+    setup_hit_deduplicator(options)
+    deduplicator = HitDeduplicator() if options.dedup else None
+
+    # Recognize screenshots. In parallel mode workers send back only compact records
+    # (strings and JPEG thumbnails). Results come in the original file order
+    # so rows and duplicates marking are the same as in serial mode
+    executor = None
+    if args.jobs > 1 and not args.stitch:
+        executor = ProcessPoolExecutor(args.jobs, initializer=init_worker,
+                                       initargs=(args.tesseract, df_path, options, memo_entries, log_level))
+    chunk_size = math.ceil(len(files) / args.jobs) if args.dedup and args.jobs > 1 else 1
+    watcher = None
+    manifest = None
+    if args.watch:
+        # Hits of each file are flushed to outputs before the file is recorded in the manifest,
+        # so after a restart files of the manifest are skipped and nothing is lost
+        manifest = ProcessedManifest(args.manifest or os.path.splitext(args.output)[0] + ".manifest.jsonl")
+        watcher = FolderWatcher(args.inputs, manifest, settle_seconds=args.settle, poll_interval=args.poll_interval)
+        logger.info("Watching %s for new screenshots (%d already processed). Press Ctrl+C to stop",
+                    ", ".join(args.inputs), len(manifest))
+        processed_files = (processed_file for batch in watcher.batches()
+                           for processed_file in process_files(batch, dimensions_file, options, executor=executor,
+                                                               cache=cache, deduplicator=deduplicator))
+    elif options.stitch:
+        processed_files = process_stitched_files(files, dimensions_file, options, deduplicator=deduplicator)
+    else:
+        processed_files = process_files(files, dimensions_file, options, executor=executor, cache=cache,
+                                        deduplicator=deduplicator, chunk_size=chunk_size)
+
+    # Misread names are snapped to the roster, so the same member is one name in outputs and partial hits merging
+    if roster:
+        processed_files = roster.canonicalize(processed_files)
+
+    # Parts of hits cut by the hits window are merged with adjacent screenshots (in the order of files)
+    partial_hit_merger = PartialHitMerger() if options.partial_hits else None
+    if partial_hit_merger:
+        processed_files = partial_hit_merger.merge(processed_files)
 
+    # Iterate over screenshot files
+    try:
+        for processed_file in processed_files:
+            if processed_file.ocr_memo_stats:
+                ocr_memo_stats += processed_file.ocr_memo_stats
+            if run_timer and processed_file.stage_timings:
+                run_timer.merge(processed_file.stage_timings)
+            for output in outputs:
+                with timed(f"write_{output.name}"):
+                    output.write(processed_file)
+            if manifest is not None:
+                for output in outputs:
+                    output.flush()
+                manifest.add(processed_file, watcher.identities.pop(processed_file.file_name, None))
+    except KeyboardInterrupt:
+        if not args.watch:
+            raise
+        logger.info("Stopped watching")
+    if watcher:
+        watcher.close()
+        manifest.close()
+
+    if executor:
+        executor.shutdown()
+
+    if options.ocr_memo:
+        print(f"OCR memo: {ocr_memo_stats}")
+
+    # Write all screenshots where each unique box was seen
+    if deduplicator:
+        for output in outputs:
+            output.write_duplicate_sources(deduplicator)
+        print(f"Deduplication: {deduplicator.unique_count} unique hit boxes, "
+              f"{deduplicator.collapsed_count} duplicated boxes collapsed")
+
+    if partial_hit_merger:
+        print(f"Partial hits: {partial_hit_merger.stats}")
+
+    if roster:
+        print(f"Roster: {roster.stats}")
+
+    if cache:
+        print(f"Recognition cache '{cache.file_name}': {cache.stats}")
+        cache.close()
+
+    # close work book(s) and other outputs
+    for output in outputs:
+        with timed(f"close_{output.name}"):
+            output.close()
+
+    if run_timer:
+        run_timer.merge(get_stage_timer().take())
+        print("Stage timings (stages may be nested, e.g. process_file has all stages of a file):")
+        print(run_timer.format_summary())
+        if args.timings:
+            run_timer.write_json(args.timings, files=len(files), jobs=args.jobs,
+                                 wall_time_s=round(time.perf_counter() - run_start, 3))
+            print(f"Stage timings are written to '{args.timings}'")
+        if args.trace:
+            run_timer.write_chrome_trace(args.trace)
+            print(f"Trace is written to '{args.trace}'")
+    print("Output files: " + ", ".join(file_name for output in outputs for file_name in output.file_names))
@@ -1 +1,2 @@
-from .image_reco import recognize_screenshot, DimensionsFile, RecognizedImage, RecognizedHitRecord
\ No newline at end of file
+from .image_reco import recognize_screenshot, DimensionsFile, RecognizedImage, RecognizedHitRecord
+from .dimensions import DimensionsFileError
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""
+Automatic layout detection: finds the hits window (battle log list) in a screenshot without
+hits_window coordinates from dimensions.yaml
+
+Hit boxes are bright rectangles separated by a dark (< 15) frame. The screenshot is thresholded
+as in find_hit_boxes, shrunk by min-pooling (so dark frame lines survive) and bright connected
+components are searched. Components which look like hit boxes (wide, stacked in one column
+with the same x and width) give the hits window. Left and right edges of the column are refined
+on the full size mask by the column projection profile of the tallest box.
+
+Detection takes a few milliseconds and is done once per resolution (see DimensionsFile.get_auto_crop_rects)
+"""
+
+import logging
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Detected layout. hits_window is (x_start, y_start, x_end, y_end) in the screenshot
+HitsLayout = namedtuple('HitsLayout', ['hits_window',       # (x_start, y_start, x_end, y_end)
+                                       'box_width',         # Width of hit boxes
+                                       'box_height',        # Height of the tallest (full) hit box
+                                       'boxes_count'])      # Number of hit boxes which were found
+
+# Height of the shrunk mask where components are searched
+DETECTION_HEIGHT = 360
+
+# A hit box is at least this part of the screenshot width, and its width / height is in this range
+MIN_BOX_WIDTH_PART = 0.3
+MIN_BOX_ASPECT = 3
+MAX_BOX_ASPECT = 20
+
+# At least this number of boxes in a column is needed to trust the detection
+MIN_BOXES = 2
+
+
+def _box_column(stats, scale, img_width):
+    """Selects the largest column of hit box like components. Returns list of (x, y, width, height) or []"""
+    candidates = []
+    for x, y, width, height, _ in stats[1:]:
+        if width * scale >= MIN_BOX_WIDTH_PART * img_width and MIN_BOX_ASPECT * height <= width <= MAX_BOX_ASPECT * height:
+            candidates.append((int(x), int(y), int(width), int(height)))
+
+    # Boxes of one column have the same x and width (+-1 pixel of the shrunk mask)
+    columns = []
+    for box in candidates:
+        for column in columns:
+            if abs(column[0][0] - box[0]) <= 1 and abs(column[0][2] - box[2]) <= 1:
+                column.append(box)
+                break
+        else:
+            columns.append([box])
+    if not columns:
+        return []
+    return max(columns, key=lambda column: (len(column), column[0][2]))
+
+
+def _refine_edge(profile, start, end, rising):
+    """Index in profile[start:end] where it changes from dark to bright (rising) or bright to dark. None if no change"""
+    start = max(start, 1)
+    end = min(end, len(profile))
+    for index in range(start, end):
+        if profile[index] != profile[index - 1] and profile[index] == rising:
+            return index
+    return None
+
+
+def detect_hits_layout(img, gray=None, debug=0):
+    """
+    Finds hits window in the screenshot
+    :param img: screenshot (cv2 image)
+    :param gray: grayscale screenshot if it is already made
+    :param debug: 1 = just prints, 2 = show image processing
+    :return: HitsLayout or None if hit boxes are not found
+    """
+    if gray is None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    img_height, img_width = gray.shape[:2]
+
+    # The same threshold as find_hit_boxes uses. Bright - boxes, dark - frame
+    mask = cv2.threshold(gray, 15, 255, cv2.THRESH_BINARY)[1]
+
+    # Min-pooling: a shrunk pixel is bright only if all its pixels are bright, so thin dark lines stay
+    scale = max(img_height // DETECTION_HEIGHT, 1)
+    small = mask
+    if scale > 1:
+        small_width, small_height = img_width // scale, img_height // scale
+        small = cv2.resize(mask[:small_height * scale, :small_width * scale], (small_width, small_height),
+                           interpolation=cv2.INTER_AREA)
+        small = cv2.threshold(small, 254, 255, cv2.THRESH_BINARY)[1]
+
+    _, _, stats, _ = cv2.connectedComponentsWithStats(small, connectivity=8)
+    column = _box_column(stats, scale, img_width)
+    if len(column) < MIN_BOXES:
+        logger.warning("detect_hits_layout: hit boxes are not found (found %d of %d needed)", len(column), MIN_BOXES)
+        return None
+
+    # Coarse coordinates of the column in the screenshot
+    x_start = min(box[0] for box in column) * scale
+    x_end = max(box[0] + box[2] for box in column) * scale
+    y_start = min(box[1] for box in column) * scale
+    y_end = max(box[1] + box[3] for box in column) * scale
+    tallest = max(column, key=lambda box: box[3])
+
+    # Refine left and right edges: column profile of the middle half of the tallest box
+    strip_start = (tallest[1] + tallest[3] // 4) * scale
+    strip_end = (tallest[1] + 3 * tallest[3] // 4) * scale
+    profile = np.count_nonzero(mask[strip_start:strip_end], axis=0) * 2 > strip_end - strip_start
+    left = _refine_edge(profile, x_start - 2 * scale, x_start + 2 * scale + 1, rising=True)
+    right = _refine_edge(profile, x_end - 2 * scale, x_end + 2 * scale + 1, rising=False)
+    x_start = left if left is not None else x_start
+    x_end = right if right is not None else x_end
+    box_width = x_end - x_start
+
+    # Window keeps a few pixels of the dark frame around the boxes (as hits_window in dimensions.yaml)
+    margin = max(box_width // 200, 2)
+    hits_window = (max(x_start - margin, 0), max(y_start - margin - scale, 0),
+                   min(x_end + margin, img_width), min(y_end + margin + scale, img_height))
+
+    logger.info("detect_hits_layout: found %d hit boxes, width=%d, hits window: %s", len(column), box_width, hits_window)
+    if debug >= 2:
+        debug_img = cv2.rectangle(img.copy(), hits_window[:2], hits_window[2:], (255, 0, 0), 2)
+        cv2.imshow("detect_hits_layout", debug_img)
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
+
+    return HitsLayout(hits_window, box_width, tallest[3] * scale, len(column))
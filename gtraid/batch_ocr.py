@@ -0,0 +1,211 @@
+"""
+Batched OCR: stitches many field images into one composite page and runs tesseract once.
+
+pytesseract.image_to_string starts a new tesseract process (and writes a temp image) on every call.
+With ~8 hits per screenshot and 3 recognized fields per hit it is ~24 process launches per image.
+Here all field images are stacked vertically on a white page with big white gaps between them,
+tesseract is called once per page with image_to_data, and every recognized word is mapped back
+to the field image (region) it belongs to by the position of its box.
+"""
+
+import logging
+
+import cv2
+import numpy as np
+import pytesseract
+
+logger = logging.getLogger(__name__)
+
+
+# White gap between stacked images. Should be big enough so tesseract doesn't merge lines of
+# different regions into one text line or paragraph
+REGION_GAP = 40
+
+# Composite pages higher than this are split to several pages (tesseract limit is 32767)
+MAX_PAGE_HEIGHT = 30000
+
+
+def _to_gray(img):
+    """Composite page is grayscale. Masks are grayscale already, but some may come as RGB"""
+    if len(img.shape) == 3:
+        return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    return img
+
+
+def _split_to_pages(images, gap=REGION_GAP, max_page_height=MAX_PAGE_HEIGHT):
+    """Splits images to groups (pages) so each page is not higher than max_page_height"""
+    pages = []
+    page = []
+    page_height = gap
+    for index, img in enumerate(images):
+        img_height = img.shape[0] + gap
+        if page and page_height + img_height > max_page_height:
+            pages.append(page)
+            page = []
+            page_height = gap
+        page.append(index)
+        page_height += img_height
+    if page:
+        pages.append(page)
+    return pages
+
+
+def build_composite_page(images, gap=REGION_GAP):
+    """
+    Stacks images vertically on one white page
+
+    :param images: list of grayscale (black text on white) images
+    :param gap: white gap between images (and page margins)
+    :return: page image, list of regions (y_start, y_end) for each image
+    """
+    page_width = max(img.shape[1] for img in images) + 2 * gap
+    page_height = sum(img.shape[0] for img in images) + gap * (len(images) + 1)
+
+    page = np.full((page_height, page_width), 255, dtype=np.uint8)
+    regions = []
+    y = gap
+    for img in images:
+        height, width = img.shape[:2]
+        page[y:y + height, gap:gap + width] = img
+        regions.append((y, y + height))
+        y += height + gap
+
+    return page, regions
+
+
+def _region_index(regions, y_center):
+    """Finds a region which contains y_center. Returns -1 if y is in a gap"""
+    for index, (y_start, y_end) in enumerate(regions):
+        if y_start <= y_center < y_end:
+            return index
+    return -1
+
+
+def _words_to_text(words):
+    """
+    Assembles words the same way tesseract text renderer does:
+    words are joined by space, each line ends with new line, paragraphs are separated by
+    an empty line, the page ends with form feed
+
+    :param words: list of (block_num, par_num, line_num, word_num, text)
+    """
+    if not words:
+        return "\f"
+
+    text = ""
+    prev_par = None
+    prev_line = None
+    for block_num, par_num, line_num, word_num, word in sorted(words):
+        par = (block_num, par_num)
+        line = (block_num, par_num, line_num)
+        if prev_line is None:
+            text += word
+        elif line == prev_line:
+            text += " " + word
+        elif par == prev_par:
+            text += "\n" + word
+        else:
+            text += "\n\n" + word
+        prev_par = par
+        prev_line = line
+
+    return text + "\n\f"
+
+
+def words_confidence(confidences):
+    """
+    Confidence of a text (0..1) by tesseract confidences (0..100) of its words: the least sure word.
+    A text without words is not sure at all. All OCR backends give confidence this way (see ocr_backend.py)
+    """
+    return min(confidences) / 100 if confidences else 0.0
+
+
+def data_to_text(data):
+    """
+    Text and its confidence of pytesseract.image_to_data (dict output) of one image
+    :return: (text as image_to_string gives it, confidence 0..1)
+    """
+    page_height = max((top + height for top, height in zip(data["top"], data["height"])), default=0)
+    return map_words_to_regions(data, [(0, page_height + 1)], with_confidence=True)[0]
+
+
+def map_words_to_regions(data, regions, with_confidence=False):
+    """
+    Maps words from pytesseract.image_to_data (dict output) to regions
+
+    :param data: pytesseract.image_to_data(..., output_type=Output.DICT) result
+    :param regions: list of regions (y_start, y_end)
+    :param with_confidence: return (text, confidence 0..1) for each region (see words_confidence)
+    :return: list of texts, one per region
+    """
+    region_words = [[] for _ in regions]
+    region_confidences = [[] for _ in regions]
+    for i, word in enumerate(data["text"]):
+        if not word or not word.strip():
+            continue
+        y_center = data["top"][i] + data["height"][i] // 2
+        index = _region_index(regions, y_center)
+        if index < 0:
+            logger.debug("batch_ocr: word '%s' at y=%d doesn't belong to any region", word, y_center)
+            continue
+        region_words[index].append((data["block_num"][i], data["par_num"][i],
+                                    data["line_num"][i], data["word_num"][i], word))
+        region_confidences[index].append(max(float(data["conf"][i]), 0.0))
+
+    if with_confidence:
+        return [(_words_to_text(words), words_confidence(confidences))
+                for words, confidences in zip(region_words, region_confidences)]
+    return [_words_to_text(words) for words in region_words]
+
+
+class BatchOcrStats:
+    """Counts how many tesseract calls batching saved"""
+
+    def __init__(self):
+        self.images = 0         # Images (fields) recognized
+        self.pages = 0          # Composite pages (actual tesseract launches)
+
+    @property
+    def saved_calls(self):
+        return self.images - self.pages
+
+    def __repr__(self):
+        return f"BatchOcrStats(images={self.images}, pages={self.pages}, saved_calls={self.saved_calls})"
+
+
+# Statistics for the whole process
+stats = BatchOcrStats()
+
+
+def batch_image_to_data(images, lang=None, config='', gap=REGION_GAP, max_page_height=MAX_PAGE_HEIGHT):
+    """
+    Recognizes many images with a single tesseract call (or a few calls if the page is too big).
+    Works as many pytesseract.image_to_string calls but gives one text per image.
+
+    :param images: list of images (black text on white background). Can be taken from many screenshots
+    :param lang: tesseract language as for image_to_string
+    :param config: tesseract config as for image_to_string
+    :param gap: white gap between images on a composite page
+    :param max_page_height: maximum height of a composite page
+    :return: list of (recognized string, confidence 0..1), one per image
+    """
+    if not images:
+        return []
+
+    images = [_to_gray(img) for img in images]
+    texts = [("\f", 0.0)] * len(images)
+
+    for page_indexes in _split_to_pages(images, gap, max_page_height):
+        page, regions = build_composite_page([images[i] for i in page_indexes], gap)
+        data = pytesseract.image_to_data(page, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+        for index, text in zip(page_indexes, map_words_to_regions(data, regions, with_confidence=True)):
+            texts[index] = text
+        stats.pages += 1
+
+    stats.images += len(images)
+    return texts
+
+
+def batch_image_to_string(images, lang=None, config='', gap=REGION_GAP, max_page_height=MAX_PAGE_HEIGHT):
+    """batch_image_to_data without confidences: list of recognized strings, one per image"""
+    return [text for text, _ in batch_image_to_data(images, lang, config, gap, max_page_height)]
@@ -0,0 +1,127 @@
+"""
+Binarization of the hits window and field images
+
+Text of hits is white on a dark box, hit boxes are lighter than the black background. Each step of
+recognition makes a binary image by a threshold:
+- boxes     - hits window mask to find hit boxes (white boxes on black)
+- name_time - name field mask which leaves the name without time, to find where the name ends
+- name      - name (without time, upscaled by 2) prepared for OCR, black on white
+- damage    - damage prepared for OCR and glyph reading, black on white
+- boss      - lvBoss prepared for OCR, black on white
+
+Threshold of each step is set for each resolution in dimensions.yaml (binarization section, see
+DimensionsFile). Steps which are not set use DEFAULT_THRESHOLDS (the thresholds recognition always had).
+Methods:
+- fixed    - global threshold value
+- otsu     - threshold is picked by the histogram of each field image (Otsu's method)
+- adaptive - threshold of each pixel is the gaussian mean of its block_size x block_size neighbourhood minus c,
+             so uneven brightness of a field doesn't matter
+- auto     - value is the threshold for the colors of the game (REFERENCE_LEVELS: background and white text
+             of the hits window). It is mapped linearly to the levels of the first screenshot of a resolution,
+             and the mapped threshold is used for the rest of screenshots of this resolution (ThresholdCalibration).
+             So darker, brighter or low contrast screenshots of other devices get proportional thresholds
+
+Thresholds are applied to slices (views) of the grayscale hits window, so nothing but the field masks
+is allocated, and inverted masks are made by THRESH_BINARY_INV in the same call.
+"""
+
+import logging
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+THRESHOLD_METHODS = ('fixed', 'otsu', 'adaptive', 'auto')
+
+# How to binarize: method (see THRESHOLD_METHODS), threshold value (fixed, auto), adaptive block size and constant
+ThresholdSettings = namedtuple('ThresholdSettings', ['method', 'value', 'block_size', 'c'],
+                               defaults=[0, 31, -20])
+
+# Thresholds of each step (as they were before they could be configured)
+DEFAULT_THRESHOLDS = {
+    'boxes': ThresholdSettings('fixed', 15),
+    'name_time': ThresholdSettings('fixed', 200),
+    'name': ThresholdSettings('fixed', 130),
+    'damage': ThresholdSettings('fixed', 160),
+    'boss': ThresholdSettings('fixed', 160),
+}
+
+# Background and white text levels of the hits window of screenshots of the game (LEVEL_PERCENTILES of pixels)
+REFERENCE_LEVELS = (13, 241)
+LEVEL_PERCENTILES = (5, 99)
+
+
+def apply_threshold(gray, settings, inverted=False, dst=None):
+    """
+    Binary image of a grayscale image
+    :param gray: grayscale image (may be a slice of a bigger image)
+    :param settings: ThresholdSettings. 'auto' ones have to be resolved by ThresholdCalibration first
+    :param inverted: dark pixels become white (text becomes black on white)
+    :param dst: image to write the result to (may be gray itself), None - a new image
+    :return: binary image (0 and 255)
+    """
+    if not gray.size:
+        return np.empty_like(gray)
+    threshold_type = cv2.THRESH_BINARY_INV if inverted else cv2.THRESH_BINARY
+    if settings.method == 'adaptive':
+        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, threshold_type,
+                                     settings.block_size, settings.c, dst=dst)
+    if settings.method == 'otsu':
+        return cv2.threshold(gray, 0, 255, threshold_type | cv2.THRESH_OTSU, dst=dst)[1]
+    return cv2.threshold(gray, settings.value, 255, threshold_type, dst=dst)[1]
+
+
+def brightness_levels(gray):
+    """(background, white text) levels of a grayscale hits window: LEVEL_PERCENTILES of its pixels"""
+    return tuple(float(level) for level in np.percentile(gray, LEVEL_PERCENTILES))
+
+
+def map_threshold(value, levels):
+    """Threshold value for REFERENCE_LEVELS mapped to other (background, white text) levels"""
+    (reference_dark, reference_bright), (dark, bright) = REFERENCE_LEVELS, levels
+    mapped = dark + (value - reference_dark) * (bright - dark) / (reference_bright - reference_dark)
+    return int(round(min(max(mapped, 0), 255)))
+
+
+class ThresholdCalibration:
+    """Brightness levels of the first screenshot of each resolution for 'auto' thresholds of the rest"""
+
+    def __init__(self):
+        self._levels = {}       # resolution -> (background, white text) levels
+
+    def __len__(self):
+        return len(self._levels)
+
+    def thresholds(self, resolution, thresholds, gray):
+        """
+        Thresholds to apply: 'auto' ones become fixed with the mapped threshold
+        :param resolution: resolution name like 'w1280h720'
+        :param thresholds: {step: ThresholdSettings}
+        :param gray: grayscale hits window (calibrates the resolution if it is the first screenshot of it)
+        :return: {step: ThresholdSettings}
+        """
+        if all(settings.method != 'auto' for settings in thresholds.values()):
+            return thresholds
+        levels = self._levels.get(resolution)
+        if levels is None:
+            levels = self._levels[resolution] = brightness_levels(gray)
+            logger.info("ThresholdCalibration: '%s' levels are %.0f-%.0f (reference %d-%d)", resolution,
+                        *levels, *REFERENCE_LEVELS)
+        return {step: settings._replace(method='fixed', value=map_threshold(settings.value, levels))
+                if settings.method == 'auto' else settings
+                for step, settings in thresholds.items()}
+
+
+# Calibrated thresholds of this process
+_threshold_calibration = ThresholdCalibration()
+
+
+def set_threshold_calibration(calibration):
+    global _threshold_calibration
+    _threshold_calibration = calibration
+
+
+def get_threshold_calibration():
+    return _threshold_calibration
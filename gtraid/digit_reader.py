@@ -0,0 +1,226 @@
+"""
+Damage recognition by glyph templates instead of general OCR
+
+Damage is a formatted integer ("6,603,170") in one font, white on the dark hit box. prepare_damage
+makes it black on white, and its glyphs never touch, so:
+
+1. Glyphs are found by column projection: runs of columns with black pixels. Each glyph is cut from
+   the text line (rows with black pixels of the whole field), so a comma keeps its place at the bottom
+2. A glyph is downscaled to GLYPH_SIZE and normalized (zero mean, unit norm)
+3. The glyph bank has templates of "0"-"9" and "," made from screenshots of each resolution (line height).
+   Glyphs of a field are compared with the templates of the nearest line height by one matrix product
+   (normalized cross correlation). Templates with another width/height ratio are not candidates
+4. Confidence of a glyph is its correlation with the best template. The text is taken if all glyphs
+   are at least min_confidence and it is a well formed number (groups of 3 digits), otherwise the
+   damage is recognized by OCR as before
+
+The bank (gallery/damage_glyphs.npz) is made from screenshots with known damages (ground truth):
+    python -m gtraid.digit_reader build -o gallery/damage_glyphs.npz
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import re
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Size of a normalized glyph (width, height)
+GLYPH_SIZE = (12, 16)
+
+# Glyphs of the bank
+GLYPH_LABELS = "0123456789,"
+
+# Minimal correlation of a glyph with its template to take the text without OCR
+MIN_CONFIDENCE = 0.9
+
+# Max relative difference of width/height ratios of a glyph and a template
+MAX_ASPECT_DIFFERENCE = 0.3
+
+# Templates of the same glyph and line height correlating at least this much are kept once
+MAX_SIMILAR = 0.98
+
+# Well formed damage: groups of 3 digits separated by commas
+DAMAGE_FORMAT = re.compile(r"^\d{1,3}(,\d{3})*$")
+
+# Damage read by glyphs: text, correlation of each glyph with its template, and if it can be taken without OCR
+DigitReading = namedtuple('DigitReading', ['text', 'confidences', 'confident'])
+
+
+def segment_glyphs(mask):
+    """
+    Glyphs of a prepared (black on white) damage image
+    :return: (list of (x_start, x_end) of glyphs, (y_start, y_end) of the text line)
+    """
+    ink = mask < 128
+    if len(ink.shape) == 3:
+        ink = ink[:, :, 0]
+    rows = np.flatnonzero(ink.any(axis=1))
+    if not rows.size:
+        return [], (0, 0)
+    columns = np.concatenate(([False], ink.any(axis=0), [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(columns))
+    return list(zip(edges[::2], edges[1::2])), (rows[0], rows[-1] + 1)
+
+
+def glyph_vectors(mask):
+    """
+    Normalized glyphs of a prepared damage image
+    :return: (matrix of glyph vectors (rows), width/height ratios, text line height)
+    """
+    glyphs, (y_start, y_end) = segment_glyphs(mask)
+    if len(mask.shape) == 3:
+        mask = mask[:, :, 0]
+    line_height = y_end - y_start
+    line = mask[y_start:y_end]
+    vectors = np.array([cv2.resize(line[:, x_start:x_end], GLYPH_SIZE, interpolation=cv2.INTER_AREA).ravel()
+                        for x_start, x_end in glyphs], dtype=np.float32).reshape(len(glyphs), -1)
+    vectors -= vectors.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms > 0, norms, 1)
+    aspects = np.array([(x_end - x_start) / max(line_height, 1) for x_start, x_end in glyphs], dtype=np.float32)
+    return vectors, aspects, line_height
+
+
+class GlyphBank:
+    """Templates of damage glyphs for each text line height (resolution)"""
+
+    def __init__(self, min_confidence=MIN_CONFIDENCE):
+        self.min_confidence = min_confidence
+        self.labels = np.zeros(0, dtype='<U1')
+        self.heights = np.zeros(0, dtype=np.int32)
+        self.aspects = np.zeros(0, dtype=np.float32)
+        self.templates = np.zeros((0, GLYPH_SIZE[0] * GLYPH_SIZE[1]), dtype=np.float32)
+
+    @classmethod
+    def load(cls, file_name, min_confidence=MIN_CONFIDENCE):
+        """Loads the bank saved by save. Raises OSError, ValueError (not a bank file), KeyError"""
+        bank = cls(min_confidence)
+        with np.load(file_name) as data:
+            bank.labels = data['labels']
+            bank.heights = data['heights']
+            bank.aspects = data['aspects']
+            bank.templates = data['templates'].astype(np.float32)
+        logger.info("GlyphBank: %d templates for line heights %s from '%s'", len(bank.labels),
+                    sorted(set(bank.heights.tolist())), file_name)
+        return bank
+
+    def save(self, file_name):
+        np.savez_compressed(file_name, labels=self.labels, heights=self.heights, aspects=self.aspects,
+                            templates=self.templates.astype(np.float16))
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def signature(self):
+        """Hash of the templates (for cache keys)"""
+        digest = hashlib.sha1(f"{self.min_confidence}:{''.join(self.labels)}".encode("utf-8"))
+        digest.update(self.heights.tobytes())
+        digest.update(self.templates.astype(np.float16).tobytes())
+        return digest.hexdigest()
+
+    def add(self, mask, text):
+        """
+        Adds glyphs of a prepared damage image with known text (e.g. "6,603,170") to the bank
+        :return: False if glyphs don't match the text
+        """
+        vectors, aspects, line_height = glyph_vectors(mask)
+        if len(vectors) != len(text) or not set(text) <= set(GLYPH_LABELS):
+            return False
+        for vector, aspect, label in zip(vectors, aspects, text):
+            same = (self.labels == label) & (self.heights == line_height)
+            if same.any() and (self.templates[same] @ vector).max() >= MAX_SIMILAR:
+                continue
+            self.labels = np.append(self.labels, label)
+            self.heights = np.append(self.heights, np.int32(line_height))
+            self.aspects = np.append(self.aspects, aspect)
+            self.templates = np.vstack((self.templates, vector))
+        return True
+
+    def read(self, mask):
+        """
+        Reads damage of a prepared (black on white) damage image
+        :return: DigitReading
+        """
+        vectors, aspects, line_height = glyph_vectors(mask)
+        if not len(vectors) or not len(self.labels):
+            return DigitReading("", (), False)
+
+        # Templates of the nearest line height
+        distances = np.abs(self.heights - line_height)
+        group = distances == distances.min()
+        labels, templates = self.labels[group], self.templates[group]
+
+        scores = vectors @ templates.T
+        template_aspects = self.aspects[group]
+        scores[np.abs(aspects[:, None] - template_aspects[None, :]) > MAX_ASPECT_DIFFERENCE * template_aspects] = -1
+        best = scores.argmax(axis=1)
+        confidences = tuple(float(score) for score in scores[np.arange(len(vectors)), best])
+        text = "".join(labels[best])
+        confident = min(confidences) >= self.min_confidence and bool(DAMAGE_FORMAT.match(text))
+        return DigitReading(text, confidences, confident)
+
+
+# Glyph bank used by recognize_screenshot in this process. None = damage is recognized by OCR only
+_glyph_bank = None
+
+
+def set_glyph_bank(bank):
+    global _glyph_bank
+    _glyph_bank = bank
+
+
+def get_glyph_bank():
+    return _glyph_bank
+
+
+if __name__ == "__main__":
+    import yaml
+
+    from .dimensions import DimensionsFile
+    from .image_reco import find_hit_boxes, prepare_hit_fields
+
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+    parser = argparse.ArgumentParser(description="Makes the damage glyph bank from screenshots with known damages")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Make the glyph bank")
+    build_parser.add_argument("--truth", default=os.path.join(root_dir, "benchmarks", "ground_truth.yaml"),
+                              help="Damages of hit boxes of screenshots from the top to the bottom "
+                                   "(benchmarks/ground_truth.yaml format)")
+    build_parser.add_argument("--images", default=os.path.join(root_dir, "test_images"),
+                              help="Folder of screenshots of the truth file")
+    build_parser.add_argument("-o", "--output", required=True, help="Glyph bank file (.npz)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    with open(args.truth, encoding="utf-8") as truth_file:
+        truth = yaml.safe_load(truth_file)
+    dimensions_file = DimensionsFile(os.path.join(root_dir, "dimensions.yaml"))
+    glyph_bank = GlyphBank()
+    added = skipped = 0
+    for truth_key, expected_hits in truth.items():
+        img = cv2.imread(os.path.join(args.images, *truth_key.split("/")))
+        if img is None:
+            logger.warning("Can't read '%s'", truth_key)
+            continue
+        crop_rects = dimensions_file.get_crop_rects(img)
+        window = crop_rects.hits_window.crop(img)
+        window_gray = cv2.cvtColor(window, cv2.COLOR_BGR2GRAY)
+        hit_rects = crop_rects.hit_image
+        boxes = sorted(find_hit_boxes(window, hit_rects.min_width, hit_rects.min_height, debug=0, gray=window_gray),
+                       key=lambda box: box.y)
+        for fields, expected in zip(prepare_hit_fields(window_gray, boxes, hit_rects), expected_hits):
+            if glyph_bank.add(fields.damage, f"{int(expected['damage']):,}"):
+                added += 1
+            else:
+                skipped += 1
+                logger.warning("%s: glyphs of the damage don't match %s", truth_key, expected['damage'])
+    glyph_bank.save(args.output)
+    print(f"{len(glyph_bank)} templates of {added} damages ({skipped} skipped) saved to '{args.output}'")
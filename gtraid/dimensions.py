@@ -0,0 +1,415 @@
+"""
+Dimensions file (dimensions.yaml): how to crop screenshots of each resolution
+
+The file is compiled once when loaded: each resolution becomes ResolutionDimensions with
+CropRect objects (coordinates + ready to use slices), indexed by (width, height).
+Everything is validated at load, so a typo is reported right away with the resolution and
+the field name, instead of a KeyError in the middle of a run.
+
+Screenshots with the same aspect ratio have the same layout, just scaled. So each resolution
+of the file also defines an aspect ratio family with coordinates normalized to 0..1.
+A resolution which is not in the file is cropped by the family with the closest aspect ratio
+(ASPECT_RATIO_TOLERANCE), its pixel rects are computed once and cached.
+
+With auto layout (get_auto_crop_rects) the hits window is detected in the screenshot instead
+(see auto_layout.py), so hits_window coordinates of the file are not needed.
+
+Optional binarization section of a resolution sets thresholds of recognition steps (see binarization.py):
+    binarization:
+        damage:
+            method: auto
+        name:
+            method: adaptive
+            block_size: 31
+            c: -20
+"""
+
+import hashlib
+import logging
+import re
+
+import yaml
+
+from .auto_layout import detect_hits_layout
+from .binarization import DEFAULT_THRESHOLDS, THRESHOLD_METHODS, ThresholdSettings
+
+logger = logging.getLogger(__name__)
+
+
+class DimensionsFileError(ValueError):
+    """Dimensions file has an error. The message names the resolution and the field"""
+    pass
+
+
+class CropRect:
+    """Rectangle to crop. Coordinates are absolute or relative to hit box (for hit_image rects)"""
+
+    __slots__ = ('x_start', 'y_start', 'x_end', 'y_end', 'rows', 'cols', 'corners')
+
+    def __init__(self, x_start, y_start, x_end, y_end):
+        self.x_start = x_start
+        self.y_start = y_start
+        self.x_end = x_end
+        self.y_end = y_end
+        self.rows = slice(y_start, y_end)                       # img[rect.rows, rect.cols] is the crop
+        self.cols = slice(x_start, x_end)
+        self.corners = ((x_start, y_start), (x_end, y_end))     # For cv2.rectangle and crop functions
+
+    @property
+    def width(self):
+        return self.x_end - self.x_start
+
+    @property
+    def height(self):
+        return self.y_end - self.y_start
+
+    def crop(self, img):
+        return img[self.rows, self.cols]
+
+    def __repr__(self):
+        return f"CropRect(x_start={self.x_start}, y_start={self.y_start}, x_end={self.x_end}, y_end={self.y_end})"
+
+
+class HitImageDimensions:
+    """How to find hit boxes and crop them (hit_image section)"""
+
+    __slots__ = ('min_width', 'min_height', 'name_rect', 'party_rect', 'damage_rect', 'boss_rect', 'lvBoss_rect')
+
+    def __init__(self, min_width, min_height, name_rect, party_rect, damage_rect, boss_rect, lvBoss_rect=None):
+        self.min_width = min_width
+        self.min_height = min_height
+        self.name_rect = name_rect
+        self.party_rect = party_rect
+        self.damage_rect = damage_rect
+        self.boss_rect = boss_rect
+        self.lvBoss_rect = lvBoss_rect      # None - boss name is not recognized for this resolution
+
+
+class ResolutionDimensions:
+    """Crop parameters of one resolution"""
+
+    __slots__ = ('name', 'width', 'height', 'hits_window', 'hit_image', 'source_name', 'binarization')
+
+    def __init__(self, name, width, height, hits_window, hit_image, source_name=None, binarization=None):
+        self.name = name                    # Like 'w1280h720'
+        self.width = width
+        self.height = height
+        self.hits_window = hits_window      # CropRect of the hits window in the screenshot
+        self.hit_image = hit_image          # HitImageDimensions
+        self.source_name = source_name or name  # Resolution in the file these parameters are scaled from
+        self.binarization = binarization or DEFAULT_THRESHOLDS  # step -> ThresholdSettings (see binarization.py)
+
+    def window_dimensions(self):
+        """Crop parameters for an image of the hits window alone (cropped from a screenshot of this resolution)"""
+        return ResolutionDimensions(self.name, self.hits_window.width, self.hits_window.height,
+                                    CropRect(0, 0, self.hits_window.width, self.hits_window.height), self.hit_image,
+                                    self.source_name, self.binarization)
+
+
+# Relative difference of aspect ratios when a screenshot may be cropped by an aspect ratio family
+ASPECT_RATIO_TOLERANCE = 0.015
+
+
+def _scale_rect(rect, scale_x, scale_y, max_width, max_height):
+    """Scales rect keeping it non-empty and inside max_width x max_height"""
+    x_start = min(round(rect.x_start * scale_x), max_width - 1)
+    y_start = min(round(rect.y_start * scale_y), max_height - 1)
+    x_end = max(min(round(rect.x_end * scale_x), max_width), x_start + 1)
+    y_end = max(min(round(rect.y_end * scale_y), max_height), y_start + 1)
+    return CropRect(x_start, y_start, x_end, y_end)
+
+
+def _scale_hit_image(hit_image, scale_x, scale_y, hits_window):
+    """Scales HitImageDimensions: hit boxes are scaled as everything else, so are rects inside them"""
+    rects = {}
+    for rect_name in _hit_rect_names + _optional_hit_rect_names:
+        rect = getattr(hit_image, rect_name)
+        rects[rect_name] = _scale_rect(rect, scale_x, scale_y, hits_window.width, hits_window.height) \
+            if rect is not None else None
+    min_width = max(round(hit_image.min_width * scale_x), 1)
+    min_height = max(round(hit_image.min_height * scale_y), 1)
+    return HitImageDimensions(min_width, min_height, **rects)
+
+
+class AspectRatioFamily:
+    """
+    Crop parameters of screenshots with the same aspect ratio. Coordinates are normalized to 0..1
+    of the screenshot size (the layout of the game is the same, just scaled)
+    """
+
+    __slots__ = ('source', 'aspect_ratio')
+
+    def __init__(self, source):
+        """:param source: ResolutionDimensions from the file the family is made of"""
+        self.source = source
+        self.aspect_ratio = source.width / source.height
+
+    def distance(self, width, height):
+        """Relative difference of aspect ratios"""
+        return abs(width / height - self.aspect_ratio) / self.aspect_ratio
+
+    def resolve(self, width, height):
+        """
+        Pixel crop parameters for a screenshot of this family
+        :return: ResolutionDimensions
+        """
+        source = self.source
+        scale_x, scale_y = width / source.width, height / source.height
+        hits_window = _scale_rect(source.hits_window, scale_x, scale_y, width, height)
+        return ResolutionDimensions(f"w{width}h{height}", width, height, hits_window,
+                                    _scale_hit_image(source.hit_image, scale_x, scale_y, hits_window),
+                                    source_name=source.name, binarization=source.binarization)
+
+
+_resolution_name_regex = re.compile(r"^w(\d+)h(\d+)$")
+
+# Rects of hit_image section. lvBoss_rect is optional (not all resolutions have it yet)
+_hit_rect_names = ['name_rect', 'party_rect', 'damage_rect', 'boss_rect']
+_optional_hit_rect_names = ['lvBoss_rect']
+
+
+def _compile_int(entry, key, path, res_name, min_value=0):
+    if not isinstance(entry, dict) or key not in entry:
+        raise DimensionsFileError(f"resolution '{res_name}': field '{path}.{key}' is missing")
+    value = entry[key]
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise DimensionsFileError(f"resolution '{res_name}': field '{path}.{key}' must be an integer, got '{value}'")
+    if value < min_value:
+        raise DimensionsFileError(f"resolution '{res_name}': field '{path}.{key}' must be >= {min_value}, got {value}")
+    return value
+
+
+def _compile_rect(entry, path, res_name, max_width, max_height):
+    """Compiles and validates a rect. max_width, max_height - size of the area where the rect is"""
+    coordinates = [_compile_int(entry, key, path, res_name) for key in ['x_start', 'y_start', 'x_end', 'y_end']]
+    rect = CropRect(*coordinates)
+    if rect.x_start >= rect.x_end or rect.y_start >= rect.y_end:
+        raise DimensionsFileError(f"resolution '{res_name}': field '{path}' is empty or inverted: {rect}")
+    if rect.x_end > max_width or rect.y_end > max_height:
+        raise DimensionsFileError(f"resolution '{res_name}': field '{path}' {rect} "
+                                  f"doesn't fit into {max_width}x{max_height}")
+    return rect
+
+
+def _compile_binarization(entry, res_name):
+    """Compiles and validates binarization section: {step: ThresholdSettings} with defaults for missing steps"""
+    if entry is None:
+        return DEFAULT_THRESHOLDS
+    if not isinstance(entry, dict):
+        raise DimensionsFileError(f"resolution '{res_name}': field 'binarization' must have steps "
+                                  f"{list(DEFAULT_THRESHOLDS)}")
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for step, step_entry in entry.items():
+        path = f'binarization.{step}'
+        if step not in DEFAULT_THRESHOLDS:
+            raise DimensionsFileError(f"resolution '{res_name}': unknown step '{path}'. "
+                                      f"Known steps: {list(DEFAULT_THRESHOLDS)}")
+        method = step_entry.get('method') if isinstance(step_entry, dict) else None
+        if method not in THRESHOLD_METHODS:
+            raise DimensionsFileError(f"resolution '{res_name}': field '{path}.method' must be one of "
+                                      f"{list(THRESHOLD_METHODS)}, got '{method}'")
+        settings = ThresholdSettings(method, DEFAULT_THRESHOLDS[step].value)
+        if method == 'fixed' or 'value' in step_entry:
+            settings = settings._replace(value=_compile_int(step_entry, 'value', path, res_name))
+            if settings.value > 255:
+                raise DimensionsFileError(f"resolution '{res_name}': field '{path}.value' must be <= 255, "
+                                          f"got {settings.value}")
+        if method == 'adaptive':
+            block_size = _compile_int(step_entry, 'block_size', path, res_name, min_value=3) \
+                if 'block_size' in step_entry else settings.block_size
+            if block_size % 2 == 0:
+                raise DimensionsFileError(f"resolution '{res_name}': field '{path}.block_size' must be odd, "
+                                          f"got {block_size}")
+            c = step_entry.get('c', settings.c)
+            if isinstance(c, bool) or not isinstance(c, (int, float)):
+                raise DimensionsFileError(f"resolution '{res_name}': field '{path}.c' must be a number, got '{c}'")
+            settings = settings._replace(block_size=block_size, c=c)
+        thresholds[step] = settings
+    return thresholds
+
+
+def compile_resolution(res_name, entry):
+    """
+    Compiles and validates crop parameters of a resolution from dimensions file
+    :param res_name: resolution name like 'w1280h720'
+    :param entry: raw parameters (dict from yaml)
+    :return: ResolutionDimensions. Raises DimensionsFileError
+    """
+    match = _resolution_name_regex.match(str(res_name))
+    if not match:
+        raise DimensionsFileError(f"resolution '{res_name}': name must be like 'w1280h720'")
+    width, height = int(match.group(1)), int(match.group(2))
+    if not isinstance(entry, dict):
+        raise DimensionsFileError(f"resolution '{res_name}': must have hits_window and hit_image fields")
+
+    hits_window = _compile_rect(entry.get('hits_window'), 'hits_window', res_name, width, height)
+
+    hit_entry = entry.get('hit_image')
+    if not isinstance(hit_entry, dict):
+        raise DimensionsFileError(f"resolution '{res_name}': field 'hit_image' is missing")
+    min_width = _compile_int(hit_entry, 'min_width', 'hit_image', res_name, min_value=1)
+    min_height = _compile_int(hit_entry, 'min_height', 'hit_image', res_name, min_value=1)
+
+    # Hit box is within the hits window, so are rects inside it
+    rects = {}
+    for rect_name in _hit_rect_names + _optional_hit_rect_names:
+        if rect_name in _optional_hit_rect_names and rect_name not in hit_entry:
+            rects[rect_name] = None
+            continue
+        rects[rect_name] = _compile_rect(hit_entry.get(rect_name), f'hit_image.{rect_name}', res_name,
+                                         hits_window.width, hits_window.height)
+
+    return ResolutionDimensions(res_name, width, height, hits_window,
+                                HitImageDimensions(min_width, min_height, **rects),
+                                binarization=_compile_binarization(entry.get('binarization'), res_name))
+
+
+class DimensionsFile:
+    """
+    DimensionsFile is yaml file that hold parameters how to crop and recognize image for different resolution
+    """
+
+    def __init__(self, config_file):
+        """
+        Loads, validates and compiles crop parameters for different resolutions.
+        Raises DimensionsFileError if something is wrong in the file
+
+        :param config_file:
+        """
+        logger.info("DimensionsFile: Loading file: '%s'", config_file)
+        with open(config_file, 'r') as stream:
+            try:
+                content = yaml.safe_load(stream)
+            except yaml.YAMLError as exc:
+                logger.error("DimensionsFile: can't parse '%s': %s", config_file, exc)
+                raise
+
+        if not isinstance(content, dict) or not isinstance(content.get("resolutions"), dict):
+            raise DimensionsFileError(f"'{config_file}' must have 'resolutions' section")
+        self._crop_rects = content["resolutions"]       # Raw parameters (for hashes)
+
+        # (width, height) -> ResolutionDimensions. Resolutions resolved by aspect ratio families are added here
+        self._resolutions = {}
+        self._families = []
+        for res_name, entry in self._crop_rects.items():
+            try:
+                dimensions = compile_resolution(res_name, entry)
+            except DimensionsFileError as ex:
+                raise DimensionsFileError(f"'{config_file}': {ex}") from None
+            self._resolutions[(dimensions.width, dimensions.height)] = dimensions
+            self._families.append(AspectRatioFamily(dimensions))
+            if dimensions.hit_image.lvBoss_rect is None:
+                logger.info("DimensionsFile: resolution '%s' has no hit_image.lvBoss_rect, boss is not recognized",
+                            res_name)
+
+        # The largest resolution of the same aspect ratio goes first (its coordinates are the most precise)
+        self._families.sort(key=lambda family: -family.source.width)
+
+        # (width, height) -> ResolutionDimensions with detected hits window (see get_auto_crop_rects)
+        self._detected = {}
+
+    def find_family(self, width, height):
+        """AspectRatioFamily with the closest aspect ratio or None if there is no close one"""
+        family = min(self._families, key=lambda family: family.distance(width, height), default=None)
+        if family is None or family.distance(width, height) > ASPECT_RATIO_TOLERANCE:
+            return None
+        return family
+
+    def get_dimensions(self, width, height):
+        """
+        ResolutionDimensions for the resolution. If the resolution is not in the file,
+        it is resolved by aspect ratio family (and cached). None if there is no such family
+        """
+        dimensions = self._resolutions.get((width, height))
+        if dimensions is None:
+            family = self.find_family(width, height)
+            if family is None:
+                return None
+            dimensions = family.resolve(width, height)
+            logger.info("DimensionsFile: resolution '%s' is not in the file, crop rects are scaled from '%s'",
+                        dimensions.name, family.source.name)
+            self._resolutions[(width, height)] = dimensions
+        return dimensions
+
+    def get_crop_rects(self, img):
+        """
+            STEP 0. Get crop parameters for a given resolution
+            :param img: screenshot
+            :return: ResolutionDimensions
+            """
+        height, width = img.shape[:2]
+        logger.debug("DimensionsFile:get_crop_rects: Searching data for resolution %dx%d", width, height)
+        dimensions = self.get_dimensions(width, height)
+        if dimensions is None:
+            err = f"The resolution '{self.get_resolution_name(img)}' is not found " \
+                  f"and there is no resolution with the same aspect ratio ({width / height:.3f})"
+            raise KeyError(err)
+        logger.debug("load_crop_rects: found data for resolution %s", dimensions.name)
+        return dimensions
+
+    def get_auto_crop_rects(self, img, gray=None):
+        """
+        Crop parameters with the hits window detected in the screenshot. The detected layout is cached
+        and reused for other screenshots of the same resolution. hit_image rects are taken from the
+        resolution in the file, or scaled by the detected box width from the resolution with the closest
+        hits window width. Falls back to get_crop_rects if hit boxes are not found
+
+        :param img: screenshot
+        :param gray: grayscale screenshot if it is already made
+        :return: ResolutionDimensions
+        """
+        height, width = img.shape[:2]
+        dimensions = self._detected.get((width, height))
+        if dimensions is not None:
+            return dimensions
+
+        layout = detect_hits_layout(img, gray)
+        if layout is None:
+            logger.warning("DimensionsFile:get_auto_crop_rects: layout is not detected, using crop rects of the file")
+            return self.get_crop_rects(img)
+        hits_window = CropRect(*layout.hits_window)
+
+        known = self._resolutions.get((width, height))
+        if known is not None and known.source_name == known.name:
+            # Exact resolution of the file, rects are right as they are
+            source = known
+            hit_image = known.hit_image
+        else:
+            source = min((family.source for family in self._families),
+                         key=lambda family_source: abs(family_source.hits_window.width - hits_window.width))
+            # Both windows are the column of hit boxes with a few pixels of the frame
+            scale = hits_window.width / source.hits_window.width
+            hit_image = _scale_hit_image(source.hit_image, scale, scale, hits_window)
+
+        dimensions = ResolutionDimensions(self.get_resolution_name(img), width, height, hits_window, hit_image,
+                                          source_name=source.name, binarization=source.binarization)
+        logger.info("DimensionsFile: detected hits window %s for '%s', hit rects are taken from '%s'",
+                    hits_window, dimensions.name, source.name)
+        self._detected[(width, height)] = dimensions
+        return dimensions
+
+    @staticmethod
+    def get_resolution_name(img):
+        """Name of the resolution in dimensions file like 'w1280h720'"""
+        height, width = img.shape[:2]
+        return f"w{width}h{height}"
+
+    @property
+    def resolution_names(self):
+        return list(self._crop_rects.keys())
+
+    def get_resolution_hash(self, res_name):
+        """
+        Hash of the crop parameters of a resolution. It changes only if parameters of this resolution
+        (or of the resolution it is scaled from) are changed in the file (used to invalidate cached results)
+        """
+        if res_name in self._crop_rects.keys():
+            dump = yaml.safe_dump(self._crop_rects[res_name], sort_keys=True)
+            return hashlib.sha1(dump.encode("utf-8")).hexdigest()
+
+        match = _resolution_name_regex.match(str(res_name))
+        dimensions = self.get_dimensions(int(match.group(1)), int(match.group(2))) if match else None
+        if dimensions is None:
+            return ""
+        dump = yaml.safe_dump(self._crop_rects[dimensions.source_name], sort_keys=True)
+        return hashlib.sha1(f"{dimensions.source_name}:{dump}".encode("utf-8")).hexdigest()
@@ -1,11 +1,283 @@
+"""
+Discord bot: officers upload raid screenshots to a channel, the bot recognizes them and saves the hits
+
+    python -m gtraid.discord_bot --token <bot token> --channel <channel id> -t /usr/bin/tesseract -j 4
+
+How a message with screenshots goes:
+1. ScreenshotIngestor.handle_message takes image attachments of the message. If the bot already has
+   max_pending screenshots (waiting and being recognized), the message is rejected with a reply,
+   so a flood of uploads can't pile up without a limit (backpressure)
+2. Attachments are downloaded asynchronously to the inbox folder (at most max_downloads at once)
+3. Each screenshot is recognized by process_file in a process pool (run_in_executor), so the event loop
+   is never blocked by OpenCV or tesseract. A guild has at most per_guild screenshots in the pool at once,
+   so one guild uploading hundreds of screenshots doesn't make others wait for all of them.
+   If a worker dies (out of memory, tesseract crash), the broken pool is replaced by a new one
+   and the screenshot is recognized once more
+4. Hits are written to the outputs (csv, jsonl, parquet, db, see output.py) in the order of attachments
+   and the bot replies with a summary
+
+ScreenshotIngestor doesn't depend on discord: messages and attachments are duck typed (see
+benchmarks/bench_discord_bot.py, which drives it with fake messages without network)
+"""
+
+import argparse
+import asyncio
+import functools
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 import discord
+import pytesseract
+
+from .output import create_output, output_file_name, parse_damage_number
+from .pipeline import LOG_FORMAT, PipelineOptions, ProcessedFile, init_worker, process_files_in_worker
+
+logger = logging.getLogger(__name__)
+
+# Extensions of screenshots (if an attachment has no content type)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Discord limit of a message length
+MAX_REPLY_LENGTH = 2000
+
+BotOptions = namedtuple('BotOptions',
+                        ['inbox_dir',           # Folder for downloaded screenshots
+                         'jobs',                # Number of recognition processes
+                         'max_pending',         # Max screenshots waiting and being recognized (all guilds)
+                         'per_guild',           # Max screenshots of a guild in the process pool at once (0 - jobs)
+                         'max_downloads',       # Max attachments downloaded at once
+                         'max_attachment_mb',   # Bigger attachments are skipped
+                         'channel_ids'],        # Channels to take screenshots from (empty - all channels)
+                        defaults=["discord_inbox", 2, 500, 0, 8, 10.0, frozenset()])
+
+# Result of a message: recognized files (ProcessedFile in the order of attachments)
+IngestResult = namedtuple('IngestResult', ['processed_files', 'rejected'])
+
+
+def is_screenshot(attachment):
+    """Attachment is an image (by content type or file extension)"""
+    if attachment.content_type:
+        return attachment.content_type.startswith("image/")
+    return attachment.filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def format_summary(processed_files):
+    """Reply text: number of screenshots, hits and total damage, and files which failed"""
+    hits = [hit for processed_file in processed_files for hit in processed_file.hit_records]
+    total_damage = 0
+    unparsed = 0
+    for hit in hits:
+        try:
+            total_damage += parse_damage_number(hit.damage) if hit.damage else 0
+        except ValueError:
+            unparsed += 1
+    names = {hit.name for hit in hits if hit.name}
+    lines = [f"Recognized {len(processed_files)} screenshot(s): {len(hits)} hits of {len(names)} players, "
+             f"total damage {total_damage:,}" + (f" ({unparsed} damages not recognized)" if unparsed else "")]
+    failed = [processed_file for processed_file in processed_files if processed_file.error]
+    if failed:
+        lines.append(f"Failed {len(failed)}:")
+        lines.extend(f"- {processed_file.image_base_name}: {processed_file.error}" for processed_file in failed)
+    text = "\n".join(lines)
+    return text if len(text) <= MAX_REPLY_LENGTH else text[:MAX_REPLY_LENGTH - 3] + "..."
+
+
+class ScreenshotIngestor:
+    """Downloads screenshots of messages, recognizes them in a process pool and writes hits to outputs"""
+
+    def __init__(self, executor, outputs, options=BotOptions(), executor_factory=None):
+        """
+        :param executor: ProcessPoolExecutor with workers initialized by init_worker
+        :param outputs: list of OutputSink. Hits of each message are written and flushed
+        :param options: BotOptions
+        :param executor_factory: makes a new executor like executor when its workers crash (None - never replaced)
+        """
+        self.executor = executor
+        self.executor_factory = executor_factory
+        self.outputs = outputs
+        self.options = options
+        self.pending = 0                # Screenshots accepted and not finished yet
+        self.stats = {"messages": 0, "rejected": 0, "screenshots": 0, "hits": 0, "failed": 0, "pool_restarts": 0}
+        self._downloads = asyncio.Semaphore(options.max_downloads)
+        self._guild_slots = {}          # guild id -> asyncio.Semaphore(per_guild)
+        if not os.path.isdir(options.inbox_dir):
+            os.makedirs(options.inbox_dir)
+
+    def _guild_semaphore(self, guild_id):
+        semaphore = self._guild_slots.get(guild_id)
+        if semaphore is None:
+            semaphore = self._guild_slots[guild_id] = asyncio.Semaphore(self.options.per_guild or self.options.jobs)
+        return semaphore
+
+    async def handle_message(self, message):
+        """
+        Recognizes screenshots attached to the message, saves hits and replies with a summary
+        :return: IngestResult or None if the message has no screenshots for the bot
+        """
+        if message.author.bot:
+            return None
+        if self.options.channel_ids and message.channel.id not in self.options.channel_ids:
+            return None
+        attachments = [attachment for attachment in message.attachments if is_screenshot(attachment)]
+        if not attachments:
+            return None
+
+        self.stats["messages"] += 1
+        if self.pending + len(attachments) > self.options.max_pending:
+            self.stats["rejected"] += 1
+            logger.warning("Rejected %d screenshots from %s: %d screenshots are pending",
+                           len(attachments), message.author, self.pending)
+            await message.reply(f"Too many screenshots are being recognized ({self.pending}), "
+                                f"please send these {len(attachments)} again in a few minutes")
+            return IngestResult([], rejected=True)
+
+        self.pending += len(attachments)
+        try:
+            guild_id = message.guild.id if message.guild else 0
+            processed_files = await asyncio.gather(*(self._process_attachment(message, index, attachment, guild_id)
+                                                     for index, attachment in enumerate(attachments)))
+        finally:
+            self.pending -= len(attachments)
+
+        for processed_file in processed_files:
+            self.stats["screenshots"] += 1
+            self.stats["hits"] += len(processed_file.hit_records)
+            self.stats["failed"] += bool(processed_file.error)
+            for output in self.outputs:
+                output.write(processed_file)
+        for output in self.outputs:
+            output.flush()
+
+        await message.reply(format_summary(processed_files))
+        return IngestResult(processed_files, rejected=False)
+
+    async def _process_attachment(self, message, index, attachment, guild_id):
+        """Downloads and recognizes one attachment. Errors are returned as ProcessedFile.error"""
+        file_name = os.path.join(self.options.inbox_dir, str(guild_id), f"{message.id}_{index}_{attachment.filename}")
+        image_base_name = os.path.splitext(os.path.basename(file_name))[0]
+        if attachment.size > self.options.max_attachment_mb * 1024 * 1024:
+            return ProcessedFile(file_name, image_base_name, "", [], f"File is too big ({attachment.size} bytes)")
+
+        try:
+            async with self._downloads:
+                os.makedirs(os.path.dirname(file_name), exist_ok=True)
+                await attachment.save(file_name)
+        except (discord.HTTPException, OSError) as ex:
+            logger.error("Can't download %s: %s", attachment.filename, ex)
+            return ProcessedFile(file_name, image_base_name, "", [], f"Can't download: {ex}")
+
+        loop = asyncio.get_running_loop()
+        async with self._guild_semaphore(guild_id):
+            # A crashed worker breaks the whole pool: it is replaced and the screenshot is tried once more
+            for attempt in range(2):
+                executor = self.executor
+                try:
+                    processed_files = await loop.run_in_executor(executor, process_files_in_worker, [file_name])
+                    return processed_files[0]
+                except BrokenProcessPool as ex:
+                    logger.error("Recognition process crashed on %s (attempt %d): %s", file_name, attempt + 1, ex)
+                    self._replace_executor(executor)
+                    error = ex
+                except Exception as ex:      # Recognition failed
+                    logger.exception("Can't recognize %s", file_name)
+                    return ProcessedFile(file_name, image_base_name, "", [], f"Can't recognize: {ex}")
+        return ProcessedFile(file_name, image_base_name, "", [], f"Can't recognize: {error}")
+
+    def _replace_executor(self, broken_executor):
+        """
+        Replaces a broken executor with a new one. Attachments which were in the broken pool all call it,
+        the pool is replaced only once
+        """
+        if broken_executor is not self.executor or self.executor_factory is None:
+            return
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = self.executor_factory()
+        self.stats["pool_restarts"] += 1
+        logger.warning("Recognition process pool is restarted")
+
+    def close(self):
+        """Waits for recognition to finish and closes outputs"""
+        self.executor.shutdown()
+        for output in self.outputs:
+            output.close()
+
+
+class RaidBot(discord.Client):
+    """Discord client which gives messages to ScreenshotIngestor"""
+
+    def __init__(self, ingestor, **kwargs):
+        intents = discord.Intents.default()
+        intents.message_content = True
+        super().__init__(intents=intents, **kwargs)
+        self.ingestor = ingestor
 
-class MyClient(discord.Client):
     async def on_ready(self):
-        print('Logged on as {0}!'.format(self.user))
+        logger.info("Logged on as %s", self.user)
 
     async def on_message(self, message):
-        print('Message from {0.author}: {0.content}'.format(message))
+        # Each event is handled in its own task, so a long message doesn't hold others
+        await self.ingestor.handle_message(message)
+
+    async def close(self):
+        await super().close()
+        self.ingestor.close()
+        logger.info("Bot stats: %s", self.ingestor.stats)
+
+
+def create_ingestor(tesseract_cmd, dimensions_path, outputs, options=BotOptions(),
+                    pipeline_options=PipelineOptions(report_dir="", thumbnails=False), log_level=logging.INFO):
+    """
+    ScreenshotIngestor with a process pool of options.jobs workers.
+    Raises pytesseract.TesseractNotFoundError if tesseract can't be run, so a wrong path is found at startup
+    """
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    logger.info("Tesseract %s", pytesseract.get_tesseract_version())
+    executor_factory = functools.partial(ProcessPoolExecutor, options.jobs, initializer=init_worker,
+                                         initargs=(tesseract_cmd, dimensions_path, pipeline_options, (), log_level))
+    return ScreenshotIngestor(executor_factory(), outputs, options, executor_factory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--token", default=os.environ.get("DISCORD_TOKEN", ""),
+                        help="Bot token (by default from DISCORD_TOKEN environment variable)")
+    parser.add_argument("--channel", type=int, action="append", default=[],
+                        help="Channel id to take screenshots from (may be repeated, default - all channels)")
+    parser.add_argument("-t", "--tesseract", default=r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+                        help="Full path to tesseract.exe")
+    parser.add_argument("-o", "--output", default="discord_hits.jsonl",
+                        help="Output file name (hits are appended, other formats get their extension)")
+    parser.add_argument("-f", "--format", default="jsonl", help="Comma separated output formats: csv, jsonl, parquet, db")
+    parser.add_argument("--inbox", default="discord_inbox", help="Folder for downloaded screenshots")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="Number of recognition processes")
+    parser.add_argument("--max-pending", type=int, default=500,
+                        help="Max screenshots waiting for recognition. Messages above it are rejected")
+    parser.add_argument("--per-guild", type=int, default=0,
+                        help="Max screenshots of a server (guild) recognized at once (default - as many as --jobs)")
+    parser.add_argument("-b", "--batch-ocr", action="store_true",
+                        help="Recognize all fields of a screenshot with one tesseract call")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    if not args.token:
+        parser.error("Bot token is not set (--token or DISCORD_TOKEN)")
+
+    bot_outputs = []
+    for output_format in dict.fromkeys(args.format.split(",")):
+        try:
+            bot_outputs.append(create_output(output_format, output_file_name(args.output, output_format), append=True))
+        except (ValueError, ImportError) as ex:
+            parser.error(str(ex))
 
-client = MyClient()
-client.run('')
+    df_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'dimensions.yaml')
+    try:
+        bot_ingestor = create_ingestor(args.tesseract, df_path, bot_outputs,
+                                       BotOptions(inbox_dir=args.inbox, jobs=args.jobs, max_pending=args.max_pending,
+                                                  per_guild=args.per_guild, channel_ids=frozenset(args.channel)),
+                                       PipelineOptions(report_dir="", batch_ocr=args.batch_ocr, thumbnails=False))
+    except pytesseract.TesseractNotFoundError as ex:
+        parser.error(f"can't run tesseract '{args.tesseract}': {ex}")
+    RaidBot(bot_ingestor).run(args.token, log_handler=None)
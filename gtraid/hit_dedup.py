@@ -0,0 +1,135 @@
+"""
+Image level deduplication of hit boxes
+
+Overlapping screenshots contain the same hit boxes. Instead of recognizing every box and guessing
+duplicates by name+damage strings afterwards, each box gets a fingerprint right after find_hits
+and boxes which were already seen are not cropped and recognized again.
+
+Fingerprint is made of the name and the damage of the box. For each of them the text is located
+by thresholding (the same way as for recognition), the tight text area is downscaled to a fixed size
+and normalized (zero mean, unit norm). So the dot product of two fingerprints is a normalized cross
+correlation, which doesn't depend on a box being shifted by a few pixels or cut at the bottom.
+Two boxes are the same if both name and damage correlate and text areas have the same size.
+On test images the same boxes have correlation ~1.0 while different hits of the same player ~0.8
+"""
+
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from .image_reco import auto_crop_dimensions
+
+# Fingerprint sizes of name and damage text areas
+NAME_FP_SIZE = (128, 16)
+DAMAGE_FP_SIZE = (128, 24)
+
+# Minimal correlation of both name and damage to consider boxes the same
+MIN_SIMILARITY = 0.95
+
+# Maximal difference of text areas sizes (in pixels)
+MAX_SIZE_DIFFERENCE = 3
+
+HitFingerprint = namedtuple('HitFingerprint', ['name', 'damage', 'sizes'])  # sizes = name w,h, damage w,h
+
+
+def _text_fingerprint(hit_image, rect, threshold, size):
+    """Fingerprint of a text within a rect: tight text area, downscaled and normalized"""
+    region = hit_image[rect.rows, rect.cols]
+    gray = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY) if len(region.shape) == 3 else region
+    mask = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY)[1]
+    y_start, y_end, x_start, x_end = auto_crop_dimensions(mask)
+
+    vector = cv2.resize(gray[y_start:y_end, x_start:x_end], size, interpolation=cv2.INTER_AREA)
+    vector = vector.astype(np.float32).ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector.astype(np.float16), (x_end - x_start, y_end - y_start)
+
+
+def hit_fingerprint(hit_image, hit_rects):
+    """
+    Fingerprint of a hit box image
+    :param hit_image: image of the hit box (from find_hits) or its grayscale
+    :param hit_rects: HitImageDimensions (crop_rects.hit_image from dimensions file)
+    :return: HitFingerprint
+    """
+    # The same thresholds as in prepare_name (name without time) and prepare_damage
+    name, name_size = _text_fingerprint(hit_image, hit_rects.name_rect, 200, NAME_FP_SIZE)
+    damage, damage_size = _text_fingerprint(hit_image, hit_rects.damage_rect, 160, DAMAGE_FP_SIZE)
+    return HitFingerprint(name=name, damage=damage, sizes=np.array(name_size + damage_size, dtype=np.int32))
+
+
+class HitDeduplicator:
+    """Keeps fingerprints of unique hit boxes and sources (screenshots) where each box was seen"""
+
+    def __init__(self, min_similarity=MIN_SIMILARITY, max_size_difference=MAX_SIZE_DIFFERENCE):
+        self.min_similarity = min_similarity
+        self.max_size_difference = max_size_difference
+
+        # Fingerprints of unique boxes stacked as matrices, so all of them are compared at once.
+        # Matrices have spare rows (capacity doubles), only the first unique_count rows are used
+        self._names = np.zeros((64, NAME_FP_SIZE[0] * NAME_FP_SIZE[1]), dtype=np.float32)
+        self._damages = np.zeros((64, DAMAGE_FP_SIZE[0] * DAMAGE_FP_SIZE[1]), dtype=np.float32)
+        self._sizes = np.zeros((64, 4), dtype=np.int32)
+
+        self.sources = []       # For each unique box - list of HitSource where it was seen. The first is canonical
+        self.texts = []         # For each unique box - recognized HitTexts
+
+    @property
+    def unique_count(self):
+        return len(self.sources)
+
+    @property
+    def collapsed_count(self):
+        """How many boxes were found to be duplicates"""
+        return sum(len(sources) - 1 for sources in self.sources)
+
+    @staticmethod
+    def fingerprint(hit_image, hit_rects):
+        return hit_fingerprint(hit_image, hit_rects)
+
+    def find(self, fingerprint):
+        """Returns index of the same unique box or -1"""
+        if not self.sources:
+            return -1
+        count = self.unique_count
+        similarity = np.minimum(self._names[:count] @ fingerprint.name.astype(np.float32),
+                                self._damages[:count] @ fingerprint.damage.astype(np.float32))
+        same_size = np.abs(self._sizes[:count] - fingerprint.sizes).max(axis=1) <= self.max_size_difference
+        similarity[~same_size] = -1
+        index = int(np.argmax(similarity))
+        return index if similarity[index] >= self.min_similarity else -1
+
+    def add(self, fingerprint, source, texts=None):
+        """Adds a new unique box with its HitTexts. Returns its index"""
+        count = self.unique_count
+        if count == len(self._sizes):
+            self._names = np.vstack((self._names, np.zeros_like(self._names)))
+            self._damages = np.vstack((self._damages, np.zeros_like(self._damages)))
+            self._sizes = np.vstack((self._sizes, np.zeros_like(self._sizes)))
+        self._names[count] = fingerprint.name
+        self._damages[count] = fingerprint.damage
+        self._sizes[count] = fingerprint.sizes
+        self.sources.append([source])
+        self.texts.append(texts)
+        return len(self.sources) - 1
+
+    def add_source(self, index, source):
+        """Adds a source where the unique box was seen again"""
+        self.sources[index].append(source)
+
+
+# Deduplicator used by recognize_screenshot in this process. None = no deduplication
+_hit_deduplicator = None
+
+
+def set_hit_deduplicator(deduplicator):
+    global _hit_deduplicator
+    _hit_deduplicator = deduplicator
+
+
+def get_hit_deduplicator():
+    return _hit_deduplicator
@@ -0,0 +1,77 @@
+"""
+Reading screenshots: size from the file header without decoding pixels
+
+Crop parameters depend only on the resolution, so they are found by the header (a few hundred bytes
+of PNG or JPEG) before the image is decoded. Screenshots of unknown resolutions are not decoded at all.
+
+Decoding only the hits window was measured on test_images (benchmarks/bench_imread.py):
+the window is 93% of screenshot rows and PNG and baseline JPEG are decoded from the top row,
+so a row limited decode saves little, and Pillow decodes PNG slower than OpenCV. Reduced resolution
+JPEG decode is fast but text is too small for OCR then. So the whole screenshot is decoded with OpenCV,
+and the pipeline keeps only a copy of the hits window when report and debug images are off
+(see ResolutionDimensions.window_dimensions).
+"""
+
+import logging
+import struct
+
+logger = logging.getLogger(__name__)
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# JPEG markers of frame headers (SOF0-SOF15 without DHT, JPG and DAC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# JPEG markers without length
+_JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+
+def _read_jpeg_size(image_file):
+    """Size from the frame header (SOF). The file position is after SOI"""
+    while True:
+        byte = image_file.read(1)
+        while byte and byte != b"\xff":         # Garbage between segments
+            byte = image_file.read(1)
+        while byte == b"\xff":                  # Fill bytes
+            byte = image_file.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in _JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == 0xD9:                      # EOI before a frame header
+            return None
+        length_bytes = image_file.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            header = image_file.read(5)
+            if len(header) < 5:
+                return None
+            height, width = struct.unpack(">xHH", header)
+            return width, height
+        image_file.seek(length - 2, 1)
+
+
+def read_image_size(file_name):
+    """
+    Size of a PNG or JPEG image from its header
+    :param file_name: image file name
+    :return: (width, height) or None if the file can't be read or has another format
+    """
+    try:
+        with open(file_name, "rb") as image_file:
+            signature = image_file.read(8)
+            if signature == _PNG_SIGNATURE:
+                # The first chunk is IHDR: length, type, width, height
+                header = image_file.read(16)
+                if len(header) < 16 or header[4:8] != b"IHDR":
+                    return None
+                return struct.unpack(">II", header[8:16])
+            if signature[:2] == b"\xff\xd8":
+                image_file.seek(2)
+                return _read_jpeg_size(image_file)
+    except OSError as ex:
+        logger.warning("read_image_size: can't read '%s': %s", file_name, ex)
+    return None
@@ -1,10 +1,20 @@
+import logging
 import os
 from collections import namedtuple
 import cv2
-import yaml
 import pytesseract
 import numpy as np
 
+from .binarization import DEFAULT_THRESHOLDS, apply_threshold, get_threshold_calibration
+from .dimensions import DimensionsFile
+from .ocr_backend import OcrText, get_ocr_backend
+from .ocr_memo import get_ocr_memo
+from .partial_hits import align_hit_boxes, visible_region
+from .reocr import reocr_field
+from .stage_timer import timed
+
+logger = logging.getLogger(__name__)
+
 RecognizedHitRecord = namedtuple('RecognizedHitRecord',
                                  ['name',               # Recognized name
                                   'damage',             # Recognized damage
@@ -14,53 +24,37 @@ RecognizedHitRecord = namedtuple('RecognizedHitRecord',
                                   'party_img',          # Image with party
                                   'boss_img',           # Image with boss
                                   'lvBoss_img',         # Image with boss LVL and Name 
-                                  'boss'])              # Recognized Boss
+                                  'boss',               # Recognized Boss
+                                  'fingerprint',        # HitFingerprint of the box (if deduplication is on)
+                                  'duplicate_of',       # HitSource of the same box recognized before (or None)
+                                  'cut',                # Partial box cut at the "top" or "bottom" ("" - full box)
+                                  'box',                # HitBox in the hits window
+                                  'party',              # Recognized heroes "hero, hero, ..." ("" - not recognized)
+                                  'confidence'],        # FieldConfidence of name, damage and boss (None - unknown)
+                                 defaults=[None, None, "", None, "", None])
 
+# Where the hit box is from: file (screenshot) name and index of the hit in this screenshot
+HitSource = namedtuple('HitSource', ['file_name', 'hit_index'])
 
-RecognizedImage = namedtuple('RecognizedImage',
-                             [
-                                 'hit_records',
-                                 'name'
-                             ])  # Recognized hit records collected from the image
+# Hit box found in the hits window (coordinates are in the hits window)
+HitBox = namedtuple('HitBox', ['x', 'y', 'width', 'height'])
 
+# Name, damage and boss images prepared for recognition (black on white)
+PreparedHitFields = namedtuple('PreparedHitFields', ['name', 'damage', 'boss'])
 
-class DimensionsFile:
-    """
-    DimensionsFile is yaml file that hold parameters how to crop and recognize image for different resolution
-    """
+# How sure recognition of name, damage and boss is: 0..1, None - unknown or not recognized.
+# OCR confidence, glyph correlation for damage read by digit_reader.py, match score for a boss from the gallery
+FieldConfidence = namedtuple('FieldConfidence', ['name', 'damage', 'boss'])
 
-    def __init__(self, config_file):
-        """
-        Loads and holds crop parameters for different resolutions
+# Recognized texts of a unique hit box, taken for its duplicates (see hit_dedup.py). confidence - FieldConfidence
+HitTexts = namedtuple('HitTexts', ['name', 'damage', 'boss', 'confidence'])
 
-        :param config_file:
-        """
-        print(f"DimensionsFile: Loading file: '{config_file}'")
-        with open(config_file, 'r') as stream:
-            try:
-                content = yaml.safe_load(stream)
-                self._crop_rects = content["resolutions"]
 
-            except yaml.YAMLError as exc:
-                print(exc)
-                raise
-
-    def get_crop_rects(self, img):
-        """
-            STEP 0. Get crop parameters for a given resolution
-            :param config_file:
-            :param width:
-            :param height:
-            :return:
-            """
-        height, width, _ = img.shape
-        print(f"DimensionsFile:get_crop_rects: Searching data for resolution {width}x{height}")
-        res_name = f"w{width}h{height}"
-        if res_name not in self._crop_rects.keys():
-            err = f"The resolution '{res_name}' is not found"
-            raise KeyError(err)
-        print(f"load_crop_rects: found data for resolution {res_name}")
-        return self._crop_rects[res_name]
+RecognizedImage = namedtuple('RecognizedImage',
+                             [
+                                 'hit_records',
+                                 'name'
+                             ])  # Recognized hit records collected from the image
 
 
 def crop_hits_window(img, crop_rect, debug=1, report_path=""):
@@ -74,7 +68,7 @@ def crop_hits_window(img, crop_rect, debug=1, report_path=""):
     """
 
     img_height, img_width, _ = img.shape
-    print(f"crop_hits_window: img_height={img_height}, img_width={img_width}")
+    logger.debug("crop_hits_window: img_height=%d, img_width=%d", img_height, img_width)
 
     x_start = crop_rect[0][0]
     y_start = crop_rect[0][1]
@@ -83,6 +77,10 @@ def crop_hits_window(img, crop_rect, debug=1, report_path=""):
 
     crop = img[y_start:y_end, x_start:x_end]
 
+    # Debug image is a copy of the whole screenshot, make it only if it is used
+    if not report_path and debug < 2:
+        return crop
+
     # Draw a rectangle with blue line borders of thickness of 2 px
     debug_img = img.copy()
     debug_img = cv2.rectangle(debug_img, crop_rect[0], crop_rect[1], (255, 0, 0), 2)
@@ -101,62 +99,58 @@ def crop_hits_window(img, crop_rect, debug=1, report_path=""):
     return crop
 
 
-def find_hits(img, hitbox_min_w,  hitbox_min_h, debug=1, report_path=""):
+def find_hit_boxes(img, hitbox_min_w, hitbox_min_h, debug=1, report_path="", gray=None, keep_partial=False,
+                   threshold=DEFAULT_THRESHOLDS['boxes']):
     """
-    Find and extract hit images from hits list (hits list must be cropped)
-
+    Find hit boxes in hits list (hits list must be cropped)
 
     :param img: cv2 image (like after imgread)
     :param hitbox_min_h: Minimal height of hit box
     :param hitbox_min_w: Minimal width of hit box
     :param debug: 1 = just prints, 2 = show image processing
-    :return:
+    :param gray: grayscale img if it is already made
+    :param keep_partial: keep boxes lower than hitbox_min_h (cut by the hits window, see partial_hits.py)
+    :param threshold: ThresholdSettings of the boxes mask (see binarization.py)
+    :return: list of HitBox
     """
 
-    # img = cv2.imread("../test_images/hits_crop.jpg")
-
     # make grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if gray is None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
     # threshold image to remove as much as possible and leave frames
-    mask = cv2.threshold(gray, 15, 255, cv2.THRESH_BINARY)[1]
-
-    # Cleanup by morphologyEX
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-    close = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    with timed("threshold"):
+        mask = apply_threshold(gray, threshold)
 
     # >oO Debug output
     if debug >= 2:
+        # Cleanup by morphologyEX
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+        close = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
         cv2.imshow("Masked image", mask)
         cv2.imshow("After morphologyEx", close)
 
     # Find contours (external only):
     # Since the cv2.findContours has been updated to return only 2 parameters
-    contours, hierarchy = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-    print(f"find_hits: found contours = {len(contours)}")
+    with timed("find_contours"):
+        contours, hierarchy = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-    if debug >= 2:
-        # draw ALL contours on original image
-        cv2.drawContours(img.copy(), contours, -1, (255, 0, 0), thickness=2)
+    logger.debug("find_hits: found contours = %d", len(contours))
 
-    hit_images = []
-    # Find bounding box and extract ROI
+    hit_boxes = []
+    # Find bounding box
     for i, contour in enumerate(contours):
 
         x, y, width, height = cv2.boundingRect(contour)
-        if height > hitbox_min_h and width > hitbox_min_w:
-
-            # Crop by our contour
-            crop = img[y:y+height, x:x+width]
-            hit_images.append(crop)
+        if (height > hitbox_min_h or keep_partial) and width > hitbox_min_w:
+            hit_boxes.append(HitBox(x, y, width, height))
 
             # >oO Debug output
-            print(f"find_hits: saving: x={x}, y={y}, width={width}, height={height}")
+            logger.debug("find_hits: saving: x=%d, y=%d, width=%d, height=%d", x, y, width, height)
             if debug >= 2:
-                cv2.imshow(f"Contour{i}", crop)
+                cv2.imshow(f"Contour{i}", img[y:y+height, x:x+width])
         else:
-            print(f"find_hits: skipping: x={x}, y={y}, width={width}, height={height}")
+            logger.debug("find_hits: skipping: x=%d, y=%d, width=%d, height=%d", x, y, width, height)
 
     # show image
     if debug >= 2:
@@ -170,7 +164,22 @@ def find_hits(img, hitbox_min_w,  hitbox_min_h, debug=1, report_path=""):
         img_with_contours = cv2.drawContours(img.copy(), contours, -1, (255, 0, 0), thickness=2)
         cv2.imwrite(report_path + "___02_fndhts__contours.jpg", img_with_contours)
 
-    return hit_images
+    return hit_boxes
+
+
+def find_hits(img, hitbox_min_w,  hitbox_min_h, debug=1, report_path=""):
+    """
+    Find and extract hit images from hits list (hits list must be cropped)
+
+
+    :param img: cv2 image (like after imgread)
+    :param hitbox_min_h: Minimal height of hit box
+    :param hitbox_min_w: Minimal width of hit box
+    :param debug: 1 = just prints, 2 = show image processing
+    :return: list of hit images
+    """
+    hit_boxes = find_hit_boxes(img, hitbox_min_w, hitbox_min_h, debug=debug, report_path=report_path)
+    return [img[box.y:box.y + box.height, box.x:box.x + box.width] for box in hit_boxes]
 
 
 def crop_hit_image(img, img_index, name_rect, party_rect, damage_rect, boss_rect, lvBoss_rect, report_path="", debug=0):
@@ -182,21 +191,25 @@ def crop_hit_image(img, img_index, name_rect, party_rect, damage_rect, boss_rect
     :param party_rect: coordinates of party rectangle ((x_start, y_start), (x_end, y_end))
     :param damage_rect: coordinates of damage rectangle ((x_start, y_start), (x_end, y_end))
     :param boss_rect:  coordinates of boss rectangle ((x_start, y_start), (x_end, y_end))
-    :param lvBoss_rect:  coordinates of boss rectangle ((x_start, y_start), (x_end, y_end))
+    :param lvBoss_rect:  coordinates of boss level and name rectangle ((x_start, y_start), (x_end, y_end)) or None
     :param report_path: where to write report to
     :return: name_img, party_img, boss_img, damage_img
     """
     img_height, img_width, img_channels = img.shape
-    print(f"img.shape: img_height={img_height}, img_width={img_width}, img_channels={img_channels}")
+    logger.debug("img.shape: img_height=%d, img_width=%d, img_channels=%d", img_height, img_width, img_channels)
 
     # Using cv2.rectangle() method
     # Draw a rectangle with blue line borders of thickness of 2 px
-    debug_image = img.copy()
-    debug_image = cv2.rectangle(debug_image, name_rect[0], name_rect[1], (255, 0, 0), 2)
-    debug_image = cv2.rectangle(debug_image, party_rect[0], party_rect[1], (0, 255, 0), 2)
-    debug_image = cv2.rectangle(debug_image, boss_rect[0], boss_rect[1], (0, 0, 255), 2)
-    debug_image = cv2.rectangle(debug_image, damage_rect[0], damage_rect[1], (0, 255, 255), 2)
-    debug_image = cv2.rectangle(debug_image, lvBoss_rect[0], lvBoss_rect[1], (0, 69, 255), 2)
+    # (only if it is used: it is a copy of the hit image)
+    debug_image = None
+    if report_path or debug >= 2:
+        debug_image = img.copy()
+        debug_image = cv2.rectangle(debug_image, name_rect[0], name_rect[1], (255, 0, 0), 2)
+        debug_image = cv2.rectangle(debug_image, party_rect[0], party_rect[1], (0, 255, 0), 2)
+        debug_image = cv2.rectangle(debug_image, boss_rect[0], boss_rect[1], (0, 0, 255), 2)
+        debug_image = cv2.rectangle(debug_image, damage_rect[0], damage_rect[1], (0, 255, 255), 2)
+        if lvBoss_rect:
+            debug_image = cv2.rectangle(debug_image, lvBoss_rect[0], lvBoss_rect[1], (0, 69, 255), 2)
 
     if debug >= 2:
         cv2.imshow("How we will crop", debug_image)
@@ -219,9 +232,11 @@ def crop_hit_image(img, img_index, name_rect, party_rect, damage_rect, boss_rect
     x_start, y_start, x_end, y_end = damage_rect[0][0], damage_rect[0][1], damage_rect[1][0], damage_rect[1][1]
     damage_img = img[y_start:y_end, x_start:x_end]
 
-    # lvBoss 
-    x_start, y_start, x_end, y_end = lvBoss_rect[0][0], lvBoss_rect[0][1], lvBoss_rect[1][0], lvBoss_rect[1][1]
-    lvBoss_img = img[y_start:y_end, x_start:x_end]
+    # lvBoss (not all resolutions have it)
+    lvBoss_img = None
+    if lvBoss_rect:
+        x_start, y_start, x_end, y_end = lvBoss_rect[0][0], lvBoss_rect[0][1], lvBoss_rect[1][0], lvBoss_rect[1][1]
+        lvBoss_img = img[y_start:y_end, x_start:x_end]
 
     # TODO remove it to a sane place
     if report_path:
@@ -231,24 +246,89 @@ def crop_hit_image(img, img_index, name_rect, party_rect, damage_rect, boss_rect
         cv2.imwrite(report_path + f"___03_{str(img_index).zfill(3)}_crop-hit_party.jpg", party_img)
         cv2.imwrite(report_path + f"___03_{str(img_index).zfill(3)}_crop-hit_boss.jpg", boss_img)
         cv2.imwrite(report_path + f"___03_{str(img_index).zfill(3)}_crop-hit_damage.jpg", damage_img)
-        cv2.imwrite(report_path + f"___03_{str(img_index).zfill(3)}_crop-hit_lvBoss.jpg", lvBoss_img)
+        if lvBoss_img is not None:
+            cv2.imwrite(report_path + f"___03_{str(img_index).zfill(3)}_crop-hit_lvBoss.jpg", lvBoss_img)
 
     return name_img, party_img, boss_img, damage_img, lvBoss_img
 
 
-def recognize_damage(img, debug=0):
+def ocr_field(img, field):
     """
-    Recognizes damage from damage box
+    Recognizes text on a prepared field image with the OCR backend.
+    If OCR memo is on and a near-identical image was already recognized, its text is reused
+    :param img: prepared (black on white) image
+    :param field: 'name', 'damage' or 'boss'
+    :return: recognized text
+    """
+    return ocr_field_text(img, field).text
+
+
+def ocr_field_text(img, field, with_confidence=False):
+    """
+    ocr_field with confidence of the text: OcrText
+    :param with_confidence: get confidence from the OCR backend (image_to_text). Otherwise the text is recognized
+                            by image_to_string and confidence is None. Memo entries without confidence are not used
+    """
+    with timed(f"ocr_{field}"):
+        memo = get_ocr_memo()
+        if memo is not None:
+            entry = memo.lookup_entry(field, img)
+            if entry is not None and (entry.confidence is not None or not with_confidence):
+                return OcrText(entry.text, entry.confidence)
+
+        if with_confidence:
+            text = get_ocr_backend().image_to_text(img, field)
+        else:
+            text = OcrText(get_ocr_backend().image_to_string(img, field), None)
+        if memo is not None:
+            memo.add(field, img, text.text, text.confidence)
+        return text
+
+
+def batch_ocr_fields(images, fields, with_confidence=False):
+    """
+    The same as ocr_field_text for many images at once. Images not found in OCR memo
+    are recognized by a single batch_image_to_text (batch_image_to_string without confidence) call
+    of the OCR backend
+    :return: list of OcrText
+    """
+    with timed("batch_ocr"):
+        memo = get_ocr_memo()
+        entries = [memo.lookup_entry(field, img) if memo is not None else None for img, field in zip(images, fields)]
+        texts = [OcrText(entry.text, entry.confidence)
+                 if entry is not None and (entry.confidence is not None or not with_confidence) else None
+                 for entry in entries]
+
+        missing = [i for i, text in enumerate(texts) if text is None]
+        if missing:
+            backend = get_ocr_backend()
+            missing_images = [images[i] for i in missing]
+            missing_fields = [fields[i] for i in missing]
+            if with_confidence:
+                missing_texts = backend.batch_image_to_text(missing_images, missing_fields)
+            else:
+                missing_texts = [OcrText(text, None)
+                                 for text in backend.batch_image_to_string(missing_images, missing_fields)]
+            for index, text in zip(missing, missing_texts):
+                texts[index] = text
+                if memo is not None:
+                    memo.add(fields[index], images[index], text.text, text.confidence)
+        return texts
+
+
+def prepare_damage(img, debug=0):
+    """
+    Prepares damage box image for recognition
     :param img: Image
     :param debug: 2 - show images, 1 - print, 0 - nothing
-    :return: image used for recognition and name
+    :return: inverted mask (black on white) used for recognition
     """
 
     # create grayscale
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-    # threshold image to remove noise and create an inverted mask with with OTSU
-    mask = 255 - cv2.threshold(gray, 160, 255, cv2.THRESH_BINARY)[1]
+    # threshold image to remove noise and create an inverted mask
+    mask = apply_threshold(gray, DEFAULT_THRESHOLDS['damage'], inverted=True, dst=gray)
 
     if debug >= 2:
         cv2.imshow("Original", img)
@@ -256,23 +336,52 @@ def recognize_damage(img, debug=0):
         cv2.waitKey(0)
         cv2.destroyAllWindows()
 
+    return mask
+
+
+def parse_damage(damage_str):
+    """Cleans up tesseract output for a damage box"""
+    if damage_str:
+        damage_str = damage_str.strip().replace("\n\f,", "")
+    return damage_str
+
+
+def recognize_damage(img, debug=0):
+    """
+    Recognizes damage from damage box
+    :param img: Image
+    :param debug: 2 - show images, 1 - print, 0 - nothing
+    :return: image used for recognition and name
+    """
+
+    mask = prepare_damage(img, debug=debug)
+    return mask, ocr_damage(mask)
+
+
+def ocr_damage(mask):
+    """Recognizes damage on the image prepared by prepare_damage"""
+
     # By default OpenCV stores images in BGR format and since pytesseract assumes RGB format,
     # we need to convert from BGR to RGB format/mode:
     img_rgb = cv2.cvtColor(mask, cv2.COLOR_BGR2RGB)
 
-    damage_str = pytesseract.image_to_string(img_rgb)
-    if damage_str:
-        damage_str = damage_str.strip().replace("\n\f,", "")
-    print("recognize_damage: Damage is:", damage_str)
+    damage_str = parse_damage(ocr_field(img_rgb, "damage"))
+    logger.debug("recognize_damage: Damage is: %s", damage_str)
+    return damage_str
 
-    return mask, damage_str
 
-def recognize_boss(img, debug=0):
-        # create grayscale
+def prepare_boss(img, debug=0):
+    """
+    Prepares lvBoss image (boss level and name) for recognition
+    :param img: Image
+    :param debug: 2 - show images, 1 - print, 0 - nothing
+    :return: inverted mask (black on white) used for recognition
+    """
+    # create grayscale
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-    # threshold image to remove noise and create an inverted mask with with OTSU
-    mask = 255 - cv2.threshold(gray, 160, 255, cv2.THRESH_BINARY)[1]
+    # threshold image to remove noise and create an inverted mask
+    mask = apply_threshold(gray, DEFAULT_THRESHOLDS['boss'], inverted=True, dst=gray)
 
     if debug >= 2:
         cv2.imshow("Original", img)
@@ -280,14 +389,25 @@ def recognize_boss(img, debug=0):
         cv2.waitKey(0)
         cv2.destroyAllWindows()
 
+    return mask
+
+
+def recognize_boss(img, debug=0):
+    mask = prepare_boss(img, debug=debug)
+    return mask, ocr_boss(mask)
+
+
+def ocr_boss(mask):
+    """Recognizes boss on the image prepared by prepare_boss"""
+
     # By default OpenCV stores images in BGR format and since pytesseract assumes RGB format,
     # we need to convert from BGR to RGB format/mode:
     img_rgb = cv2.cvtColor(mask, cv2.COLOR_BGR2RGB)
 
-    boss_str = pytesseract.image_to_string(img_rgb)
-    print("recognize_boss: boss is:", boss_str)
-    
-    return mask, boss_str
+    boss_str = ocr_field(img_rgb, "boss")
+    logger.debug("recognize_boss: boss is: %s", boss_str)
+    return boss_str
+
 
 def auto_crop_dimensions(image, threshold=0):
     """Find crop dimensions aiming to crop any edges below or equal to threshold
@@ -319,114 +439,367 @@ def auto_crop(image, threshold=0):
     return image[crop_rect[0]:crop_rect[1], crop_rect[2]: crop_rect[3]]
 
 
-def recognize_name(img, debug=0):
+def prepare_name(img, debug=0):
     """
-    Recognizes name
+    Prepares name image for recognition: removes time information and makes it black on white
     :param img:
     :param debug:
-    :return:
+    :return: image used for recognition
     """
 
     # create grayscale
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-    # threshold image to remove noise and create an inverted mask with with OTSU
-    only_name_mask = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY)[1]
+    # threshold image to remove noise and create a mask of the name without time
+    only_name_mask = apply_threshold(gray, DEFAULT_THRESHOLDS['name_time'])
+
+    return prepare_name_from_mask(gray, only_name_mask, debug=debug)
+
+
+def crop_name_gray(gray, only_name_mask):
+    """Grayscale name image without time information by its mask (threshold 200)"""
 
     # This mask removes time information, but name is difficult to recognize
     # so we use autocrop function, to figure the place where name ends!
     crop_rect = auto_crop_dimensions(only_name_mask)
 
-
     # Now we crop image removing not needed time information
-    crop_name_img = gray[:, :crop_rect[3]+10]
+    return gray[:, :crop_rect[3]+10]
 
-    crop_name_img = cv2.resize(crop_name_img, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
 
-    # This mask makes recognizing english and korean names easier
-    mask2 = cv2.threshold(crop_name_img, 130, 255, cv2.THRESH_BINARY)[1]
+def prepare_name_from_mask(gray, only_name_mask, debug=0, threshold=DEFAULT_THRESHOLDS['name']):
+    """
+    prepare_name for already made grayscale name image and its mask (threshold 200) without time
+    :param threshold: ThresholdSettings of the upscaled name (see binarization.py)
+    :return: image used for recognition
+    """
 
-    # Invert image to make it black on white
-    reco_image = 255-mask2
+    crop_name_img = crop_name_gray(gray, only_name_mask)
 
-    # recognize the image
-    name = pytesseract.image_to_string(reco_image, lang="kor+eng")
-    if name:
-        name = name[:name.find(' ')]
-        #name = name.strip()
-    print(f"Name is: {name}")
+    crop_name_img = cv2.resize(crop_name_img, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+
+    # This mask makes recognizing english and korean names easier.
+    # Inverted, to make it black on white. The upscaled image is not used after it, so it is thresholded in place
+    reco_image = apply_threshold(crop_name_img, threshold, inverted=True,
+                                 dst=None if debug >= 2 else crop_name_img)
 
     if debug >= 2:
-        cv2.imshow("Original", img)
+        cv2.imshow("Original", gray)
         cv2.imshow("Masking", only_name_mask)
         cv2.imshow("Crop", crop_name_img)
         cv2.imshow("Time mask", reco_image)
         cv2.waitKey(0)
         cv2.destroyAllWindows()
 
-    return reco_image, name
+    return reco_image
 
 
-def recognize_screenshot(img, crop_rects, name='', report_path="", debug=1):
+def parse_name(name):
+    """Takes the name (the first word) from tesseract output"""
+    if name:
+        name = name[:name.find(' ')]
+        #name = name.strip()
+    return name
+
+
+def recognize_name(img, debug=0):
+    """
+    Recognizes name
+    :param img:
+    :param debug:
+    :return:
+    """
+
+    reco_image = prepare_name(img, debug=debug)
+    return reco_image, ocr_name(reco_image)
+
+
+def ocr_name(reco_image):
+    """Recognizes name on the image prepared by prepare_name"""
+    name = parse_name(ocr_field(reco_image, "name"))
+    logger.debug("Name is: %s", name)
+    return name
+
+
+def box_region(img, box, rect):
+    """
+    Region of a rect within a hit box taken directly from the hits window image.
+    The same as cropping the rect from the hit image (the rect is clipped by the box)
+    :param img: hits window image (or its grayscale, mask)
+    :param box: HitBox
+    :param rect: CropRect relative to the hit box
+    """
+    x_start = box.x + min(rect.x_start, box.width)
+    x_end = box.x + min(rect.x_end, box.width)
+    y_start = box.y + min(rect.y_start, box.height)
+    y_end = box.y + min(rect.y_end, box.height)
+    return img[y_start:y_end, x_start:x_end]
+
+
+def field_region(img, box, full_box, rect):
+    """box_region for a full box, visible part of the rect for a partial box (None if it is not visible)"""
+    if full_box is box:
+        return box_region(img, box, rect)
+    return visible_region(img, box, full_box, rect)
+
+
+def hit_field_gray(gray, box, full_box, hit_rects, field, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Grayscale image of a field before preparation (white text on dark), name without time.
+    Second recognition pass (see reocr.py) prepares it in other ways
+    :param field: 'name', 'damage' or 'boss'
+    :param thresholds: {step: ThresholdSettings} (see binarization.py)
+    :return: image or None if the field is not visible
+    """
+    if field == "name":
+        name_gray = field_region(gray, box, full_box, hit_rects.name_rect)
+        if name_gray is None:
+            return None
+        return crop_name_gray(name_gray, apply_threshold(name_gray, thresholds['name_time']))
+    return field_region(gray, box, full_box, hit_rects.damage_rect if field == "damage" else hit_rects.lvBoss_rect)
+
+
+def prepare_hit_fields(gray, hit_boxes, hit_rects, debug=0, full_boxes=None, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Prepares name, damage and boss images for recognition for all hit boxes at once.
+    The result is the same as of prepare_name, prepare_damage and prepare_boss on crops of each hit,
+    but the hits window is converted to grayscale once and thresholds are applied to slices of it,
+    so only the field images are allocated
+
+    :param gray: grayscale hits window
+    :param hit_boxes: list of HitBox
+    :param hit_rects: HitImageDimensions (crop_rects.hit_image)
+    :param debug: 2 - show images, 1 - print, 0 - nothing
+    :param full_boxes: HitBox-es aligned by the full box height for partial boxes (see partial_hits.py).
+                       None - all boxes are full
+    :param thresholds: {step: ThresholdSettings} of name_time, name, damage and boss (see binarization.py).
+                       'auto' ones must be resolved by ThresholdCalibration
+    :return: list of PreparedHitFields. boss is None if there is no lvBoss_rect for the resolution,
+             a field is None if it is not visible in a partial box
+    """
+    prepared = []
+    for index, box in enumerate(hit_boxes):
+        full_box = full_boxes[index] if full_boxes else box
+        name = damage = boss = None
+
+        # Name: the name_time mask leaves the name without time, so the name is cut where it ends
+        name_gray = field_region(gray, box, full_box, hit_rects.name_rect)
+        if name_gray is not None:
+            name = prepare_name_from_mask(name_gray, apply_threshold(name_gray, thresholds['name_time']),
+                                          threshold=thresholds['name'])
+
+        # Damage and boss: inverted (black on white)
+        damage_gray = field_region(gray, box, full_box, hit_rects.damage_rect)
+        if damage_gray is not None:
+            damage = apply_threshold(damage_gray, thresholds['damage'], inverted=True)
+        boss_gray = field_region(gray, box, full_box, hit_rects.lvBoss_rect) if hit_rects.lvBoss_rect else None
+        if boss_gray is not None:
+            boss = apply_threshold(boss_gray, thresholds['boss'], inverted=True)
+        prepared.append(PreparedHitFields(name=name, damage=damage, boss=boss))
+
+        if debug >= 2:
+            if name is not None:
+                cv2.imshow("Name", name)
+            if damage is not None:
+                cv2.imshow("Masking damage", damage)
+            if boss is not None:
+                cv2.imshow("Masking boss", boss)
+            cv2.waitKey(0)
+            cv2.destroyAllWindows()
+
+    return prepared
+
+
+def recognize_screenshot(img, crop_rects, name='', report_path="", debug=1, batch_ocr=False, deduplicator=None,
+                         partial_hits=False, gallery=None, glyph_bank=None, min_confidence=None,
+                         with_confidence=False):
     """
     Recognizes the image
     :param img: Image object with the image to recognize
-    :param crop_rects: Crop rectangles, how to crop subparts of image
+    :param crop_rects: Crop rectangles, how to crop subparts of image (ResolutionDimensions)
     :param name: Some name, like file name, will be added in the record
     :param report_path: name of the report
     :param debug: 0 - show nothing, 1 - debug prints, 2 - debug imgshow
+    :param batch_ocr: recognize all fields of the screenshot at once. For pytesseract backend it is
+                      one tesseract call per language instead of one call per field (see batch_ocr.py)
+    :param deduplicator: HitDeduplicator. Boxes already seen by it are not cropped and recognized again,
+                         their records have duplicate_of set and no field images (see hit_dedup.py)
+    :param partial_hits: keep boxes cut by the hits window and recognize their visible fields.
+                         Their records have cut set and other fields empty (see partial_hits.py)
+    :param gallery: TemplateGallery. Boss and party portraits are matched with its reference images,
+                    bosses it doesn't know are recognized by OCR (see template_gallery.py)
+    :param glyph_bank: GlyphBank. Damage is read by glyph templates, by OCR only if it is not confident
+                       (see digit_reader.py)
+    :param min_confidence: OCR results with lower confidence are recognized again in more expensive ways
+                           (see reocr.py). None - no second pass
+    :param with_confidence: get confidence of OCR results (it is always got with min_confidence).
+                            Otherwise OCR fields have confidence None
     :return: RecognizedImage with recognized data
     """
 
     # 1. Crop hit window
     img_height, img_width, _ = img.shape
 
-    crop_hits_dim = ((crop_rects["hits_window"]["x_start"], crop_rects["hits_window"]["y_start"]),
-                     (crop_rects["hits_window"]["x_end"], crop_rects["hits_window"]["y_end"]))
+    with timed("crop_hits_window"):
+        raid_hits_img = crop_hits_window(img, crop_rects.hits_window.corners, debug=debug, report_path=report_path)
 
-    raid_hits_img = crop_hits_window(img, crop_hits_dim, debug=debug, report_path=report_path)
+    # Grayscale hits window is made once. Hits search, fingerprints and fields preparation use it
+    with timed("grayscale"):
+        raid_hits_gray = cv2.cvtColor(raid_hits_img, cv2.COLOR_BGR2GRAY)
 
-    # 2. Find hits images
-    hit_images = find_hits(raid_hits_img,
-                           crop_rects["hit_image"]["min_width"],
-                           crop_rects["hit_image"]["min_height"],
-                           report_path=report_path, debug=debug)
+    # Thresholds of the resolution. 'auto' ones are calibrated by the first screenshot (see binarization.py)
+    thresholds = get_threshold_calibration().thresholds(crop_rects.name, crop_rects.binarization, raid_hits_gray)
 
-    hit_records = []
+    # 2. Find hits images
+    hit_rects = crop_rects.hit_image
+    with timed("find_hit_boxes"):
+        hit_boxes = find_hit_boxes(raid_hits_img, hit_rects.min_width, hit_rects.min_height, report_path=report_path,
+                                   debug=debug, gray=raid_hits_gray, keep_partial=partial_hits,
+                                   threshold=thresholds['boxes'])
+
+    # 2.1 Align boxes cut by the hits window against the full box height
+    full_boxes = None
+    cuts = [""] * len(hit_boxes)
+    if partial_hits:
+        aligned = align_hit_boxes(hit_boxes, hit_rects.min_height, raid_hits_img.shape[0])
+        hit_boxes = [aligned_box.box for aligned_box in aligned]
+        full_boxes = [aligned_box.full_box for aligned_box in aligned]
+        cuts = [aligned_box.cut for aligned_box in aligned]
+    hit_images = [raid_hits_img[box.y:box.y + box.height, box.x:box.x + box.width] for box in hit_boxes]
+
+    # 2.2 Find boxes which were already recognized in other screenshots (partial boxes are not compared)
+    fingerprints = [None] * len(hit_images)
+    duplicates = [-1] * len(hit_images)
+    if deduplicator is not None:
+        for index, box in enumerate(hit_boxes):
+            if cuts[index]:
+                continue
+            with timed("fingerprint"):
+                hit_gray = raid_hits_gray[box.y:box.y + box.height, box.x:box.x + box.width]
+                fingerprints[index] = deduplicator.fingerprint(hit_gray, hit_rects)
+                unique_index = deduplicator.find(fingerprints[index])
+            if unique_index >= 0:
+                logger.debug("recognize_screenshot: hit #%d is the same as %s", index,
+                             deduplicator.sources[unique_index][0])
+                deduplicator.add_source(unique_index, HitSource(name, index))
+                duplicates[index] = unique_index
+
+    hit_crops = []
 
     # 3. Crop hits image to pieces
+    lvBoss_rect = hit_rects.lvBoss_rect.corners if hit_rects.lvBoss_rect else None
     for index, hit_image in enumerate(hit_images):
-        name_rect = ((crop_rects["hit_image"]["name_rect"]["x_start"],
-                      crop_rects["hit_image"]["name_rect"]["y_start"]),
-                     (crop_rects["hit_image"]["name_rect"]["x_end"],
-                      crop_rects["hit_image"]["name_rect"]["y_end"]))
-        party_rect = ((crop_rects["hit_image"]["party_rect"]["x_start"],
-                       crop_rects["hit_image"]["party_rect"]["y_start"]),
-                      (crop_rects["hit_image"]["party_rect"]["x_end"],
-                       crop_rects["hit_image"]["party_rect"]["y_end"]))
-        damage_rect = ((crop_rects["hit_image"]["damage_rect"]["x_start"],
-                        crop_rects["hit_image"]["damage_rect"]["y_start"]),
-                       (crop_rects["hit_image"]["damage_rect"]["x_end"],
-                        crop_rects["hit_image"]["damage_rect"]["y_end"]))
-        boss_rect = ((crop_rects["hit_image"]["boss_rect"]["x_start"],
-                      crop_rects["hit_image"]["boss_rect"]["y_start"]),
-                     (crop_rects["hit_image"]["boss_rect"]["x_end"],
-                      crop_rects["hit_image"]["boss_rect"]["y_end"]))
-        lvBoss_rect = ((crop_rects["hit_image"]["lvBoss_rect"]["x_start"],
-                      crop_rects["hit_image"]["lvBoss_rect"]["y_start"]),
-                     (crop_rects["hit_image"]["lvBoss_rect"]["x_end"],
-                      crop_rects["hit_image"]["lvBoss_rect"]["y_end"]))              
-
-        name_img, party_img, boss_img, damage_img, lvBoss_img = crop_hit_image(hit_image, index,
-                                                                   name_rect, party_rect, damage_rect, boss_rect, lvBoss_rect,
-                                                                   report_path=report_path,
-                                                                   debug=debug)
-        # 4. Recognize name and damage
-        name_rec_img, name = recognize_name(name_img, debug=debug)
-        damage_rec_img, damage = recognize_damage(damage_img, debug=debug)
-        lvBoss_rec_img, boss = recognize_boss(lvBoss_img, debug=debug)
-
-        hit = RecognizedHitRecord(name=name,                      # Recognized name
+        if duplicates[index] >= 0:
+            continue
+
+        if cuts[index]:
+            # Only visible fields of a partial box, others are None
+            box, full_box = hit_boxes[index], full_boxes[index]
+            logger.debug("recognize_screenshot: hit #%d is cut at the %s: %s", index, cuts[index], box)
+            name_img, party_img, boss_img, damage_img = [
+                visible_region(raid_hits_img, box, full_box, rect)
+                for rect in [hit_rects.name_rect, hit_rects.party_rect, hit_rects.boss_rect, hit_rects.damage_rect]]
+            lvBoss_img = visible_region(raid_hits_img, box, full_box, hit_rects.lvBoss_rect) \
+                if hit_rects.lvBoss_rect else None
+        else:
+            with timed("crop_hit_image"):
+                name_img, party_img, boss_img, damage_img, lvBoss_img = crop_hit_image(hit_image, index,
+                                                                           hit_rects.name_rect.corners,
+                                                                           hit_rects.party_rect.corners,
+                                                                           hit_rects.damage_rect.corners,
+                                                                           hit_rects.boss_rect.corners,
+                                                                           lvBoss_rect,
+                                                                           report_path=report_path,
+                                                                           debug=debug)
+        hit_crops.append((index, hit_image, name_img, party_img, boss_img, damage_img, lvBoss_img))
+
+    # 4. Prepare name, damage and boss images of all hits at once
+    with timed("prepare_fields"):
+        prepared = prepare_hit_fields(raid_hits_gray, [hit_boxes[crops[0]] for crops in hit_crops], hit_rects,
+                                      debug=debug,
+                                      full_boxes=[full_boxes[crops[0]] for crops in hit_crops] if full_boxes else None,
+                                      thresholds=thresholds)
+
+    # 4.1 Match boss and party portraits of full boxes with the gallery. Known bosses are not sent to OCR
+    gallery_bosses = [None] * len(hit_crops)
+    parties = [""] * len(hit_crops)
+    if gallery is not None:
+        full = [position for position, crops in enumerate(hit_crops) if not cuts[crops[0]]]
+        with timed("match_gallery"):
+            for position, match in zip(full, gallery.recognize_bosses([hit_crops[position][4] for position in full])):
+                if match.label:
+                    gallery_bosses[position] = match
+                    prepared[position] = prepared[position]._replace(boss=None)
+            for position, party in zip(full, gallery.recognize_parties([hit_crops[position][3] for position in full])):
+                parties[position] = party
+
+    # 4.2 Read damages by glyph templates. Confident ones are not sent to OCR
+    digit_damages = [None] * len(prepared)
+    if glyph_bank is not None:
+        with timed("read_digits"):
+            for position, fields in enumerate(prepared):
+                if fields.damage is None:
+                    continue
+                reading = glyph_bank.read(fields.damage)
+                logger.debug("recognize_screenshot: digits '%s' confidences %s", reading.text,
+                             " ".join(f"{confidence:.2f}" for confidence in reading.confidences))
+                if reading.confident:
+                    digit_damages[position] = reading
+
+    # 5. Recognize name, damage and boss: all names, then all damages, then all bosses
+    # (boss is not recognized for resolutions without lvBoss_rect, fields of partial boxes - if they are not visible)
+    jobs = [(position, field) for field in PreparedHitFields._fields
+            for position, fields in enumerate(prepared)
+            if getattr(fields, field) is not None and not (field == "damage" and digit_damages[position])]
+    with_confidence = with_confidence or min_confidence is not None
+    if batch_ocr:
+        ocr_texts = batch_ocr_fields([getattr(prepared[position], field) for position, field in jobs],
+                                     [field for position, field in jobs], with_confidence)
+    else:
+        ocr_texts = [ocr_field_text(getattr(prepared[position], field), field, with_confidence)
+                     for position, field in jobs]
+
+    # 5.1 Recognize fields with low confidence again in more expensive ways (see reocr.py)
+    if min_confidence is not None:
+        for job_index, (position, field) in enumerate(jobs):
+            confidence = ocr_texts[job_index].confidence
+            if confidence is None or confidence >= min_confidence:
+                continue
+            index = hit_crops[position][0]
+            field_gray = hit_field_gray(raid_hits_gray, hit_boxes[index],
+                                        full_boxes[index] if full_boxes else hit_boxes[index], hit_rects, field,
+                                        thresholds)
+            ocr_texts[job_index] = reocr_field(field_gray, field, ocr_texts[job_index])
+
+    field_texts = [{"name": "", "damage": "", "boss": ""} for _ in prepared]
+    field_confidences = [{"name": None, "damage": None, "boss": None} for _ in prepared]
+    parsers = {"name": parse_name, "damage": parse_damage, "boss": lambda text: text}
+    for (position, field), ocr_text in zip(jobs, ocr_texts):
+        field_texts[position][field] = parsers[field](ocr_text.text)
+        field_confidences[position][field] = ocr_text.confidence
+    for position, reading in enumerate(digit_damages):
+        if reading is not None:
+            field_texts[position]["damage"] = reading.text
+            field_confidences[position]["damage"] = min(reading.confidences)
+    for position, match in enumerate(gallery_bosses):
+        if match is not None:
+            field_texts[position]["boss"] = match.label
+            field_confidences[position]["boss"] = match.score
+
+    hit_records = [None] * len(hit_images)
+    for position, crops in enumerate(hit_crops):
+        index, hit_image, name_img, party_img, boss_img, damage_img, lvBoss_img = crops
+        name_rec_img, damage_rec_img = prepared[position].name, prepared[position].damage
+        hit_name, damage, boss = (field_texts[position][field] for field in PreparedHitFields._fields)
+        confidence = FieldConfidence(**field_confidences[position])
+        logger.debug("recognize_screenshot: name='%s' damage='%s' boss='%s' confidence %s",
+                     hit_name, damage, boss, confidence)
+
+        if deduplicator is not None and fingerprints[index] is not None:
+            deduplicator.add(fingerprints[index], HitSource(name, index),
+                             texts=HitTexts(hit_name, damage, boss, confidence))
+
+        hit = RecognizedHitRecord(name=hit_name,                  # Recognized name
                                   damage=damage,                  # Recognized damage
                                   original_img=hit_image,         # Image of the record
                                   name_rec_img=name_rec_img,      # Image with name (used for recognition)
@@ -434,8 +807,25 @@ def recognize_screenshot(img, crop_rects, name='', report_path="", debug=1):
                                   party_img=party_img,            # Image with party
                                   boss_img=boss_img,              # Image with boss
                                   lvBoss_img=lvBoss_img,          # Image with lvBoss
-                                  boss=boss)                      # Recognized Boss
-        hit_records.append(hit)
+                                  boss=boss,                      # Recognized Boss
+                                  fingerprint=fingerprints[index],
+                                  cut=cuts[index],                # Partial box: "top" or "bottom"
+                                  box=hit_boxes[index],           # Where the box is in the hits window
+                                  party=parties[position],        # Heroes from the gallery
+                                  confidence=confidence)          # How sure name, damage and boss are
+        hit_records[index] = hit
+
+    # Duplicated boxes are not cropped and recognized. Take texts of the same box from other screenshot
+    for index, unique_index in enumerate(duplicates):
+        if unique_index < 0:
+            continue
+        texts = deduplicator.texts[unique_index]
+        hit_records[index] = RecognizedHitRecord(name=texts.name, damage=texts.damage, original_img=hit_images[index],
+                                                 name_rec_img=None, damage_rec_img=None, party_img=None,
+                                                 boss_img=None, lvBoss_img=None, boss=texts.boss,
+                                                 fingerprint=fingerprints[index],
+                                                 duplicate_of=deduplicator.sources[unique_index][0],
+                                                 box=hit_boxes[index], confidence=texts.confidence)
 
     # 99. forming result
     result = RecognizedImage(hit_records=hit_records, name=name)
@@ -443,6 +833,7 @@ def recognize_screenshot(img, crop_rects, name='', report_path="", debug=1):
 
 if __name__ == "__main__":
 
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
     pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
     if not os.path.isdir("report"):
@@ -0,0 +1,192 @@
+"""
+OCR backends: how field images (name, damage, boss) are turned to text
+
+- pytesseract - runs tesseract executable for every call (the original way)
+- tesserocr   - uses tesseract C API in process. Initialized API handle is kept alive per language set
+                (per worker process), so there is no process startup and traineddata loading per field
+
+The backend is selected once per process with set_ocr_backend (gt.py --ocr flag)
+
+image_to_text gives confidence of the text along with it: tesseract confidence of the least sure word
+(0..1, see batch_ocr.words_confidence) with every backend. It is used only when confidence is needed
+(gt.py --min-confidence, --reocr), otherwise the text is taken from image_to_string
+"""
+
+import logging
+import os
+from collections import namedtuple
+
+import pytesseract
+
+from .batch_ocr import batch_image_to_data, data_to_text, words_confidence
+
+logger = logging.getLogger(__name__)
+
+# Recognized text and its confidence 0..1 (None - the backend doesn't know it)
+OcrText = namedtuple('OcrText', ['text', 'confidence'])
+
+
+class OcrBackend:
+    """Base class for OCR backends"""
+
+    name = ""
+
+    def image_to_string(self, img, field):
+        """
+        Recognizes text on a prepared (black on white) field image
+        :param img: image prepared by prepare_name, prepare_damage, prepare_boss
+        :param field: 'name', 'damage' or 'boss'
+        :return: recognized text
+        """
+        raise NotImplementedError()
+
+    def image_to_text(self, img, field, psm=None):
+        """
+        image_to_string with confidence. By default confidence is unknown
+        :param psm: tesseract page segmentation mode number instead of the field's one (None - field's one)
+        :return: OcrText
+        """
+        return OcrText(self.image_to_string(img, field), None)
+
+    def batch_image_to_string(self, images, fields):
+        """
+        Recognizes many field images at once. By default just calls image_to_string for each
+        :param images: list of prepared field images
+        :param fields: list of fields ('name', 'damage' or 'boss') for each image
+        :return: list of recognized texts
+        """
+        return [self.image_to_string(img, field) for img, field in zip(images, fields)]
+
+    def batch_image_to_text(self, images, fields):
+        """batch_image_to_string with confidences: list of OcrText. By default calls image_to_text for each"""
+        return [self.image_to_text(img, field) for img, field in zip(images, fields)]
+
+
+class PytesseractBackend(OcrBackend):
+    """Runs tesseract executable through pytesseract. Field settings are the original ones"""
+
+    name = "pytesseract"
+
+    # language for each field (None = tesseract default)
+    field_langs = {"name": "kor+eng", "damage": None, "boss": None}
+
+    def image_to_string(self, img, field):
+        return pytesseract.image_to_string(img, lang=self.field_langs[field])
+
+    def image_to_text(self, img, field, psm=None):
+        """Text and word confidences are taken from one image_to_data call (one tesseract run)"""
+        data = pytesseract.image_to_data(img, lang=self.field_langs[field], config=f"--psm {psm}" if psm else "",
+                                         output_type=pytesseract.Output.DICT)
+        return OcrText(*data_to_text(data))
+
+    def batch_image_to_string(self, images, fields):
+        return [text for text, _ in self.batch_image_to_text(images, fields)]
+
+    def batch_image_to_text(self, images, fields):
+        """Stitches images with the same language to one page, so it is one tesseract call per language"""
+        texts = [OcrText("", None)] * len(images)
+        for lang in set(self.field_langs[field] for field in fields):
+            indexes = [i for i, field in enumerate(fields) if self.field_langs[field] == lang]
+            lang_texts = batch_image_to_data([images[i] for i in indexes], lang=lang)
+            for index, text in zip(indexes, lang_texts):
+                texts[index] = OcrText(*text)
+        return texts
+
+
+class TesserocrBackend(OcrBackend):
+    """
+    Uses tesseract C API through tesserocr (pip install tesserocr).
+    One initialized API per language set is kept for the life of the process
+    """
+
+    name = "tesserocr"
+
+    # language, page segmentation mode name, characters whitelist for each field
+    field_settings = {
+        "name": ("kor+eng", "SINGLE_LINE", ""),
+        "damage": ("eng", "SINGLE_LINE", "0123456789,.'"),
+        "boss": ("eng", "SINGLE_LINE", ""),
+    }
+
+    def __init__(self, tessdata_path=None):
+        try:
+            import tesserocr
+        except ImportError:
+            logger.error("TesserocrBackend: tesserocr is not installed. Run: pip install tesserocr")
+            raise
+        self._tesserocr = tesserocr
+        self._tessdata_path = tessdata_path
+        self._apis = {}
+
+    def _get_api(self, lang):
+        """Returns initialized API for the language set. Creates it on the first use"""
+        api = self._apis.get(lang)
+        if api is None:
+            logger.info("TesserocrBackend: initializing tesseract API for lang='%s'", lang)
+            if self._tessdata_path:
+                api = self._tesserocr.PyTessBaseAPI(path=self._tessdata_path, lang=lang)
+            else:
+                api = self._tesserocr.PyTessBaseAPI(lang=lang)
+            self._apis[lang] = api
+        return api
+
+    def image_to_string(self, img, field):
+        return self._recognize(img, field).GetUTF8Text()
+
+    def image_to_text(self, img, field, psm=None):
+        api = self._recognize(img, field, psm)
+        return OcrText(api.GetUTF8Text(), words_confidence(api.AllWordConfidences()))
+
+    def _recognize(self, img, field, psm=None):
+        """Sets the image and settings of the field to the API of its language. Gives the API to get results"""
+        lang, psm_name, whitelist = self.field_settings[field]
+        api = self._get_api(lang)
+        api.SetPageSegMode(psm if psm is not None else getattr(self._tesserocr.PSM, psm_name))
+        api.SetVariable("tessedit_char_whitelist", whitelist)
+
+        # Images are grayscale numpy arrays. Pass raw bytes, so no PIL conversion is needed
+        if len(img.shape) == 3:
+            height, width, channels = img.shape
+        else:
+            height, width = img.shape
+            channels = 1
+        api.SetImageBytes(img.tobytes(), width, height, channels, width * channels)
+        return api
+
+    def close(self):
+        for api in self._apis.values():
+            api.End()
+        self._apis = {}
+
+
+ocr_backend_names = [PytesseractBackend.name, TesserocrBackend.name]
+
+# Backend used by recognize_name, recognize_damage, recognize_boss in this process
+_ocr_backend = PytesseractBackend()
+
+
+def create_ocr_backend(name, tesseract_cmd=""):
+    """
+    Creates backend by name
+    :param name: one of ocr_backend_names
+    :param tesseract_cmd: path to tesseract executable. tessdata folder next to it is used by tesserocr
+    """
+    if name == PytesseractBackend.name:
+        return PytesseractBackend()
+    if name == TesserocrBackend.name:
+        tessdata_path = os.path.join(os.path.dirname(tesseract_cmd), "tessdata") if tesseract_cmd else ""
+        return TesserocrBackend(tessdata_path if os.path.isdir(tessdata_path) else None)
+    raise ValueError(f"Unknown OCR backend '{name}'. Known backends: {ocr_backend_names}")
+
+
+def set_ocr_backend(backend):
+    """Sets OCR backend for this process. backend - OcrBackend or its name"""
+    global _ocr_backend
+    if isinstance(backend, str):
+        backend = create_ocr_backend(backend, pytesseract.pytesseract.tesseract_cmd)
+    _ocr_backend = backend
+
+
+def get_ocr_backend():
+    """OCR backend of this process"""
+    return _ocr_backend
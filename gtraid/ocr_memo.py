@@ -0,0 +1,160 @@
+"""
+OCR memoization for near-identical field images
+
+Players scroll the hits list, so the same hit box appears in 2-3 consecutive screenshots.
+Prepared (binarized) name and boss images of such boxes are nearly identical,
+so OCR result of the first one can be reused for the others.
+
+How near-identical images are found:
+- images are grouped by field and exact size (the same box gives the same crop size)
+- a perceptual hash (image downscaled to HASH_WIDTH x HASH_HEIGHT bits) quickly selects candidates
+  with a small hamming distance. All hashes of a group are compared at once with numpy
+- candidates are verified on the full resolution binary image: only a tiny fraction of pixels may differ
+
+Damage is never memoized (MEMO_FIELDS): one digit replaced by another of the same width changes only
+a few pixels of the damage crop (as few as 3 in test_images), fewer than two screenshots of the same
+damage may differ, so a different damage would silently get the text of a remembered one.
+"""
+
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+HASH_WIDTH = 32
+HASH_HEIGHT = 8
+
+# Fields which OCR results are reused. Damages differ by a single digit (see above)
+MEMO_FIELDS = ('name', 'boss')
+
+# Max different bits of perceptual hash for a candidate
+MAX_HASH_DISTANCE = 4
+
+# Max fraction of different pixels of binarized images to reuse OCR result
+MAX_PIXEL_DIFFERENCE = 0.005
+
+# Learned OCR result. hash and mask are packed bits, confidence is 0..1 (None - unknown)
+OcrMemoEntry = namedtuple('OcrMemoEntry', ['field', 'height', 'width', 'hash', 'mask', 'text', 'confidence'],
+                          defaults=[None])
+
+
+class OcrMemoStats:
+    def __init__(self, lookups=0, hits=0):
+        self.lookups = lookups
+        self.hits = hits
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0
+
+    def __add__(self, other):
+        return OcrMemoStats(self.lookups + other.lookups, self.hits + other.hits)
+
+    def __sub__(self, other):
+        return OcrMemoStats(self.lookups - other.lookups, self.hits - other.hits)
+
+    def __repr__(self):
+        return (f"OcrMemoStats(lookups={self.lookups}, hits={self.hits}, "
+                f"hit_rate={self.hit_rate:.0%}, ocr_calls_saved={self.hits})")
+
+
+def binarize(img):
+    """Field images are already black and white, but may come as 3 channels"""
+    if len(img.shape) == 3:
+        img = img[:, :, 0]
+    return img > 127
+
+
+def perceptual_hash(binary_img):
+    """Downscales binary image to HASH_WIDTH x HASH_HEIGHT and packs it to bits"""
+    small = cv2.resize(binary_img.astype(np.uint8) * 255, (HASH_WIDTH, HASH_HEIGHT), interpolation=cv2.INTER_AREA)
+    return np.packbits(small > 127)
+
+
+class OcrMemo:
+    """Remembers OCR results of field images and finds them for near-identical images"""
+
+    def __init__(self):
+        # (field, height, width) -> [stacked hashes array, list of entries]
+        self._groups = {}
+        self.stats = OcrMemoStats()
+        self.new_entries = []    # Entries learned (not loaded) since the last take_new_entries
+
+    def __len__(self):
+        return sum(len(entries) for _, entries in self._groups.values())
+
+    def lookup(self, field, img):
+        """
+        Finds OCR result of a near-identical image
+        :param field: 'name', 'damage' or 'boss'
+        :param img: prepared (binarized) field image
+        :return: text or None if no such image was recognized (always None for damage)
+        """
+        entry = self.lookup_entry(field, img)
+        return entry.text if entry is not None else None
+
+    def lookup_entry(self, field, img):
+        """lookup which gives OcrMemoEntry (with confidence of the text) or None"""
+        if field not in MEMO_FIELDS:
+            return None
+        self.stats.lookups += 1
+        binary_img = binarize(img)
+        group = self._groups.get((field, binary_img.shape[0], binary_img.shape[1]))
+        if group is None:
+            return None
+
+        hashes, entries = group
+        distances = np.unpackbits(np.bitwise_xor(hashes, perceptual_hash(binary_img)), axis=1).sum(axis=1)
+        max_different_pixels = MAX_PIXEL_DIFFERENCE * binary_img.size
+        packed_img = np.packbits(binary_img)
+        for index in np.argsort(distances):
+            if distances[index] > MAX_HASH_DISTANCE:
+                break
+            entry = entries[index]
+            different_pixels = np.unpackbits(np.bitwise_xor(entry.mask, packed_img)).sum()
+            if different_pixels <= max_different_pixels:
+                self.stats.hits += 1
+                return entry
+        return None
+
+    def add(self, field, img, text, confidence=None):
+        """Remembers OCR result (and its confidence) for the image. Fields not in MEMO_FIELDS are not remembered"""
+        if field not in MEMO_FIELDS:
+            return
+        binary_img = binarize(img)
+        entry = OcrMemoEntry(field=field, height=binary_img.shape[0], width=binary_img.shape[1],
+                             hash=perceptual_hash(binary_img), mask=np.packbits(binary_img), text=text,
+                             confidence=confidence)
+        self.add_entry(entry)
+        self.new_entries.append(entry)
+
+    def add_entry(self, entry):
+        """Adds entry (e.g. loaded from a persistent storage). Entries of fields not in MEMO_FIELDS are skipped"""
+        if entry.field not in MEMO_FIELDS:
+            return
+        key = (entry.field, entry.height, entry.width)
+        group = self._groups.get(key)
+        if group is None:
+            self._groups[key] = [entry.hash[np.newaxis, :], [entry]]
+        else:
+            group[0] = np.vstack((group[0], entry.hash))
+            group[1].append(entry)
+
+    def take_new_entries(self):
+        """Returns entries learned since the last call (to send them from a worker or to save them)"""
+        new_entries = self.new_entries
+        self.new_entries = []
+        return new_entries
+
+
+# Memo used by recognize_name, recognize_damage, recognize_boss in this process. None = no memoization
+_ocr_memo = None
+
+
+def set_ocr_memo(memo):
+    global _ocr_memo
+    _ocr_memo = memo
+
+
+def get_ocr_memo():
+    return _ocr_memo
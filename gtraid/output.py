@@ -0,0 +1,339 @@
+"""
+Outputs of recognized hits (sinks)
+
+- xlsx    - Excel with thumbnails to check results by eye (see xlsx_output.py)
+- csv     - text fields only
+- jsonl   - text fields only, one JSON object per hit
+- parquet - text fields only, columnar (pip install pyarrow). The output is a folder of part files,
+            each run adds a new part, so results are appended without rewriting anything
+- db      - SQLite results database of all runs for leaderboards and player history (see results_db.py).
+            Hits already in the database are not added again
+
+Text outputs are much faster to write and to open than Excel with images and are enough for leaderboards.
+Confidence of recognized fields is written to the confidence columns, xlsx highlights fields with confidence
+below min_confidence.
+With a roster (see roster.py) names snapped to roster names keep the recognized name in ocr_name,
+xlsx highlights names which are not in the roster.
+With image_dir they also save thumbnails as files and write their paths.
+With append=True csv and jsonl add rows to the end of existing files and parquet adds a part file.
+"""
+
+import csv
+import json
+import logging
+import os
+import time
+
+from .screenshot_time import parse_screenshot_time
+
+logger = logging.getLogger(__name__)
+
+# Text columns of each hit
+HIT_COLUMNS = ['file_name',         # Screenshot file name as given
+               'image_base_name',   # File name without directory and extension
+               'screenshot_time',   # Time from the file name (ISO format) or empty
+               'hit_index',         # Index of the hit in the screenshot
+               'name',              # Recognized name
+               'damage',            # Recognized damage text
+               'damage_value',      # Damage as a number or empty if it can't be parsed
+               'boss',              # Recognized boss text
+               'boss_short',        # Short boss name
+               'party',             # Recognized heroes "hero, hero, ..." (gt.py --gallery) or empty
+               'name_confidence',   # How sure name, damage and boss are: 0..1 or empty if unknown
+               'damage_confidence',
+               'boss_confidence',
+               'ocr_name',          # Recognized name if it was snapped to the roster (gt.py --roster) or empty
+               'name_status']       # Roster status of the name: known, snapped, unknown or empty without roster
+
+# Confidence columns and their fields of image_reco.FieldConfidence
+CONFIDENCE_COLUMNS = {'name_confidence': 'name', 'damage_confidence': 'damage', 'boss_confidence': 'boss'}
+
+# Thumbnails which are saved with image_dir. Columns are <image>_path
+IMAGE_FIELDS = ['name_img', 'damage_img', 'party_img', 'boss_img', 'lvBoss_img', 'hit_img']
+
+
+def parse_damage_number(damage):
+    """Converts recognized damage like '1,234,567' to int. Raises ValueError"""
+    return int(damage.replace(',', '').replace(' ', '').replace('.', '').replace('\'', ''))
+
+
+def boss_short_name(boss):
+    """
+    Short boss name for the boss column from the OCR text of lvBoss.
+    Bosses recognized by the gallery (gt.py --gallery) are labels of reference images and stay as they are
+    """
+    if boss.find('Goblin') != -1:
+        boss = 'Goblin'
+    elif boss.find('Commander') != -1:
+        boss = 'Invader'
+    elif boss.find('Sandmonster') != -1:
+        boss = 'Sandy'
+    elif boss.find('Marina') != -1:
+        boss = 'Marina'
+    return boss
+
+
+def field_confidence(hit_record, field):
+    """Confidence of a field of a hit record rounded to 3 digits, None if it is unknown"""
+    confidence = getattr(hit_record.confidence, field) if hit_record.confidence is not None else None
+    return round(confidence, 3) if confidence is not None else None
+
+
+class OutputSink:
+    """Base class for outputs. Gets ProcessedFile-s (see pipeline.py) in the order of files"""
+
+    name = ""
+    extension = ""
+    needs_thumbnails = False        # Thumbnails are written (so they have to be made by the pipeline)
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file_names = [file_name]   # Names of all created files
+
+    def write(self, processed_file):
+        """Writes all hits of a processed screenshot"""
+        raise NotImplementedError()
+
+    def write_duplicate_sources(self, deduplicator):
+        """
+        Writes all screenshots where each unique box was seen (hit_dedup.HitDeduplicator).
+        Text outputs are written once row by row, so they have no place for it
+        """
+        pass
+
+    def flush(self):
+        """Makes written hits durable while the output stays open (for a long running bot, see discord_bot.py)"""
+        pass
+
+    def close(self):
+        pass
+
+
+class TableOutput(OutputSink):
+    """Base class for text outputs: a hit is a row with HIT_COLUMNS (and image paths)"""
+
+    def __init__(self, file_name, append=False, image_dir=""):
+        super().__init__(file_name)
+        self.append = append
+        self.image_dir = image_dir
+        self.needs_thumbnails = bool(image_dir)
+        self.columns = HIT_COLUMNS + ([f"{field}_path" for field in IMAGE_FIELDS] if image_dir else [])
+        if image_dir and not os.path.isdir(image_dir):
+            os.makedirs(image_dir)
+
+    def _save_image(self, thumbnail, image_base_name, hit_index, field):
+        """Saves thumbnail to image_dir. Returns file name or "" if there is no image"""
+        if not thumbnail.data:
+            return ""
+        file_name = os.path.join(self.image_dir, f"{image_base_name}_{hit_index}_{field}.jpg")
+        with open(file_name, "wb") as image_file:
+            image_file.write(thumbnail.data)
+        return file_name
+
+    def rows(self, processed_file):
+        """Converts hits of ProcessedFile to a list of {column: value}"""
+        screenshot_time = parse_screenshot_time(processed_file.file_name)
+        rows = []
+        for hit_record in processed_file.hit_records:
+            try:
+                damage_value = parse_damage_number(hit_record.damage) if hit_record.damage else None
+            except ValueError:
+                damage_value = None
+            row = {
+                'file_name': processed_file.file_name,
+                'image_base_name': processed_file.image_base_name,
+                'screenshot_time': screenshot_time.isoformat() if screenshot_time else None,
+                'hit_index': hit_record.hit_index,
+                'name': hit_record.name,
+                'damage': hit_record.damage,
+                'damage_value': damage_value,
+                'boss': hit_record.boss,
+                'boss_short': boss_short_name(hit_record.boss) if hit_record.boss else hit_record.boss,
+                'party': hit_record.party,
+                'ocr_name': hit_record.ocr_name,
+                'name_status': hit_record.name_status,
+            }
+            for column, field in CONFIDENCE_COLUMNS.items():
+                row[column] = field_confidence(hit_record, field)
+            if self.image_dir:
+                for field in IMAGE_FIELDS:
+                    row[f"{field}_path"] = self._save_image(getattr(hit_record, field), processed_file.image_base_name,
+                                                            hit_record.hit_index, field)
+            rows.append(row)
+        return rows
+
+    def write(self, processed_file):
+        rows = self.rows(processed_file)
+        if rows:
+            self.write_rows(rows)
+
+    def write_rows(self, rows):
+        raise NotImplementedError()
+
+
+class CsvOutput(TableOutput):
+    name = "csv"
+    extension = ".csv"
+
+    def __init__(self, file_name, append=False, image_dir=""):
+        super().__init__(file_name, append, image_dir)
+        exists = append and os.path.isfile(file_name) and os.path.getsize(file_name) > 0
+        if exists:
+            with open(file_name, newline='', encoding='utf-8') as csv_file:
+                header = next(csv.reader(csv_file), [])
+            if header != self.columns:
+                raise ValueError(f"Can't append to '{file_name}': it has other columns {header}. "
+                                 f"Expected {self.columns} (is --image-dir the same as before?)")
+        logger.info("CsvOutput: %s '%s'", 'appending to' if exists else 'creating', file_name)
+        self._file = open(file_name, "a" if exists else "w", newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, self.columns)
+        if not exists:
+            self._writer.writeheader()
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JsonLinesOutput(TableOutput):
+    name = "jsonl"
+    extension = ".jsonl"
+
+    def __init__(self, file_name, append=False, image_dir=""):
+        super().__init__(file_name, append, image_dir)
+        logger.info("JsonLinesOutput: %s '%s'", 'appending to' if append else 'creating', file_name)
+        self._file = open(file_name, "a" if append else "w", encoding='utf-8')
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetOutput(TableOutput):
+    """
+    Parquet dataset: a folder with part files. Rows are written by row groups of row_group_size,
+    so memory doesn't depend on the number of hits. Read it with pyarrow.parquet.read_table(folder)
+
+    A part is written to a hidden file (ignored by read_table) and renamed when it is complete.
+    flush completes the current part and the next rows go to a new one, so after a crash
+    the folder has all flushed rows (parquet footer is written only when a file is closed).
+    """
+
+    name = "parquet"
+    extension = ".parquet"
+
+    def __init__(self, file_name, append=False, image_dir="", row_group_size=10000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            logger.error("ParquetOutput: pyarrow is not installed. Run: pip install pyarrow")
+            raise
+        super().__init__(file_name, append, image_dir)
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.row_group_size = row_group_size
+
+        if not os.path.isdir(file_name):
+            os.makedirs(file_name)
+        if not append:
+            for part_name in os.listdir(file_name):
+                if part_name.lstrip(".").startswith("part-") and part_name.endswith(".parquet"):
+                    os.remove(os.path.join(file_name, part_name))
+
+        # Part names are unique for each run, previous parts are never touched
+        self._part_prefix = os.path.join(file_name, f"part-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        logger.info("ParquetOutput: writing '%s-*.parquet'", self._part_prefix)
+        self.file_names = []            # Completed parts
+
+        column_types = {'hit_index': pyarrow.int64(), 'damage_value': pyarrow.int64(),
+                        **{column: pyarrow.float64() for column in CONFIDENCE_COLUMNS}}
+        self._schema = pyarrow.schema([(column, column_types.get(column, pyarrow.string()))
+                                       for column in self.columns])
+        self._writer = None
+        self._part_name = ""
+        self._rows = []
+
+    def write_rows(self, rows):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.row_group_size:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        if self._writer is None:
+            self._part_name = f"{self._part_prefix}-{len(self.file_names):04d}.parquet"
+            self._writer = self._pq.ParquetWriter(self._hidden_name(self._part_name), self._schema)
+        self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self._schema))
+        self._rows = []
+
+    @staticmethod
+    def _hidden_name(part_name):
+        folder, base_name = os.path.split(part_name)
+        return os.path.join(folder, "." + base_name)
+
+    def _complete_part(self):
+        """Writes the rest of rows and renames the current part (if any) to its final name"""
+        if self._rows:
+            self._write_row_group()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.replace(self._hidden_name(self._part_name), self._part_name)
+            self.file_names.append(self._part_name)
+
+    def flush(self):
+        self._complete_part()
+
+    def close(self):
+        self._complete_part()       # No empty part files if nothing was written
+
+
+_table_outputs = {output.name: output for output in [CsvOutput, JsonLinesOutput, ParquetOutput]}
+
+output_format_names = ["xlsx"] + list(_table_outputs) + ["db"]
+
+_output_extensions = {"xlsx": ".xlsx", "db": ".db", **{name: output.extension for name, output in _table_outputs.items()}}
+
+
+def output_file_name(file_name, output_format):
+    """Output file name for the format: the given name with the format extension"""
+    if output_format not in output_format_names:
+        raise ValueError(f"Unknown output format '{output_format}'. Known formats: {output_format_names}")
+    return os.path.splitext(file_name)[0] + _output_extensions[output_format]
+
+
+def create_output(output_format, file_name, append=False, image_dir="", streaming=False, max_rows=0,
+                  split_by_day=False, dedup_sources=False, season="", min_confidence=None):
+    """
+    Creates output by format name
+    :param output_format: one of output_format_names
+    :param file_name: output file name (for parquet - folder name)
+    :param append: add results to the existing output (not supported by xlsx, db is always added to)
+    :param image_dir: text outputs save thumbnails to this folder and write their paths ("" - no images)
+    :param streaming, max_rows, split_by_day, dedup_sources: xlsx options (see XlsxOutput)
+    :param season: season name of hits in db ("" - by screenshot time, see results_db.py)
+    :param min_confidence: xlsx highlights fields with lower confidence (None - no highlighting)
+    """
+    if output_format == "db":
+        from .results_db import DatabaseOutput
+        return DatabaseOutput(file_name, season=season)
+    if output_format == "xlsx":
+        if append:
+            raise ValueError("xlsx output can't be appended, use csv, jsonl or parquet format")
+        from .xlsx_output import XlsxOutput
+        return XlsxOutput(file_name, streaming=streaming, max_rows=max_rows, split_by_day=split_by_day,
+                          dedup_sources=dedup_sources, min_confidence=min_confidence)
+    if output_format in _table_outputs:
+        return _table_outputs[output_format](file_name, append=append, image_dir=image_dir)
+    raise ValueError(f"Unknown output format '{output_format}'. Known formats: {output_format_names}")
@@ -0,0 +1,184 @@
+"""
+Partial hits: hit boxes cut at the top or at the bottom of the hits window (scrolled list)
+
+Without it such boxes are dropped by min_height, or kept with crop rects skewed (if the box is
+cut from the top, see test_images/bad_crop.jpg). With partial hits on:
+
+1. find_hit_boxes keeps boxes lower than min_height (but at least PARTIAL_MIN_VISIBLE of a full box)
+2. align_hit_boxes aligns each cut box against the full box height (the tallest box of the screenshot):
+   a box cut at the top is a full box which starts above the hits window
+3. only fields which are visible (FIELD_MIN_VISIBLE of the rect height) are cropped and recognized,
+   others are empty. A box cut at the top has damage and party, a box cut at the bottom has name and boss
+4. PartialHitMerger merges partial records of adjacent screenshots (in the order of files):
+   a partial record is dropped if the neighbour screenshot has the full record of the same hit,
+   the bottom part of a hit at the end of one screenshot and its top part at the beginning of the
+   next one are merged into one record
+"""
+
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Cut boxes lower than this part of the full box height are dropped
+PARTIAL_MIN_VISIBLE = 0.25
+
+# A field is recognized if at least this part of its rect height is visible
+FIELD_MIN_VISIBLE = 0.85
+
+# Box is cut if it is lower than the full box height by more than this part (+- a pixel or two for full boxes)
+CUT_TOLERANCE = 0.02
+
+# Partial records are marked by the cut side
+CUT_TOP = "top"
+CUT_BOTTOM = "bottom"
+
+AlignedHitBox = namedtuple('AlignedHitBox',
+                           ['box',          # HitBox of the visible part in the hits window
+                            'full_box',     # HitBox of the whole hit aligned by the full height (may go out of the window)
+                            'cut'])         # "" - full box, CUT_TOP or CUT_BOTTOM
+
+
+def align_hit_boxes(hit_boxes, min_height, window_height):
+    """
+    Aligns cut boxes against the full box height
+
+    :param hit_boxes: list of HitBox (including boxes lower than min_height)
+    :param min_height: hit_image.min_height of the resolution (boxes higher are not partial)
+    :param window_height: height of the hits window
+    :return: list of AlignedHitBox sorted from the top to the bottom
+    """
+    full_height = max((box.height for box in hit_boxes if box.height > min_height), default=0)
+    if not full_height:
+        logger.warning("align_hit_boxes: no full hit boxes, partial boxes are not aligned")
+        return sorted((AlignedHitBox(box, box, "") for box in hit_boxes if box.height > min_height),
+                      key=lambda aligned_box: aligned_box.box.y)
+
+    tolerance = max(round(full_height * CUT_TOLERANCE), 2)
+    aligned = []
+    for box in hit_boxes:
+        if box.height >= full_height - tolerance:
+            aligned.append(AlignedHitBox(box, box, ""))
+        elif box.height < full_height * PARTIAL_MIN_VISIBLE:
+            logger.debug("align_hit_boxes: skipping too small partial box: %s", box)
+        elif box.y + box.height / 2 < window_height / 2:
+            # Cut at the top: the full box starts above the window
+            full_box = box._replace(y=box.y - (full_height - box.height), height=full_height)
+            aligned.append(AlignedHitBox(box, full_box, CUT_TOP))
+        else:
+            aligned.append(AlignedHitBox(box, box._replace(height=full_height), CUT_BOTTOM))
+
+    # Records go from the top of the list to the bottom, so adjacent screenshots can be merged
+    return sorted(aligned, key=lambda aligned_box: aligned_box.box.y)
+
+
+def visible_rows(box, full_box, rect):
+    """
+    Rows of the rect (relative to the full box) which are visible in the box.
+    :return: (y_start, y_end) in the hits window or None if less than FIELD_MIN_VISIBLE of the rect is visible
+    """
+    y_start = max(full_box.y + rect.y_start, box.y)
+    y_end = min(full_box.y + min(rect.y_end, full_box.height), box.y + box.height)
+    if y_end - y_start < FIELD_MIN_VISIBLE * rect.height:
+        return None
+    return y_start, y_end
+
+
+def visible_region(img, box, full_box, rect):
+    """
+    Visible region of a rect of the aligned hit box from the hits window image (clipped by the box).
+    :return: image or None if the field is not visible enough to be recognized
+    """
+    rows = visible_rows(box, full_box, rect)
+    if rows is None:
+        return None
+    x_start = box.x + min(rect.x_start, box.width)
+    x_end = box.x + min(rect.x_end, box.width)
+    return img[rows[0]:rows[1], x_start:x_end]
+
+
+def merged_confidence(bottom, top):
+    """Confidence of a hit merged of its bottom and top parts: each field's one is of the part it is taken from"""
+    if bottom.confidence is None or top.confidence is None:
+        return bottom.confidence or top.confidence
+    return bottom.confidence._replace(name=bottom.confidence.name if bottom.name else top.confidence.name,
+                                      boss=bottom.confidence.boss if bottom.boss else top.confidence.boss,
+                                      damage=top.confidence.damage if top.damage else bottom.confidence.damage)
+
+
+class PartialHitMergerStats:
+    """How partial records were resolved"""
+
+    def __init__(self):
+        self.dropped = 0        # Partial records which have the full record in the neighbour screenshot
+        self.merged = 0         # Pairs of bottom + top parts merged into one record
+        self.kept = 0           # Partial records left as they are (other fields are empty)
+
+    def __repr__(self):
+        return f"PartialHitMergerStats(dropped={self.dropped}, merged={self.merged}, kept={self.kept})"
+
+
+class PartialHitMerger:
+    """
+    Merges partial records (CompactHitRecord with cut) of adjacent screenshots. Screenshots must
+    come in the order they were taken (scrolling the list down). Each ProcessedFile is given out
+    when the next one is seen, because its last record may be completed by the next screenshot
+    """
+
+    def __init__(self):
+        self.stats = PartialHitMergerStats()
+
+    def merge(self, processed_files):
+        """Generator of ProcessedFile-s with partial records resolved, in the same order"""
+        previous = None
+        for processed_file in processed_files:
+            if previous is not None:
+                previous, processed_file = self._merge_pair(previous, processed_file)
+                yield previous
+            previous = processed_file
+        if previous is not None:
+            self.stats.kept += sum(1 for hit_record in previous.hit_records if hit_record.cut)
+            yield previous
+
+    def _merge_pair(self, previous, current):
+        """Resolves the bottom cut record at the end of previous and the top cut record at the beginning of current"""
+        previous_records = list(previous.hit_records)
+        current_records = list(current.hit_records)
+        previous_damages = {hit_record.damage for hit_record in previous_records if not hit_record.cut and hit_record.damage}
+        current_damages = {hit_record.damage for hit_record in current_records if not hit_record.cut and hit_record.damage}
+
+        # Top part of current: the full record is in previous (the list was scrolled less than a page)
+        top = current_records[0] if current_records and current_records[0].cut == CUT_TOP else None
+        if top is not None and top.damage and top.damage in previous_damages:
+            current_records.pop(0)
+            top = None
+            self.stats.dropped += 1
+
+        bottom = previous_records[-1] if previous_records and previous_records[-1].cut == CUT_BOTTOM else None
+        if bottom is not None:
+            # The first full record of current which is not in previous is the same hit
+            new_records = [hit_record for hit_record in current_records
+                           if not hit_record.cut and hit_record.damage not in previous_damages]
+            if (bottom.damage and bottom.damage in current_damages) or \
+                    (top is None and bottom.name and new_records and new_records[0].name == bottom.name):
+                previous_records.pop()
+                self.stats.dropped += 1
+            elif top is not None:
+                # The list was scrolled exactly by a page: parts of the same hit on both screenshots.
+                # Name and boss are at the top of a hit box, damage and party are at the bottom
+                previous_records[-1] = bottom._replace(
+                    name=bottom.name or top.name, boss=bottom.boss or top.boss, damage=top.damage or bottom.damage,
+                    ocr_name=bottom.ocr_name if bottom.name else top.ocr_name,
+                    name_status=bottom.name_status if bottom.name else top.name_status,
+                    name_img=bottom.name_img if bottom.name else top.name_img,
+                    lvBoss_img=bottom.lvBoss_img if bottom.boss else top.lvBoss_img,
+                    damage_img=top.damage_img if top.damage else bottom.damage_img,
+                    party_img=top.party_img if top.party_img.data else bottom.party_img,
+                    boss_img=top.boss_img if top.boss_img.data else bottom.boss_img,
+                    confidence=merged_confidence(bottom, top),
+                    cut="")
+                current_records.pop(0)
+                self.stats.merged += 1
+
+        self.stats.kept += sum(1 for hit_record in previous_records if hit_record.cut)
+        return previous._replace(hit_records=previous_records), current._replace(hit_records=current_records)
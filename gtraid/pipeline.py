@@ -0,0 +1,497 @@
+"""
+Screenshot processing pipeline: file -> recognized hits -> compact records for the output
+
+Compact records hold only strings and encoded JPEG thumbnails (not full numpy crops),
+so they are cheap to send from worker processes back to the process which writes Excel.
+"""
+
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import Future
+
+import cv2
+import pytesseract
+
+from .image_reco import recognize_screenshot, auto_crop, DimensionsFile, HitSource, HitTexts
+from .dimensions import CropRect, ResolutionDimensions
+from .image_io import read_image_size
+from .ocr_backend import set_ocr_backend
+from .ocr_memo import OcrMemo, OcrMemoStats, get_ocr_memo, set_ocr_memo
+from .hit_dedup import HitDeduplicator, get_hit_deduplicator, set_hit_deduplicator
+from .digit_reader import GlyphBank, get_glyph_bank, set_glyph_bank
+from .template_gallery import TemplateGallery, get_template_gallery, set_template_gallery
+from .stitching import ScrollSequence, assign_hit_boxes
+from .stage_timer import StageTimer, get_stage_timer, set_stage_timer, timed
+
+logger = logging.getLogger(__name__)
+
+# Log format of gt.py and worker processes
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(message)s"
+
+# JPEG encoded thumbnail and its size in pixels
+Thumbnail = namedtuple('Thumbnail', ['data', 'width', 'height'])
+
+CompactHitRecord = namedtuple('CompactHitRecord',
+                              ['hit_index',         # Index of the hit in the screenshot
+                               'name',              # Recognized name
+                               'damage',            # Recognized damage
+                               'boss',              # Recognized Boss
+                               'name_img',          # Thumbnail of name (as used for recognition)
+                               'damage_img',        # Thumbnail of damage (as used for recognition)
+                               'party_img',         # Thumbnail of party
+                               'boss_img',          # Thumbnail of boss
+                               'lvBoss_img',        # Thumbnail of boss LVL and Name
+                               'hit_img',           # Thumbnail of the whole hit
+                               'fingerprint',       # HitFingerprint (if deduplication is on)
+                               'duplicate_of',      # HitSource of the same box recognized before (or None)
+                               'cut',               # Partial box cut at the "top" or "bottom" ("" - full box)
+                               'party',             # Recognized heroes "hero, hero, ..." ("" - not recognized)
+                               'confidence',        # FieldConfidence of name, damage and boss (None - unknown)
+                               'ocr_name',          # Recognized name if it was snapped to the roster (see roster.py)
+                               'name_status'],      # Roster status of the name: known, snapped, unknown ("" - no roster)
+                              defaults=[None, None, "", "", None, "", ""])
+
+# No image (e.g. for duplicated boxes which are not cropped)
+NO_THUMBNAIL = Thumbnail(data=b"", width=0, height=0)
+
+ProcessedFile = namedtuple('ProcessedFile',
+                           ['file_name',            # Full file name as given
+                            'image_base_name',      # File name without directory and extension
+                            'resolution',           # Resolution name like 'w1280h720'
+                            'hit_records',          # list of CompactHitRecord
+                            'error',                # Error text if file was not processed
+                            'ocr_memo_stats',       # OcrMemoStats for this file (None if memo is off)
+                            'ocr_memo_entries',     # OcrMemoEntry-s learned while processing this file
+                            'stage_timings'],       # StageTimer with timings of this file (None if timing is off)
+                           defaults=[None, (), None])
+
+PipelineOptions = namedtuple('PipelineOptions',
+                             ['report_dir',         # Report folder ("" = no report)
+                              'debug',              # 0 - none, 1 - prints, 2 - show images
+                              'batch_ocr',          # Use one tesseract call per screenshot
+                              'ocr_backend',        # OCR backend name (see ocr_backend.py)
+                              'ocr_memo',           # Reuse OCR results for near-identical field images
+                              'dedup',              # Find the same hit boxes by image (see hit_dedup.py)
+                              'thumbnails',         # Make thumbnails (not needed if outputs write text only)
+                              'auto_layout',        # Detect hits window instead of taking it from dimensions file
+                              'partial_hits',       # Recognize visible fields of boxes cut by the hits window
+                              'stitch',             # Recognize overlapping screenshots as one list (see stitching.py)
+                              'timing',             # Time processing stages: "" - off, "stages", "trace" (with events)
+                              'gallery',            # Gallery config to match bosses and heroes ("" - off)
+                              'glyphs',             # Glyph bank to read damage without OCR ("" - off)
+                              'reocr',              # Recognize OCR results with lower confidence again (None - off)
+                              'confidence'],        # Get OCR confidence of fields (always with reocr)
+                             defaults=["", 0, False, "pytesseract", False, False, True, False, False, False, "", "",
+                                       "", None, False])
+
+
+def encode_thumbnail(img, scale):
+    """Resizes image by scale and encodes it to JPEG"""
+    if img is None:
+        return NO_THUMBNAIL
+    img = cv2.resize(img, (0, 0), fx=scale, fy=scale)
+    height, width = img.shape[:2]
+    is_success, buffer = cv2.imencode(".jpg", img)
+    return Thumbnail(data=buffer.tobytes(), width=width, height=height)
+
+
+def compact_hit_record(hit_record, hit_index, thumbnails=True):
+    """
+    Converts RecognizedHitRecord to CompactHitRecord with thumbnails ready to be inserted to Excel
+    :param hit_record: RecognizedHitRecord
+    :param hit_index: index of the hit in the screenshot
+    :param thumbnails: make thumbnails. If False all images are NO_THUMBNAIL
+    :return: CompactHitRecord
+    """
+    if not thumbnails:
+        hit_record = hit_record._replace(original_img=None, name_rec_img=None, damage_rec_img=None, party_img=None,
+                                         boss_img=None, lvBoss_img=None)
+    name_img = damage_img = None
+    if hit_record.name_rec_img is not None:
+        name_img = 255 - auto_crop(255 - hit_record.name_rec_img)        # crop empty edges
+    if hit_record.damage_rec_img is not None:
+        damage_img = 255 - auto_crop(255 - hit_record.damage_rec_img)    # crop empty edges
+
+    return CompactHitRecord(hit_index=hit_index,
+                            name=hit_record.name,
+                            damage=hit_record.damage,
+                            boss=hit_record.boss,
+                            name_img=encode_thumbnail(name_img, 0.4),                      # resize to 40%
+                            damage_img=encode_thumbnail(damage_img, 0.5),                  # resize to 50%
+                            party_img=encode_thumbnail(hit_record.party_img, 0.5),
+                            boss_img=encode_thumbnail(hit_record.boss_img, 0.5),
+                            lvBoss_img=encode_thumbnail(hit_record.lvBoss_img, 0.5),
+                            hit_img=encode_thumbnail(hit_record.original_img, 0.7),        # resize to 70%
+                            fingerprint=hit_record.fingerprint,
+                            duplicate_of=hit_record.duplicate_of,
+                            cut=hit_record.cut,
+                            party=hit_record.party,
+                            confidence=hit_record.confidence)
+
+
+def process_file(file_name, dimensions_file, options=PipelineOptions()):
+    """
+    Reads and recognizes one screenshot file
+
+    :param file_name: screenshot file name
+    :param dimensions_file: DimensionsFile
+    :param options: PipelineOptions
+    :return: ProcessedFile
+    """
+    with timed("process_file"):
+        processed_file = _process_file(file_name, dimensions_file, options)
+    return with_stage_timings(processed_file)
+
+
+def _process_file(file_name, dimensions_file, options):
+    """process_file without timings"""
+    logger.info("Processing: %s", file_name)
+
+    image_base_name = os.path.splitext(os.path.basename(file_name))[0]
+
+    # Crop parameters by the size in the file header, screenshots of unknown resolutions are not decoded
+    crop_rects = None
+    if not options.auto_layout:
+        with timed("read_image_size"):
+            size = read_image_size(file_name)
+        if size is not None:
+            crop_rects = dimensions_file.get_dimensions(*size)
+            if crop_rects is None:
+                logger.error("Resolution %dx%d of '%s' is not found in dimensions file", size[0], size[1], file_name)
+                return ProcessedFile(file_name, image_base_name, "", [], f"Unknown resolution {size[0]}x{size[1]}")
+
+    with timed("imread"):
+        img = cv2.imread(file_name)
+    if img is None:
+        logger.error("Can't open file: %s", file_name)
+        return ProcessedFile(file_name, image_base_name, "", [], f"Can't open file: {file_name}")
+    resolution = DimensionsFile.get_resolution_name(img)
+
+    if options.auto_layout:
+        crop_rects = dimensions_file.get_auto_crop_rects(img)
+    elif crop_rects is None or (crop_rects.width, crop_rects.height) != (img.shape[1], img.shape[0]):
+        # Not PNG or JPEG, or the image is rotated by EXIF orientation
+        crop_rects = dimensions_file.get_crop_rects(img)
+
+    # do we need to fill a report?
+    report_path = f"{options.report_dir}/{image_base_name}_" if options.report_dir else ""
+
+    # The whole screenshot is needed only for report and debug images. Otherwise only a copy of the hits window
+    # is kept, so the screenshot is freed before recognition (OCR takes most of the time)
+    if not report_path and options.debug < 2:
+        img = crop_rects.hits_window.crop(img).copy()
+        crop_rects = crop_rects.window_dimensions()
+
+    memo = get_ocr_memo()
+    memo_stats_before = OcrMemoStats(memo.stats.lookups, memo.stats.hits) if memo is not None else None
+
+    # RECOGNIZE SCREENSHOT
+    result = recognize_screenshot(img, crop_rects, name=file_name, report_path=report_path, debug=options.debug,
+                                  batch_ocr=options.batch_ocr,
+                                  deduplicator=get_hit_deduplicator() if options.dedup else None,
+                                  partial_hits=options.partial_hits, gallery=get_template_gallery(),
+                                  glyph_bank=get_glyph_bank(), min_confidence=options.reocr,
+                                  with_confidence=options.confidence)
+    logger.info("Recognized %d hits", len(result.hit_records))
+
+    with timed("encode_thumbnails"):
+        hit_records = [compact_hit_record(hit_record, hit_index, options.thumbnails)
+                       for hit_index, hit_record in enumerate(result.hit_records)]
+
+    if memo is not None:
+        return ProcessedFile(file_name, image_base_name, resolution, hit_records, "",
+                             ocr_memo_stats=memo.stats - memo_stats_before,
+                             ocr_memo_entries=memo.take_new_entries())
+
+    return ProcessedFile(file_name, image_base_name, resolution, hit_records, "")
+
+
+# Each worker process of a process pool holds its own dimensions file and options
+_worker_dimensions_file = None
+_worker_options = None
+
+
+def setup_ocr_memo(options, memo_entries=()):
+    """Creates OCR memo for this process if it is on in options. memo_entries - known OCR results"""
+    if not options.ocr_memo:
+        set_ocr_memo(None)
+        return
+    memo = OcrMemo()
+    for entry in memo_entries:
+        memo.add_entry(entry)
+    set_ocr_memo(memo)
+
+
+def setup_stage_timer(options):
+    """Creates stage timer for this process if timing is on in options"""
+    set_stage_timer(StageTimer(trace=options.timing == "trace") if options.timing else None)
+
+
+def with_stage_timings(processed_file):
+    """ProcessedFile with timings collected by the stage timer of this process since the last file"""
+    timer = get_stage_timer()
+    if timer is None:
+        return processed_file
+    return processed_file._replace(stage_timings=timer.take())
+
+
+def setup_hit_deduplicator(options):
+    """Creates hit boxes deduplicator for this process if it is on in options"""
+    set_hit_deduplicator(HitDeduplicator() if options.dedup else None)
+
+
+def setup_template_gallery(options):
+    """Loads the gallery for this process if it is on in options. Raises TemplateGalleryError"""
+    set_template_gallery(TemplateGallery(options.gallery) if options.gallery else None)
+
+
+def setup_glyph_bank(options):
+    """Loads the damage glyph bank for this process if it is on in options. Raises OSError, ValueError, KeyError"""
+    set_glyph_bank(GlyphBank.load(options.glyphs) if options.glyphs else None)
+
+
+def init_worker(tesseract_cmd, dimensions_path, options, memo_entries=(), log_level=logging.WARNING):
+    """Process pool initializer. Sets up tesseract, OCR backend and loads dimensions file once per worker"""
+    global _worker_dimensions_file, _worker_options
+    logging.basicConfig(level=log_level, format=LOG_FORMAT)
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    set_ocr_backend(options.ocr_backend)
+    setup_ocr_memo(options, memo_entries)
+    setup_hit_deduplicator(options)
+    setup_template_gallery(options)
+    setup_glyph_bank(options)
+    setup_stage_timer(options)
+    _worker_dimensions_file = DimensionsFile(dimensions_path)
+    _worker_options = options
+
+
+def process_files_in_worker(file_names):
+    """process_file for a process pool worker initialized by init_worker. Processes files one by one"""
+    return [process_file(file_name, _worker_dimensions_file, _worker_options) for file_name in file_names]
+
+
+def collapse_duplicates(processed_file, deduplicator):
+    """
+    Removes hit records which boxes were already seen (in this or previous files) by the deduplicator.
+    Each worker process has its own deduplicator, so a box may be recognized by several workers.
+    This final pass over all results in file order keeps exactly one record per unique box
+
+    :return: ProcessedFile with records of new unique boxes only
+    """
+    unique_records = []
+    for hit_record in processed_file.hit_records:
+        if hit_record.fingerprint is None:
+            unique_records.append(hit_record)
+            continue
+        source = HitSource(processed_file.file_name, hit_record.hit_index)
+        unique_index = deduplicator.find(hit_record.fingerprint)
+        if unique_index >= 0:
+            deduplicator.add_source(unique_index, source)
+        else:
+            deduplicator.add(hit_record.fingerprint, source, texts=HitTexts(hit_record.name, hit_record.damage,
+                                                                            hit_record.boss, hit_record.confidence))
+            unique_records.append(hit_record)
+    return processed_file._replace(hit_records=unique_records)
+
+
+def cache_settings(options):
+    """
+    Settings which change cached results: OCR backend, if there are thumbnails, auto layout, partial hits,
+    templates of the gallery and the glyph bank (of this process, see setup_template_gallery, setup_glyph_bank),
+    the second recognition pass threshold, OCR confidence and deduplication (hit records have fingerprints
+    only if it is on)
+    """
+    settings = options.ocr_backend if options.thumbnails else f"{options.ocr_backend}:no-thumbnails"
+    if options.auto_layout:
+        settings += ":auto-layout"
+    if options.partial_hits:
+        settings += ":partial-hits"
+    gallery = get_template_gallery()
+    if options.gallery and gallery is not None:
+        settings += f":gallery-{gallery.signature}"
+    glyph_bank = get_glyph_bank()
+    if options.glyphs and glyph_bank is not None:
+        settings += f":glyphs-{glyph_bank.signature}"
+    if options.reocr is not None:
+        settings += f":reocr-{options.reocr}"
+    elif options.confidence:
+        settings += ":confidence"
+    if options.dedup:
+        settings += ":dedup"
+    return settings
+
+
+def process_files(files, dimensions_file, options=PipelineOptions(), executor=None, cache=None, deduplicator=None,
+                  chunk_size=1):
+    """
+    Processes files giving ProcessedFile results in the order of files
+
+    :param files: list of screenshot file names
+    :param dimensions_file: DimensionsFile (used if there is no executor)
+    :param options: PipelineOptions
+    :param executor: ProcessPoolExecutor with workers initialized by init_worker. None = process here
+    :param cache: RecognitionCache. None = no cache
+    :param deduplicator: HitDeduplicator to collapse the same boxes in results (if options.dedup is on)
+    :param chunk_size: how many consecutive files a worker processes in one task. With deduplication
+                       bigger chunks keep overlapping screenshots in the same worker and its deduplicator
+    """
+    # Take what we can from the cache and send the rest to workers at once,
+    # so workers are busy while results are consumed in order
+    keys = []
+    pending = []        # ProcessedFile from cache, (future, index in chunk) or None to process here
+    chunk = []
+    for file_name in files:
+        key = cache.make_key(file_name, cache_settings(options)) if cache else ""
+        processed_file = cache.get(key, file_name) if cache else None
+        keys.append(key)
+        pending.append(processed_file)
+        if processed_file is None and executor:
+            chunk.append(len(pending) - 1)
+            if len(chunk) == chunk_size:
+                _submit_chunk(executor, files, pending, chunk)
+                chunk = []
+    if chunk:
+        _submit_chunk(executor, files, pending, chunk)
+
+    for file_name, key, processed_file in zip(files, keys, pending):
+        if processed_file is None:
+            processed_file = process_file(file_name, dimensions_file, options)
+        elif isinstance(processed_file, tuple) and isinstance(processed_file[0], Future):
+            future, index_in_chunk = processed_file
+            processed_file = future.result()[index_in_chunk]
+        else:
+            logger.info("Taking recognized hits from cache: %s", file_name)
+            key = ""
+
+        if cache and key:
+            cache.put_ocr_memo_entries(processed_file.ocr_memo_entries, options.ocr_backend)
+            cache.put(key, processed_file)
+
+        if deduplicator is not None:
+            processed_file = collapse_duplicates(processed_file, deduplicator)
+        yield processed_file
+
+
+def _submit_chunk(executor, files, pending, chunk):
+    """Submits files with indexes in chunk to executor, puts (future, index in chunk) to pending"""
+    future = executor.submit(process_files_in_worker, [files[index] for index in chunk])
+    for index_in_chunk, index in enumerate(chunk):
+        pending[index] = (future, index_in_chunk)
+
+
+def process_sequence(sequence, options=PipelineOptions()):
+    """
+    Recognizes screenshots of a scroll sequence as one long hits list, so each hit box is found
+    and recognized once. Boxes are given to the first screenshot where they are fully visible
+
+    :param sequence: ScrollSequence
+    :param options: PipelineOptions
+    :return: list of ProcessedFile, one for each screenshot of the sequence
+    """
+    file_names = sequence.file_names
+    logger.info("Processing sequence: %s", ", ".join(file_names))
+
+    image_base_names = [os.path.splitext(os.path.basename(file_name))[0] for file_name in file_names]
+    with timed("build_strip"):
+        strip, tops = sequence.build_strip()
+    strip_height, strip_width = strip.shape[:2]
+
+    # The strip is a screenshot which is all hits window
+    crop_rects = sequence.crop_rects
+    strip_rects = ResolutionDimensions(crop_rects.name, strip_width, strip_height,
+                                       CropRect(0, 0, strip_width, strip_height), crop_rects.hit_image,
+                                       source_name=crop_rects.source_name, binarization=crop_rects.binarization)
+
+    report_path = f"{options.report_dir}/{image_base_names[0]}_stitched_" if options.report_dir else ""
+
+    memo = get_ocr_memo()
+    memo_stats_before = OcrMemoStats(memo.stats.lookups, memo.stats.hits) if memo is not None else None
+
+    # Boxes of the strip are unique. The deduplicator only gives fingerprints to collapse
+    # the same boxes of other sequences (see collapse_duplicates)
+    result = recognize_screenshot(strip, strip_rects, name=file_names[0], report_path=report_path,
+                                  debug=options.debug, batch_ocr=options.batch_ocr,
+                                  deduplicator=HitDeduplicator() if options.dedup else None,
+                                  partial_hits=options.partial_hits, gallery=get_template_gallery(),
+                                  glyph_bank=get_glyph_bank(), min_confidence=options.reocr,
+                                  with_confidence=options.confidence)
+    logger.info("Recognized %d hits in %d screenshots", len(result.hit_records), len(file_names))
+
+    owners = assign_hit_boxes([hit_record.box for hit_record in result.hit_records], tops,
+                              sequence.windows[0].shape[0])
+    file_records = [[] for _ in file_names]
+    with timed("encode_thumbnails"):
+        for hit_record, owner in zip(result.hit_records, owners):
+            records = file_records[owner]
+            records.append(compact_hit_record(hit_record, len(records), options.thumbnails))
+
+    processed_files = [ProcessedFile(file_name, image_base_name, crop_rects.name, records, "")
+                       for file_name, image_base_name, records in zip(file_names, image_base_names, file_records)]
+    if memo is not None:
+        # OCR memo stats and entries of the whole sequence go with its first screenshot
+        processed_files[0] = processed_files[0]._replace(ocr_memo_stats=memo.stats - memo_stats_before,
+                                                         ocr_memo_entries=memo.take_new_entries())
+    # So are timings (reading of files and offsets estimation included)
+    processed_files[0] = with_stage_timings(processed_files[0])
+    return processed_files
+
+
+def process_stitched_files(files, dimensions_file, options=PipelineOptions(), deduplicator=None):
+    """
+    Processes files (in the order they were taken) by scroll sequences: consecutive screenshots which
+    overlap are recognized together (see stitching.py). Gives ProcessedFile results in the order of files
+
+    :param files: list of screenshot file names sorted by time (see screenshot_order_key)
+    :param dimensions_file: DimensionsFile
+    :param options: PipelineOptions
+    :param deduplicator: HitDeduplicator to collapse the same boxes of different sequences (if options.dedup is on)
+    """
+    sequence = None
+    for file_name in files:
+        with timed("imread"):
+            img = cv2.imread(file_name)
+        error = ""
+        if img is None:
+            logger.error("Can't open file: %s", file_name)
+            error = f"Can't open file: {file_name}"
+        else:
+            try:
+                if options.auto_layout:
+                    crop_rects = dimensions_file.get_auto_crop_rects(img)
+                else:
+                    crop_rects = dimensions_file.get_crop_rects(img)
+            except KeyError as ex:
+                logger.error("%s: %s", file_name, ex.args[0])
+                error = f"Unknown resolution {DimensionsFile.get_resolution_name(img)}"
+        if error:
+            # The sequence ends here: the next screenshot can't be stitched to one before this file
+            if sequence is not None:
+                yield from _process_sequence_collapsed(sequence, options, deduplicator)
+                sequence = None
+            image_base_name = os.path.splitext(os.path.basename(file_name))[0]
+            yield ProcessedFile(file_name, image_base_name, "", [], error)
+            continue
+
+        window = crop_rects.hits_window.crop(img)
+        gray = cv2.cvtColor(window, cv2.COLOR_BGR2GRAY)
+
+        if sequence is not None:
+            with timed("scroll_offset"):
+                appended = sequence.append(file_name, crop_rects, window, gray)
+            if not appended:
+                yield from _process_sequence_collapsed(sequence, options, deduplicator)
+                sequence = None
+        if sequence is None:
+            sequence = ScrollSequence(file_name, crop_rects, window, gray)
+
+    if sequence is not None:
+        yield from _process_sequence_collapsed(sequence, options, deduplicator)
+
+
+def _process_sequence_collapsed(sequence, options, deduplicator):
+    """process_sequence with the same boxes of previous sequences collapsed by deduplicator"""
+    for processed_file in process_sequence(sequence, options):
+        if deduplicator is not None:
+            processed_file = collapse_duplicates(processed_file, deduplicator)
+        yield processed_file
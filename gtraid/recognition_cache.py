@@ -0,0 +1,193 @@
+"""
+On-disk cache of recognized screenshots (SQLite)
+
+Re-running gt.py over a folder where only a few screenshots are new shouldn't OCR everything again.
+A screenshot is identified by a hash of its file bytes (so renamed or copied files are found too)
+and recognition settings. Along with the result the cache stores the resolution name and a hash of
+crop parameters of that resolution in dimensions.yaml. When crop parameters of a resolution are
+edited, only screenshots of this resolution are recognized again.
+
+The same file keeps OCR results of separate field images for OcrMemo (see ocr_memo.py),
+so near-identical hits from new screenshots are not recognized again in the next runs.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import time
+
+import numpy as np
+
+from .ocr_memo import OcrMemoEntry
+
+logger = logging.getLogger(__name__)
+
+# Cached data format. Increase it when ProcessedFile or CompactHitRecord change
+CACHE_FORMAT_VERSION = 6
+
+
+class RecognitionCacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.evicted = 0
+
+    def __repr__(self):
+        return (f"RecognitionCacheStats(hits={self.hits}, misses={self.misses}, "
+                f"invalidated={self.invalidated}, evicted={self.evicted})")
+
+
+class RecognitionCache:
+    """SQLite file with ProcessedFile results keyed by image hash + recognition settings"""
+
+    def __init__(self, file_name, dimensions_file, max_size_mb=500, rebuild=False):
+        """
+        Opens (creates) cache file
+
+        :param file_name: SQLite file name
+        :param dimensions_file: DimensionsFile. Results for resolutions with changed crop params are dropped
+        :param max_size_mb: cache size limit. Least recently used results are evicted after it
+        :param rebuild: drop everything in the cache
+        """
+        logger.info("RecognitionCache: opening '%s'", file_name)
+        self.file_name = file_name
+        self.dimensions_file = dimensions_file
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.max_ocr_memo_entries = 50000
+        self.stats = RecognitionCacheStats()
+
+        self._db = sqlite3.connect(file_name)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS screenshots (
+                                key TEXT PRIMARY KEY,
+                                resolution TEXT NOT NULL,
+                                dimensions_hash TEXT NOT NULL,
+                                format_version INTEGER NOT NULL,
+                                size INTEGER NOT NULL,
+                                last_used REAL NOT NULL,
+                                payload BLOB NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS screenshots_last_used ON screenshots(last_used)")
+
+        # OCR results of field images for OcrMemo
+        self._db.execute("""CREATE TABLE IF NOT EXISTS ocr_memo (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                settings TEXT NOT NULL,
+                                field TEXT NOT NULL,
+                                height INTEGER NOT NULL,
+                                width INTEGER NOT NULL,
+                                hash BLOB NOT NULL,
+                                mask BLOB NOT NULL,
+                                text TEXT NOT NULL,
+                                confidence REAL)""")
+        if "confidence" not in [column[1] for column in self._db.execute("PRAGMA table_info(ocr_memo)")]:
+            # Cache of an older version: entries without confidence
+            self._db.execute("ALTER TABLE ocr_memo ADD COLUMN confidence REAL")
+
+        if rebuild:
+            logger.info("RecognitionCache: rebuilding cache, all results are dropped")
+            self._db.execute("DELETE FROM screenshots")
+            self._db.execute("DELETE FROM ocr_memo")
+
+        self.invalidate_stale()
+        self._db.commit()
+
+    def invalidate_stale(self):
+        """Drops results of resolutions which crop parameters changed (and of old cache formats)"""
+        rows = self._db.execute("SELECT DISTINCT resolution, dimensions_hash FROM screenshots").fetchall()
+        for resolution, dimensions_hash in rows:
+            if dimensions_hash != self.dimensions_file.get_resolution_hash(resolution):
+                logger.info("RecognitionCache: crop parameters for '%s' changed, dropping its results", resolution)
+                cursor = self._db.execute("DELETE FROM screenshots WHERE resolution=? AND dimensions_hash=?",
+                                          (resolution, dimensions_hash))
+                self.stats.invalidated += cursor.rowcount
+        cursor = self._db.execute("DELETE FROM screenshots WHERE format_version!=?", (CACHE_FORMAT_VERSION,))
+        self.stats.invalidated += cursor.rowcount
+
+    @staticmethod
+    def make_key(file_name, settings=""):
+        """
+        Key of a screenshot: hash of file bytes and recognition settings
+
+        :param file_name: screenshot file name
+        :param settings: string with settings which change recognition results (like OCR backend)
+        :return: key or "" if the file can't be read
+        """
+        try:
+            with open(file_name, "rb") as image_file:
+                image_hash = hashlib.sha1(image_file.read()).hexdigest()
+        except OSError as ex:
+            logger.warning("RecognitionCache: can't read '%s': %s", file_name, ex)
+            return ""
+        return f"{image_hash}:{settings}"
+
+    def get(self, key, file_name):
+        """
+        Gets cached ProcessedFile
+
+        :param key: key from make_key
+        :param file_name: current file name (cached result may be from the same image with another name)
+        :return: ProcessedFile or None if not in cache
+        """
+        row = self._db.execute("SELECT payload FROM screenshots WHERE key=?", (key,)).fetchone() if key else None
+        if row is None:
+            self.stats.misses += 1
+            return None
+
+        self._db.execute("UPDATE screenshots SET last_used=? WHERE key=?", (time.time(), key))
+        self.stats.hits += 1
+        processed_file = pickle.loads(row[0])
+        return processed_file._replace(file_name=file_name,
+                                       image_base_name=os.path.splitext(os.path.basename(file_name))[0])
+
+    def put(self, key, processed_file):
+        """Stores ProcessedFile. Files which were not recognized (with error) are not stored"""
+        if not key or processed_file.error:
+            return
+        processed_file = processed_file._replace(ocr_memo_stats=None, ocr_memo_entries=(), stage_timings=None)
+        payload = pickle.dumps(processed_file, protocol=pickle.HIGHEST_PROTOCOL)
+        resolution = processed_file.resolution
+        self._db.execute("INSERT OR REPLACE INTO screenshots VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (key, resolution, self.dimensions_file.get_resolution_hash(resolution),
+                          CACHE_FORMAT_VERSION, len(payload), time.time(), payload))
+        self._evict()
+        self._db.commit()
+
+    def _evict(self):
+        """Removes least recently used results while the cache is bigger than max_size"""
+        total_size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM screenshots").fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        rows = self._db.execute("SELECT key, size FROM screenshots ORDER BY last_used").fetchall()
+        for key, size in rows:
+            if total_size <= self.max_size:
+                break
+            self._db.execute("DELETE FROM screenshots WHERE key=?", (key,))
+            total_size -= size
+            self.stats.evicted += 1
+
+    def get_ocr_memo_entries(self, settings=""):
+        """Loads OcrMemoEntry-s recognized with the same settings (OCR backend)"""
+        rows = self._db.execute("SELECT field, height, width, hash, mask, text, confidence FROM ocr_memo "
+                                "WHERE settings=?", (settings,)).fetchall()
+        return [OcrMemoEntry(field, height, width, np.frombuffer(hash_bytes, dtype=np.uint8),
+                             np.frombuffer(mask_bytes, dtype=np.uint8), text, confidence)
+                for field, height, width, hash_bytes, mask_bytes, text, confidence in rows]
+
+    def put_ocr_memo_entries(self, entries, settings=""):
+        """Stores OcrMemoEntry-s. Only max_ocr_memo_entries latest entries are kept"""
+        if not entries:
+            return
+        self._db.executemany("INSERT INTO ocr_memo (settings, field, height, width, hash, mask, text, confidence) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             [(settings, entry.field, entry.height, entry.width, entry.hash.tobytes(),
+                               entry.mask.tobytes(), entry.text, entry.confidence) for entry in entries])
+        self._db.execute("DELETE FROM ocr_memo WHERE id <= (SELECT MAX(id) FROM ocr_memo) - ?",
+                         (self.max_ocr_memo_entries,))
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
@@ -0,0 +1,91 @@
+"""
+Second recognition pass for fields with low confidence
+
+Most fields are clean and the first pass recognizes them surely. A field with confidence below
+min_confidence (gt.py --min-confidence) is recognized again from its grayscale image in a few
+more expensive ways (FIELD_VARIANTS):
+- upscaled more than the first pass does (INTER_CUBIC)
+- binarized by another threshold or by Otsu threshold (picked by the image histogram)
+- with another tesseract page segmentation mode: 7 - single text line, 8 - single word
+The text of the most confident variant is taken if it is more confident than the first pass text.
+
+Only OCR results are recognized again: damages read by glyph templates and bosses from the gallery
+are confident by their own scores.
+"""
+
+import logging
+from collections import namedtuple
+
+import cv2
+
+from .ocr_backend import get_ocr_backend
+from .stage_timer import timed
+
+logger = logging.getLogger(__name__)
+
+# Fields with lower confidence are recognized again (and highlighted in xlsx)
+MIN_CONFIDENCE = 0.8
+
+# How to prepare a grayscale field: scale, threshold (None - Otsu), tesseract page segmentation mode
+ReocrVariant = namedtuple('ReocrVariant', ['scale', 'threshold', 'psm'])
+
+# The first pass: names are scaled by 2 with threshold 130, damages and bosses are taken as is with threshold 160
+FIELD_VARIANTS = {
+    "name": [ReocrVariant(3, 130, 7), ReocrVariant(3, None, 7), ReocrVariant(4, None, 7)],
+    "damage": [ReocrVariant(2, 160, 7), ReocrVariant(2, None, 8), ReocrVariant(3, None, 7)],
+    "boss": [ReocrVariant(2, 160, 7), ReocrVariant(2, None, 7), ReocrVariant(3, None, 7)],
+}
+
+# White margin around the text, tesseract recognizes text touching the image border worse
+MARGIN = 10
+
+
+class ReocrStats:
+    """Counts fields recognized again and how many of them got a more confident text"""
+
+    def __init__(self):
+        self.fields = 0
+        self.improved = 0
+        self.variants = 0       # Extra OCR calls
+
+    def __repr__(self):
+        return f"ReocrStats(fields={self.fields}, improved={self.improved}, variants={self.variants})"
+
+
+# Statistics for the whole process
+stats = ReocrStats()
+
+
+def prepare_variant(gray, variant):
+    """Black on white image of a grayscale field (white text on dark) prepared by ReocrVariant"""
+    img = cv2.resize(gray, None, fx=variant.scale, fy=variant.scale, interpolation=cv2.INTER_CUBIC)
+    if variant.threshold is None:
+        img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+    else:
+        img = cv2.threshold(img, variant.threshold, 255, cv2.THRESH_BINARY_INV)[1]
+    return cv2.copyMakeBorder(img, MARGIN, MARGIN, MARGIN, MARGIN, cv2.BORDER_CONSTANT, value=255)
+
+
+def reocr_field(gray, field, ocr_text):
+    """
+    Recognizes a field with low confidence again
+    :param gray: grayscale field image (see image_reco.hit_field_gray)
+    :param field: 'name', 'damage' or 'boss'
+    :param ocr_text: OcrText of the first pass
+    :return: the most confident OcrText
+    """
+    best = ocr_text
+    if gray is None or not gray.size:
+        return best
+    with timed("reocr"):
+        backend = get_ocr_backend()
+        for variant in FIELD_VARIANTS[field]:
+            text = backend.image_to_text(prepare_variant(gray, variant), field, psm=variant.psm)
+            stats.variants += 1
+            logger.debug("reocr_field: %s %s: '%s' (%s)", field, variant, text.text.strip(), text.confidence)
+            if text.confidence is not None and text.text.strip() and text.confidence > (best.confidence or 0):
+                best = text
+    stats.fields += 1
+    if best is not ocr_text:
+        stats.improved += 1
+    return best
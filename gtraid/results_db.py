@@ -0,0 +1,389 @@
+"""
+Raid results database (SQLite): hits of all runs in one file, for season totals and player history
+
+    python gt.py -f xlsx,db screenshots/*                       # result.xlsx and hits added to result.db
+    python -m gtraid.results_db result.db                       # leaderboard of the last season
+    python -m gtraid.results_db result.db --player EoS          # hits of a player
+    python -m gtraid.results_db result.db --season 2021-06-02 --export season.xlsx
+
+Each hit is stored once. Its key is made of the season, name, damage and short boss name: overlapping
+screenshots (and the same screenshot ingested again) give the same hits with the same texts, so they
+are merged into one row (upsert) and only the list of screenshots where the hit was seen grows.
+Hits which texts are not recognized (no name or damage) are keyed by the screenshot and hit index
+(or by the box they duplicate, see hit_dedup.py), so they are never merged with other hits.
+
+Day and season are taken from the screenshot time (file name or EXIF, see screenshot_time.py).
+A season is SEASON_DAYS long and starts every SEASON_DAYS days from SEASON_FIRST_DAY, its name is
+the day it starts. If seasons of your server don't follow this, give the season name to ingest.
+
+Thumbnails are kept in a separate table, so the xlsx (see xlsx_output.py) can be made from the database
+at any time for a season, a day or a player, while queries read only the hits table and its indexes.
+"""
+
+import argparse
+import hashlib
+import itertools
+import logging
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+
+from .output import OutputSink, IMAGE_FIELDS, parse_damage_number, boss_short_name
+from .pipeline import CompactHitRecord, NO_THUMBNAIL, ProcessedFile, Thumbnail
+from .screenshot_time import parse_screenshot_time, read_exif_time
+
+logger = logging.getLogger(__name__)
+
+# Seasons: SEASON_DAYS long, one of them starts on SEASON_FIRST_DAY
+SEASON_FIRST_DAY = date(2021, 6, 2)
+SEASON_DAYS = 14
+
+# Row of a leaderboard
+LeaderboardRow = namedtuple('LeaderboardRow',
+                            ['name',            # Player name
+                             'hits',            # Number of hits
+                             'total_damage',    # Sum of damages
+                             'best_damage'])    # Max damage of a hit
+
+# Hit of a player
+PlayerHit = namedtuple('PlayerHit',
+                       ['day',                  # Day of the screenshot (YYYY-MM-DD) or None
+                        'boss_short',           # Short boss name
+                        'damage_value',         # Damage as a number (None if it can't be parsed)
+                        'file_name',            # The first screenshot where the hit was seen
+                        'hit_index',            # Index of the hit in the screenshot
+                        'seen_count'])          # Number of screenshots where the hit was seen
+
+# Season summary
+SeasonRow = namedtuple('SeasonRow', ['season', 'days', 'players', 'hits', 'total_damage'])
+
+
+def season_of(day, first_day=SEASON_FIRST_DAY, season_days=SEASON_DAYS):
+    """
+    Season of a day
+    :param day: date
+    :return: the first day of the season (date)
+    """
+    return first_day + timedelta(days=(day - first_day).days // season_days * season_days)
+
+
+def make_hit_key(season, hit_record, file_name, damage_value, boss_short):
+    """
+    Key of a hit: the same for the same hit in any screenshot of the season
+    :param season: season name ("" if unknown)
+    :param hit_record: CompactHitRecord
+    :param file_name: screenshot file name
+    :param damage_value: damage as a number or None
+    :param boss_short: short boss name
+    """
+    if hit_record.name and damage_value is not None:
+        text = f"{season}|{hit_record.name}|{damage_value}|{boss_short}"
+    elif hit_record.duplicate_of is not None:
+        text = f"box|{hit_record.duplicate_of.file_name}|{hit_record.duplicate_of.hit_index}"
+    else:
+        text = f"box|{file_name}|{hit_record.hit_index}"
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ResultsDatabase:
+    """SQLite file with hits of all ingested screenshots"""
+
+    def __init__(self, file_name, first_day=SEASON_FIRST_DAY, season_days=SEASON_DAYS):
+        """
+        Opens (creates) the database
+
+        :param file_name: SQLite file name
+        :param first_day: the first day of any season (see season_of)
+        :param season_days: season length in days
+        """
+        logger.info("ResultsDatabase: opening '%s'", file_name)
+        self.file_name = file_name
+        self.first_day = first_day
+        self.season_days = season_days
+
+        self._db = sqlite3.connect(file_name)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS screenshots (
+                                file_name TEXT PRIMARY KEY,
+                                image_base_name TEXT NOT NULL,
+                                resolution TEXT NOT NULL,
+                                screenshot_time TEXT,
+                                day TEXT,
+                                season TEXT,
+                                hits INTEGER NOT NULL,
+                                ingested REAL NOT NULL)""")
+
+        # A hit with the first screenshot where it was seen
+        self._db.execute("""CREATE TABLE IF NOT EXISTS hits (
+                                id INTEGER PRIMARY KEY,
+                                hit_key TEXT NOT NULL UNIQUE,
+                                name TEXT NOT NULL,
+                                damage TEXT NOT NULL,
+                                damage_value INTEGER,
+                                boss TEXT NOT NULL,
+                                boss_short TEXT NOT NULL,
+                                day TEXT,
+                                season TEXT,
+                                file_name TEXT NOT NULL,
+                                hit_index INTEGER NOT NULL,
+                                cut TEXT NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS hits_player ON hits(name, boss_short, day)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS hits_season ON hits(season, name, damage_value)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS hits_day ON hits(day)")
+
+        # All screenshots where each hit was seen
+        self._db.execute("""CREATE TABLE IF NOT EXISTS hit_sources (
+                                file_name TEXT NOT NULL,
+                                hit_index INTEGER NOT NULL,
+                                hit_id INTEGER NOT NULL,
+                                PRIMARY KEY (file_name, hit_index))""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS hit_sources_hit ON hit_sources(hit_id)")
+
+        # Thumbnails (JPEG) of hits, see pipeline.CompactHitRecord
+        self._db.execute("""CREATE TABLE IF NOT EXISTS hit_images (
+                                hit_id INTEGER NOT NULL,
+                                field TEXT NOT NULL,
+                                data BLOB NOT NULL,
+                                width INTEGER NOT NULL,
+                                height INTEGER NOT NULL,
+                                PRIMARY KEY (hit_id, field))""")
+        self._db.commit()
+
+    def day_and_season(self, file_name):
+        """
+        Day and season of a screenshot by its time
+        :return: (screenshot time, day, season): ISO strings or None if the screenshot has no time
+        """
+        screenshot_time = parse_screenshot_time(file_name) or read_exif_time(file_name)
+        if screenshot_time is None:
+            return None, None, None
+        day = screenshot_time.date()
+        season = season_of(day, self.first_day, self.season_days)
+        return screenshot_time.isoformat(), day.isoformat(), season.isoformat()
+
+    def ingest(self, processed_file, season=""):
+        """
+        Adds hits of a processed screenshot (pipeline.ProcessedFile). Hits which are already in the database
+        are not added again. Changes are not committed until commit()
+
+        :param season: season name. Default - by the screenshot time
+        :return: number of new hits
+        """
+        if processed_file.error:
+            return 0
+        screenshot_time, day, time_season = self.day_and_season(processed_file.file_name)
+        season = season or time_season
+        self._db.execute("INSERT OR REPLACE INTO screenshots VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (processed_file.file_name, processed_file.image_base_name, processed_file.resolution,
+                          screenshot_time, day, season, len(processed_file.hit_records), time.time()))
+
+        new_hits = 0
+        for hit_record in processed_file.hit_records:
+            try:
+                damage_value = parse_damage_number(hit_record.damage) if hit_record.damage else None
+            except ValueError:
+                damage_value = None
+            boss_short = boss_short_name(hit_record.boss) if hit_record.boss else hit_record.boss
+            hit_key = make_hit_key(season or "", hit_record, processed_file.file_name, damage_value, boss_short)
+
+            # A new hit is inserted. A hit seen before cut by the hits window takes the full box
+            row = self._db.execute("SELECT id FROM hits WHERE hit_key=?", (hit_key,)).fetchone()
+            cursor = self._db.execute(
+                "INSERT INTO hits (hit_key, name, damage, damage_value, boss, boss_short, day, season, "
+                "                  file_name, hit_index, cut) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(hit_key) DO UPDATE SET file_name=excluded.file_name, hit_index=excluded.hit_index, "
+                "                                   cut=excluded.cut "
+                "WHERE hits.cut != '' AND excluded.cut = ''",
+                (hit_key, hit_record.name, hit_record.damage, damage_value, hit_record.boss, boss_short, day, season,
+                 processed_file.file_name, hit_record.hit_index, hit_record.cut))
+            hit_id = row[0] if row else cursor.lastrowid
+            new_hits += row is None
+            self._db.execute("INSERT OR IGNORE INTO hit_sources VALUES (?, ?, ?)",
+                             (processed_file.file_name, hit_record.hit_index, hit_id))
+
+            if cursor.rowcount > 0:
+                self._db.executemany("INSERT OR REPLACE INTO hit_images VALUES (?, ?, ?, ?, ?)",
+                                     [(hit_id, field, thumbnail.data, thumbnail.width, thumbnail.height)
+                                      for field, thumbnail in ((field, getattr(hit_record, field))
+                                                               for field in IMAGE_FIELDS) if thumbnail.data])
+        return new_hits
+
+    def commit(self):
+        self._db.commit()
+
+    def _where(self, season=None, day=None, boss=None, name=None):
+        """WHERE clause and its parameters for the filters which are given"""
+        conditions = []
+        parameters = []
+        for column, value in (('season', season), ('day', day), ('boss_short', boss), ('name', name)):
+            if value is not None:
+                conditions.append(f"hits.{column}=?")
+                parameters.append(value)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+    def last_season(self):
+        """Name of the latest season or None if there are no hits with time"""
+        return self._db.execute("SELECT MAX(season) FROM hits").fetchone()[0]
+
+    def leaderboard(self, season=None, day=None, boss=None, limit=0):
+        """
+        Players by total damage
+        :param season, day, boss: filters (None - all)
+        :param limit: number of players (0 - all)
+        :return: list of LeaderboardRow
+        """
+        where, parameters = self._where(season, day, boss)
+        where += (" AND " if where else " WHERE ") + "damage_value IS NOT NULL AND name != ''"
+        sql = (f"SELECT name, COUNT(*), SUM(damage_value), MAX(damage_value) FROM hits{where} "
+               f"GROUP BY name ORDER BY SUM(damage_value) DESC")
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [LeaderboardRow(*row) for row in self._db.execute(sql, parameters)]
+
+    def player_hits(self, name, season=None, boss=None):
+        """
+        Hits of a player by day
+        :return: list of PlayerHit
+        """
+        where, parameters = self._where(season, None, boss, name)
+        sql = (f"SELECT day, boss_short, damage_value, file_name, hit_index, "
+               f"       (SELECT COUNT(*) FROM hit_sources WHERE hit_id=hits.id) "
+               f"FROM hits{where} ORDER BY day, file_name, hit_index")
+        return [PlayerHit(*row) for row in self._db.execute(sql, parameters)]
+
+    def seasons(self):
+        """Summary of each season: list of SeasonRow"""
+        rows = self._db.execute("SELECT season, COUNT(DISTINCT day), COUNT(DISTINCT name), COUNT(*), "
+                                "       COALESCE(SUM(damage_value), 0) "
+                                "FROM hits GROUP BY season ORDER BY season")
+        return [SeasonRow(*row) for row in rows]
+
+    def processed_files(self, season=None, day=None, boss=None, name=None):
+        """
+        Stored hits as ProcessedFile-s (one for each screenshot, hits are in the order of the screenshot),
+        so they can be written by any OutputSink. A hit goes with the first screenshot where it was seen
+        """
+        where, parameters = self._where(season, day, boss, name)
+        rows = self._db.execute(f"SELECT hits.id, hits.file_name, hit_index, name, damage, boss, cut, "
+                                f"       screenshots.image_base_name, screenshots.resolution "
+                                f"FROM hits LEFT JOIN screenshots USING (file_name){where} "
+                                f"ORDER BY hits.day, hits.file_name, hit_index", parameters)
+        for file_name, file_rows in itertools.groupby(rows, key=lambda row: row[1]):
+            file_rows = list(file_rows)
+            images = {}
+            hit_ids = [row[0] for row in file_rows]
+            for hit_id, field, data, width, height in self._db.execute(
+                    f"SELECT hit_id, field, data, width, height FROM hit_images "
+                    f"WHERE hit_id IN ({','.join('?' * len(hit_ids))})", hit_ids):
+                images[hit_id, field] = Thumbnail(data, width, height)
+            hit_records = [CompactHitRecord(hit_index, name, damage, boss,
+                                            *(images.get((hit_id, field), NO_THUMBNAIL) for field in IMAGE_FIELDS),
+                                            cut=cut)
+                           for hit_id, _, hit_index, name, damage, boss, cut, _, _ in file_rows]
+            image_base_name = file_rows[0][7] or os.path.splitext(os.path.basename(file_name))[0]
+            yield ProcessedFile(file_name, image_base_name, file_rows[0][8] or "", hit_records, "")
+
+    def export(self, outputs, season=None, day=None, boss=None, name=None):
+        """
+        Writes stored hits to outputs (see output.create_output) and closes them
+        :return: number of written hits
+        """
+        count = 0
+        for processed_file in self.processed_files(season, day, boss, name):
+            count += len(processed_file.hit_records)
+            for output in outputs:
+                output.write(processed_file)
+        for output in outputs:
+            output.close()
+        return count
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+
+class DatabaseOutput(OutputSink):
+    """
+    Output which adds hits to ResultsDatabase. Results of previous runs are always kept
+    (ingesting the same screenshots again changes nothing)
+    """
+
+    name = "db"
+    extension = ".db"
+    needs_thumbnails = True         # Kept for xlsx made from the database
+
+    def __init__(self, file_name, season=""):
+        """
+        :param file_name: database file name
+        :param season: season name of all hits. Default - by the screenshot time
+        """
+        super().__init__(file_name)
+        self.season = season
+        self.database = ResultsDatabase(file_name)
+        self.new_hits = 0
+
+    def write(self, processed_file):
+        self.new_hits += self.database.ingest(processed_file, self.season)
+
+    def flush(self):
+        self.database.commit()
+
+    def close(self):
+        logger.info("DatabaseOutput: %d new hits added to '%s'", self.new_hits, self.file_name)
+        self.database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queries of the raid results database")
+    parser.add_argument("database", help="Database file (made by gt.py -f db)")
+    parser.add_argument("--season", default=None, help="Season (its first day, YYYY-MM-DD). Default - the last one")
+    parser.add_argument("--all-seasons", action="store_true", help="Don't filter by season")
+    parser.add_argument("--day", default=None, help="Day (YYYY-MM-DD)")
+    parser.add_argument("--boss", default=None, help="Short boss name")
+    parser.add_argument("--player", default=None, help="Show hits of the player instead of the leaderboard")
+    parser.add_argument("--seasons", action="store_true", help="Show all seasons")
+    parser.add_argument("--limit", type=int, default=0, help="Number of players in the leaderboard (0 - all)")
+    parser.add_argument("--export", default="",
+                        help="Write the hits (with the filters) to this xlsx file (or csv, jsonl by extension)")
+    parser.add_argument("--streaming", action="store_true", help="Write Excel with constant memory")
+    parser.add_argument("--max-rows", type=int, default=0,
+                        help="Start a new Excel file after this number of rows (0 - no limit)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    if not os.path.isfile(args.database):
+        parser.error(f"Database '{args.database}' doesn't exist")
+    database = ResultsDatabase(args.database)
+    query_season = None if args.all_seasons or args.day else args.season or database.last_season()
+
+    start = time.perf_counter()
+    if args.export:
+        from .output import create_output
+        export_format = os.path.splitext(args.export)[1].lstrip(".") or "xlsx"
+        try:
+            export_output = create_output(export_format, args.export, streaming=args.streaming,
+                                          max_rows=args.max_rows)
+        except (ValueError, ImportError) as ex:
+            parser.error(str(ex))
+        exported = database.export([export_output], query_season, args.day, args.boss, args.player)
+        print(f"{exported} hits are written to " + ", ".join(export_output.file_names))
+    elif args.seasons:
+        print(f"{'season':<12}{'days':>6}{'players':>9}{'hits':>8}{'total damage':>18}")
+        for row in database.seasons():
+            print(f"{row.season or 'no date':<12}{row.days:>6}{row.players:>9}{row.hits:>8}{row.total_damage:>18,}")
+    elif args.player:
+        print(f"Hits of '{args.player}'" + (f" in season {query_season}" if query_season else ""))
+        for hit in database.player_hits(args.player, query_season, args.boss):
+            damage = f"{hit.damage_value:,}" if hit.damage_value is not None else "?"
+            print(f"{hit.day or 'no date':<12}{hit.boss_short:<16}{damage:>14}   "
+                  f"{os.path.basename(hit.file_name)}#{hit.hit_index}" +
+                  (f" (seen in {hit.seen_count} screenshots)" if hit.seen_count > 1 else ""))
+    else:
+        print("Leaderboard" + (f" of season {query_season}" if query_season else "") +
+              (f", day {args.day}" if args.day else "") + (f", boss {args.boss}" if args.boss else ""))
+        for place, row in enumerate(database.leaderboard(query_season, args.day, args.boss, args.limit), 1):
+            print(f"{place:>4}. {row.name:<20}{row.hits:>5} hits{row.total_damage:>16,}   best {row.best_damage:,}")
+    print(f"({(time.perf_counter() - start) * 1000:.1f} ms)")
+    database.close()
@@ -0,0 +1,242 @@
+"""
+Roster of guild members: recognized names are snapped to the closest known name
+
+Misreads of the same member ("Bamboozle", "Bamboozie", "8amboozle") are different names, so they make
+separate players in totals and the duplicate check of Excel misses them. With a roster (gt.py --roster)
+each recognized name is looked up by Levenshtein distance (number of inserted, deleted or replaced
+characters) among roster names:
+- a roster name is "known" and stays as it is
+- the closest roster name within max_distance edits replaces it ("snapped"), the OCR text is kept in ocr_name
+- a name without a roster name that close, or with two equally close ones, stays as it is and is "unknown"
+Names are snapped after recognition, so the recognition cache stays valid when the roster changes.
+
+Roster file (YAML): guild -> list of member names. A plain list of names is one guild:
+    Guild A:
+        - Bamboozle
+        - EoS
+    Guild B:
+        - Vi
+
+Lookup is sub-millisecond for rosters of thousands of names. Each edit changes at most 2 bigrams
+(pairs of adjacent characters, with start and end marks), so a name within k edits of a roster
+name of length n shares at least n + 1 - 2k bigrams with it (NameIndex). Common bigrams are counted
+by an inverted index and only roster names with enough of them are compared by Levenshtein distance,
+which stops as soon as it is more than k. Names repeat from screenshot to screenshot, so matches are
+memoized.
+"""
+
+import argparse
+import logging
+from collections import namedtuple
+
+import yaml
+
+from .stage_timer import timed
+
+logger = logging.getLogger(__name__)
+
+# Max edits to snap a name: this part of its length (names of 2 characters must be exact, 3-5 - one edit...)
+MAX_DISTANCE_RATIO = 0.34
+
+# Name statuses
+KNOWN = "known"
+SNAPPED = "snapped"
+UNKNOWN = "unknown"
+
+# Roster name of a recognized name (None - unknown), its distance and guild
+RosterMatch = namedtuple('RosterMatch', ['name', 'distance', 'guild'])
+
+
+class RosterError(ValueError):
+    """Roster file has an error. The message names the file and the guild"""
+
+
+def levenshtein(a, b, limit):
+    """Levenshtein distance of a and b, or limit + 1 if it is more than limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+def name_grams(name):
+    """
+    Bigrams of a name with start and end marks (len(name) + 1 of them). A repeated bigram is numbered,
+    so the number of common bigrams of two names is the size of the multiset intersection
+    """
+    padded = f"\x02{name}\x03"
+    repeats = {}
+    grams = []
+    for position in range(len(padded) - 1):
+        gram = padded[position:position + 2]
+        repeats[gram] = repeats.get(gram, 0) + 1
+        grams.append((gram, repeats[gram]))
+    return grams
+
+
+class NameIndex:
+    """Names indexed by their bigrams for lookup by Levenshtein distance"""
+
+    def __init__(self):
+        self.names = []
+        self._postings = {}         # (bigram, repeat) -> ids of names which have it
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        name_id = len(self.names)
+        self.names.append(name)
+        for gram in name_grams(name):
+            self._postings.setdefault(gram, []).append(name_id)
+
+    def search(self, name, max_distance):
+        """
+        Names within max_distance of name
+        :return: list of (distance, name)
+        """
+        if len(name) + 1 - 2 * max_distance <= 0:
+            candidates = self.names         # Too short to have common bigrams with its matches
+        else:
+            common = {}
+            for gram in name_grams(name):
+                for name_id in self._postings.get(gram, ()):
+                    common[name_id] = common.get(name_id, 0) + 1
+            candidates = [self.names[name_id] for name_id, count in common.items()
+                          if count >= max(len(name), len(self.names[name_id])) + 1 - 2 * max_distance]
+        found = []
+        for candidate in candidates:
+            distance = levenshtein(name, candidate, max_distance)
+            if distance <= max_distance:
+                found.append((distance, candidate))
+        return found
+
+
+class RosterStats:
+    """Names looked up in the roster"""
+
+    def __init__(self):
+        self.known = 0          # Names of the roster
+        self.snapped = 0        # Names replaced by the closest roster name
+        self.unknown = 0        # Names too far from roster names (flagged)
+
+    def __repr__(self):
+        return f"RosterStats(known={self.known}, snapped={self.snapped}, unknown={self.unknown})"
+
+
+class Roster:
+    """Names of guild members for fuzzy lookup of recognized names"""
+
+    def __init__(self, max_distance_ratio=MAX_DISTANCE_RATIO):
+        self.max_distance_ratio = max_distance_ratio
+        self.guilds = {}            # name -> guild
+        self.stats = RosterStats()
+        self._index = NameIndex()
+        self._matches = {}          # Memo: recognized name -> RosterMatch
+
+    @classmethod
+    def load(cls, file_name, max_distance_ratio=MAX_DISTANCE_RATIO):
+        """Loads roster file. Raises RosterError"""
+        try:
+            with open(file_name, encoding="utf-8") as roster_file:
+                content = yaml.safe_load(roster_file)
+        except (OSError, yaml.YAMLError) as ex:
+            raise RosterError(f"Can't read roster '{file_name}': {ex}")
+        if isinstance(content, list):
+            content = {"": content}
+        if not isinstance(content, dict) or not content:
+            raise RosterError(f"Roster '{file_name}' must be guilds with lists of names or a list of names")
+
+        roster = cls(max_distance_ratio)
+        for guild, names in content.items():
+            if not isinstance(names, list):
+                raise RosterError(f"Roster '{file_name}': guild '{guild}' must be a list of names")
+            for name in names:
+                roster.add(str(name), str(guild))
+        logger.info("Roster: %d names of %d guilds from '%s'", len(roster), len(content), file_name)
+        return roster
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, name, guild=""):
+        """Adds a member. A name which is already in the roster keeps its first guild"""
+        name = name.strip()
+        if name and name not in self.guilds:
+            self._index.add(name)
+            self.guilds[name] = guild
+            self._matches.clear()
+
+    def max_distance(self, name):
+        """Max edits to snap name to a roster name"""
+        return int(len(name) * self.max_distance_ratio)
+
+    def match(self, name):
+        """
+        Roster name of a recognized name
+        :return: RosterMatch. name is None if no roster name is within max_distance or two are equally close
+        """
+        match = self._matches.get(name)
+        if match is not None:
+            return match
+        if name in self.guilds:
+            match = RosterMatch(name, 0, self.guilds[name])
+        else:
+            found = sorted(self._index.search(name, self.max_distance(name)))
+            if found and (len(found) == 1 or found[0][0] < found[1][0]):
+                distance, roster_name = found[0]
+                match = RosterMatch(roster_name, distance, self.guilds[roster_name])
+            elif found:
+                match = RosterMatch(None, None, None)
+                logger.info("Roster: '%s' is as close to '%s' as to '%s', it is unknown", name, found[0][1],
+                            found[1][1])
+            else:
+                match = RosterMatch(None, None, None)
+                logger.info("Roster: '%s' is unknown", name)
+        self._matches[name] = match
+        return match
+
+    def canonicalize(self, processed_files):
+        """
+        Generator of ProcessedFile-s (see pipeline.py) with names of hit records snapped to the roster.
+        A snapped record keeps the recognized name in ocr_name, name_status is KNOWN, SNAPPED or UNKNOWN
+        """
+        for processed_file in processed_files:
+            with timed("roster"):
+                hit_records = [self._canonical_record(hit_record) for hit_record in processed_file.hit_records]
+            yield processed_file._replace(hit_records=hit_records)
+
+    def _canonical_record(self, hit_record):
+        """CompactHitRecord with the name snapped to the roster"""
+        if not hit_record.name:
+            return hit_record
+        match = self.match(hit_record.name)
+        if match.name is None:
+            self.stats.unknown += 1
+            return hit_record._replace(name_status=UNKNOWN)
+        if match.distance:
+            self.stats.snapped += 1
+            return hit_record._replace(name=match.name, ocr_name=hit_record.name, name_status=SNAPPED)
+        self.stats.known += 1
+        return hit_record._replace(name_status=KNOWN)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Looks up names in a roster")
+    parser.add_argument("roster", help="Roster file (YAML: guild -> list of names)")
+    parser.add_argument("names", nargs="+", help="Names to look up")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    loaded = Roster.load(args.roster)
+    for recognized_name in args.names:
+        print(f"{recognized_name}: {loaded.match(recognized_name)}")
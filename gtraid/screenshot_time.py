@@ -0,0 +1,69 @@
+"""
+Screenshot time from the file name
+
+Phones name screenshots with the time they were taken, like:
+    Screenshot_20210606-135955_Guardian_Tales.jpg
+    Screenshot_2021-05-31-10-40-58.png
+    Guardian Tales_2021-05-31-22-12-10.jpg
+
+If the name has no time, it may be in EXIF data of the file (needs pillow: pip install pillow)
+"""
+
+import re
+from datetime import datetime
+
+# year month day hour minute second with optional separators between them
+_time_regex = re.compile(r"(20\d{2})[-_.]?(\d{2})[-_.]?(\d{2})[-_. ]?(\d{2})[-_.]?(\d{2})[-_.]?(\d{2})")
+
+
+def parse_screenshot_time(file_name):
+    """
+    Gets the time when the screenshot was taken from its file name
+    :param file_name: file name (path is allowed)
+    :return: datetime or None if the name has no time
+    """
+    match = _time_regex.search(file_name.replace("\\", "/").split("/")[-1])
+    if not match:
+        return None
+    try:
+        return datetime(*(int(group) for group in match.groups()))
+    except ValueError:
+        return None
+
+
+# EXIF tags: DateTimeOriginal (in Exif IFD) and DateTime (in the main IFD)
+_EXIF_IFD = 0x8769
+_EXIF_DATE_TIME_ORIGINAL = 36867
+_EXIF_DATE_TIME = 306
+
+
+def read_exif_time(file_name):
+    """
+    Gets the time when the screenshot was taken from its EXIF data
+    :param file_name: image file name
+    :return: datetime or None if there is no EXIF time (or pillow is not installed)
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(file_name) as img:
+            exif = img.getexif()
+            value = exif.get_ifd(_EXIF_IFD).get(_EXIF_DATE_TIME_ORIGINAL) or exif.get(_EXIF_DATE_TIME)
+    except (OSError, ValueError):
+        return None
+    if not value:
+        return None
+    try:
+        return datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def screenshot_order_key(file_name):
+    """
+    Sort key to put screenshots in the order they were taken: time from the file name or from EXIF.
+    Screenshots without time go first, files with the same time are ordered by name
+    """
+    return parse_screenshot_time(file_name) or read_exif_time(file_name) or datetime.min, file_name
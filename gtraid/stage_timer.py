@@ -0,0 +1,181 @@
+"""
+Per-stage timing of screenshot processing
+
+Processing code marks its stages with `with timed("stage"):`. If there is no stage timer in this
+process (the default), timed() is a no-op. With a StageTimer each stage adds its duration to the
+totals of its name, and if trace is on, an event with the start time (to see stages on a timeline).
+
+Stages are named by what they do: imread, crop_hits_window, threshold, find_contours, crop_hit_image,
+prepare_fields, ocr_name / ocr_damage / ocr_boss (one field), batch_ocr, encode_thumbnails,
+write_xlsx (and other outputs) and so on. Stages may be nested: process_file includes all stages of a file.
+
+Each worker process has its own timer. Timings of a file go to the main process with ProcessedFile
+(like OCR memo stats) and are merged into the timer of the run, which writes:
+- JSON summary (write_json): count, total, mean and max time of each stage
+- Chrome trace (write_chrome_trace): open it in chrome://tracing, https://ui.perfetto.dev
+  or https://www.speedscope.app
+"""
+
+import json
+import os
+import time
+from collections import namedtuple
+
+# Stage event for the trace: start is wall clock time (comparable between processes), duration is in seconds
+StageEvent = namedtuple('StageEvent', ['name', 'start', 'duration', 'pid'])
+
+
+class StageStats:
+    """Totals of one stage"""
+
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self, count=0, total=0.0, max_time=0.0):
+        self.count = count
+        self.total = total          # Seconds
+        self.max = max_time         # Seconds
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def __repr__(self):
+        return f"StageStats(count={self.count}, total={self.total:.3f}s, max={self.max:.3f}s)"
+
+
+class StageTimer:
+    """Collects durations of processing stages (and trace events if trace is on)"""
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.stages = {}        # stage name -> StageStats
+        self.events = []        # StageEvent-s if trace is on
+
+    def add(self, name, start, duration):
+        """Adds a finished stage. start - wall clock time (time.time()), duration - seconds"""
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        stats.add(duration)
+        if self.trace:
+            self.events.append(StageEvent(name, start, duration, os.getpid()))
+
+    def take(self):
+        """Gives collected timings as a new StageTimer and starts over (to send timings of a file)"""
+        taken = StageTimer(self.trace)
+        taken.stages, taken.events = self.stages, self.events
+        self.stages, self.events = {}, []
+        return taken
+
+    def merge(self, other):
+        """Adds timings of other StageTimer (e.g. of a file processed in a worker process)"""
+        for name, stats in other.stages.items():
+            self.stages.setdefault(name, StageStats()).merge(stats)
+        if self.trace:
+            self.events.extend(other.events)
+
+    def summary(self):
+        """Stages sorted by total time: list of (name, StageStats)"""
+        return sorted(self.stages.items(), key=lambda item: item[1].total, reverse=True)
+
+    def format_summary(self):
+        """Text table of stages for the console"""
+        lines = [f"{'stage':<20}{'count':>8}{'total, s':>11}{'mean, ms':>11}{'max, ms':>10}"]
+        for name, stats in self.summary():
+            lines.append(f"{name:<20}{stats.count:>8}{stats.total:>11.3f}{stats.mean * 1000:>11.2f}"
+                         f"{stats.max * 1000:>10.2f}")
+        return "\n".join(lines)
+
+    def summary_dict(self):
+        """Stages for JSON: stage name -> count, total seconds, mean and max milliseconds"""
+        return {name: {"count": stats.count, "total_s": round(stats.total, 6),
+                       "mean_ms": round(stats.mean * 1000, 3), "max_ms": round(stats.max * 1000, 3)}
+                for name, stats in self.summary()}
+
+    def write_json(self, file_name, **run_info):
+        """
+        Writes JSON summary of stages
+        :param file_name: JSON file name
+        :param run_info: other values to save with stages (like number of files and wall time)
+        """
+        data = dict(run_info)
+        data["stages"] = self.summary_dict()
+        with open(file_name, "w", encoding="utf-8") as json_file:
+            json.dump(data, json_file, indent=2)
+
+    def write_chrome_trace(self, file_name):
+        """Writes trace events in Chrome trace event format (complete events, microseconds)"""
+        first_start = min((event.start for event in self.events), default=0)
+        trace_events = [{"name": event.name, "cat": "gtraid", "ph": "X",
+                         "ts": round((event.start - first_start) * 1e6), "dur": round(event.duration * 1e6),
+                         "pid": event.pid, "tid": event.pid}
+                        for event in self.events]
+        with open(file_name, "w", encoding="utf-8") as json_file:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, json_file)
+
+
+class _TimedStage:
+    """Context manager which adds the time of the block to the timer"""
+
+    __slots__ = ('timer', 'name', 'start', 'wall_start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.add(self.name, self.wall_start, time.perf_counter() - self.start)
+        return False
+
+
+class _NoStage:
+    """Context manager which does nothing (there is no timer)"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_no_stage = _NoStage()
+
+# StageTimer of this process (None - timing is off)
+_stage_timer = None
+
+
+def set_stage_timer(timer):
+    global _stage_timer
+    _stage_timer = timer
+
+
+def get_stage_timer():
+    return _stage_timer
+
+
+def timed(name):
+    """
+    Context manager to time a stage:
+        with timed("find_contours"):
+            ...
+    """
+    if _stage_timer is None:
+        return _no_stage
+    return _TimedStage(_stage_timer, name)
@@ -0,0 +1,163 @@
+"""
+Scroll sequence stitching: screenshots taken while scrolling the battle log are glued into one
+long hits list, so each hit box is found and recognized exactly once
+
+1. Screenshots are taken in the order they were made (time from file names or EXIF, see screenshot_time.py)
+2. estimate_scroll_offset finds the vertical offset between hits windows of consecutive screenshots:
+   row profiles (mean brightness of each row) give offset candidates, candidates are checked
+   on the images themselves: almost every row of the overlap must be the same. Hit boxes look alike,
+   so a wrong offset by a few boxes still matches frames and labels, but not names and numbers.
+   If the windows don't overlap, a new sequence starts
+3. ScrollSequence.build_strip pastes hits windows at their offsets into one tall image (strip),
+   which is recognized as one hits window
+4. assign_hit_boxes gives each box of the strip to the first screenshot where it is fully visible
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Windows must overlap by at least this part of the window height to be stitched
+MIN_OVERLAP = 0.1
+
+# Rows of the overlap (95th percentile) may differ by this mean absolute difference of gray pixels
+# (JPEG noise). Overlaps of wrong offsets have rows with names and numbers which differ by 15-40
+MAX_DIFFERENCE = 6.0
+
+# Rows at the edges of the window (this part of its height) are not compared: the list is clipped there
+EDGE_ROWS = 1 / 64
+
+# Number of best row profile offsets which are checked on images.
+# Hit boxes look alike, so offsets which differ by a box height have close profiles
+PROFILE_CANDIDATES = 8
+
+# Columns of the hits window used for matching (without the frame and the scroll bar on the right)
+MATCH_COLUMNS = (0.02, 0.9)
+
+# A sequence longer than this is split (the strip is kept in memory)
+MAX_SEQUENCE_LENGTH = 30
+
+
+def _overlap(previous, current, offset):
+    """Overlapping parts of previous and current windows (arrays) if current is scrolled by offset rows"""
+    if offset >= 0:
+        return previous[offset:], current[:len(current) - offset]
+    return previous[:len(previous) + offset], current[-offset:]
+
+
+def estimate_scroll_offset(previous_gray, current_gray):
+    """
+    Estimates how far the list was scrolled between two screenshots
+
+    :param previous_gray: grayscale hits window of the previous screenshot
+    :param current_gray: grayscale hits window of the current screenshot (the same size)
+    :return: offset in rows: row y of current is row y + offset of previous (negative if the list
+             was scrolled up). None if windows don't overlap
+    """
+    if previous_gray.shape != current_gray.shape:
+        return None
+    height, width = previous_gray.shape[:2]
+    x_start, x_end = int(width * MATCH_COLUMNS[0]), int(width * MATCH_COLUMNS[1])
+    previous_crop = previous_gray[:, x_start:x_end].astype(np.float32)
+    current_crop = current_gray[:, x_start:x_end].astype(np.float32)
+    previous_profile = previous_crop.mean(axis=1)
+    current_profile = current_crop.mean(axis=1)
+
+    max_offset = height - max(int(height * MIN_OVERLAP), 1)
+    offsets = np.arange(-max_offset, max_offset + 1)
+    profile_differences = np.empty(len(offsets), dtype=np.float32)
+    for index, offset in enumerate(offsets):
+        previous_part, current_part = _overlap(previous_profile, current_profile, offset)
+        profile_differences[index] = np.abs(previous_part - current_part).mean()
+
+    # Check the best candidates on images (every second row and column is enough).
+    # If several candidates match (a small overlap may be just a gap and a label), the largest overlap wins
+    edge = max(int(height * EDGE_ROWS), 1)
+    best_offset = None
+    for index in np.argsort(profile_differences)[:PROFILE_CANDIDATES]:
+        offset = int(offsets[index])
+        previous_part, current_part = _overlap(previous_crop[edge:height - edge], current_crop[edge:height - edge],
+                                               offset)
+        row_differences = np.abs(previous_part[::2, ::2] - current_part[::2, ::2]).mean(axis=1)
+        difference = float(np.percentile(row_differences, 95))
+        logger.debug("estimate_scroll_offset: offset=%d, difference=%.2f", offset, difference)
+        if difference <= MAX_DIFFERENCE and (best_offset is None or abs(offset) < abs(best_offset)):
+            best_offset = offset
+    return best_offset
+
+
+class ScrollSequence:
+    """Screenshots of the same resolution where each hits window overlaps with the previous one"""
+
+    def __init__(self, file_name, crop_rects, window, gray):
+        """
+        :param file_name: the first screenshot
+        :param crop_rects: ResolutionDimensions of the screenshots
+        :param window: hits window (color) of the first screenshot
+        :param gray: grayscale hits window
+        """
+        self.crop_rects = crop_rects
+        self.file_names = [file_name]
+        self.windows = [window]
+        self.tops = [0]             # Top row of each window in the list (the first window is at 0)
+        self._last_gray = gray
+
+    def append(self, file_name, crop_rects, window, gray):
+        """
+        Adds the next screenshot if its hits window overlaps with the last one
+        :return: True if added, False if the screenshot starts another sequence
+        """
+        if len(self.file_names) >= MAX_SEQUENCE_LENGTH or crop_rects.name != self.crop_rects.name or \
+                window.shape != self.windows[-1].shape:
+            return False
+        offset = estimate_scroll_offset(self._last_gray, gray)
+        if offset is None:
+            return False
+        logger.info("ScrollSequence: '%s' is scrolled by %d px from the previous screenshot", file_name, offset)
+        self.file_names.append(file_name)
+        self.windows.append(window)
+        self.tops.append(self.tops[-1] + offset)
+        self._last_gray = gray
+        return True
+
+    def build_strip(self):
+        """
+        Pastes hits windows into one tall image
+        :return: (strip image, list of top rows of each window in the strip)
+        """
+        window_height = self.windows[0].shape[0]
+        first_top = min(self.tops)
+        tops = [top - first_top for top in self.tops]
+        strip_height = max(tops) + window_height
+        strip = np.empty((strip_height,) + self.windows[0].shape[1:], dtype=self.windows[0].dtype)
+        for window, top in zip(self.windows, tops):
+            strip[top:top + window_height] = window
+
+        # Edge rows of windows (the list is clipped there) are covered by inner rows of overlapping windows
+        edge = max(int(window_height * EDGE_ROWS), 1)
+        for window, top in zip(self.windows, tops):
+            strip[top + edge:top + window_height - edge] = window[edge:window_height - edge]
+        return strip, tops
+
+
+def assign_hit_boxes(hit_boxes, tops, window_height):
+    """
+    Gives each hit box of the strip to the first window where it is fully visible
+    (or the window which has its middle if the box is higher than the window)
+
+    :param hit_boxes: list of HitBox in the strip
+    :param tops: top rows of windows in the strip
+    :param window_height: height of a window
+    :return: list of window indexes for boxes
+    """
+    owners = []
+    for box in hit_boxes:
+        owner = next((index for index, top in enumerate(tops)
+                      if top <= box.y and box.y + box.height <= top + window_height), None)
+        if owner is None:
+            middle = box.y + box.height // 2
+            owner = next((index for index, top in enumerate(tops) if top <= middle < top + window_height), 0)
+        owners.append(owner)
+    return owners
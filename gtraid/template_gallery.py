@@ -0,0 +1,317 @@
+"""
+Boss and hero recognition by reference images (template matching) instead of OCR
+
+Boss portraits and hero portraits look the same in all screenshots of a season, only scaled by
+the resolution and darkened with a cross when the boss is dead. So they are recognized by comparing
+with reference images of a gallery instead of reading the boss name with tesseract:
+
+1. The gallery config (gallery.yaml) names folders with reference images of bosses and heroes.
+   Label of an image is its file name up to the first "_": "Ancient Demon_dead.png" is "Ancient Demon".
+   A new season needs new images (see "extract" below) and no code changes
+2. Each reference image is downscaled to a fixed small size (INTER_AREA) and normalized
+   (zero mean, unit norm). All templates of a folder are rows of one float32 matrix (TemplateIndex)
+3. A crop is prepared the same way, so one matrix-vector product gives normalized cross correlation
+   with all templates at once. Crops of all hits of a screenshot are one matrix-matrix product.
+   The best template wins if its correlation is at least min_score, otherwise the crop is unknown
+   (boss is recognized by OCR of lvBoss then, if the resolution has it)
+
+The party image is slots hero portraits side by side, each slot is matched with the heroes gallery.
+
+Reference images are crops made by the same dimensions file, so they are taken from screenshots:
+    python -m gtraid.template_gallery extract -k bosses -o gallery/new test_images/2021-06-06/*
+writes different crops (correlation below --max-similar) as unknown_001.png, ... Rename them to
+"<label>_<anything>.png" and move to the gallery folder.
+"""
+
+import argparse
+import glob
+import hashlib
+import logging
+import os
+from collections import namedtuple
+
+import cv2
+import numpy as np
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# Extensions of reference images
+GALLERY_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Galleries of the config file
+GALLERY_KINDS = ('bosses', 'heroes')
+
+# Default template sizes (width, height): boss portraits are wide, hero portraits are square
+DEFAULT_SIZES = {'bosses': (24, 12), 'heroes': (16, 16)}
+
+# Best template of a crop: label and correlation ("" and the best correlation if it is below min_score)
+TemplateMatch = namedtuple('TemplateMatch', ['label', 'score'])
+
+
+class TemplateGalleryError(ValueError):
+    """Gallery config has an error. The message names the gallery and the field"""
+
+
+def template_vector(img, size):
+    """
+    Image downscaled to size and normalized (zero mean, unit norm), so dot product of two vectors
+    is their normalized cross correlation
+    :param img: BGR image
+    :param size: (width, height)
+    :return: float32 vector
+    """
+    vector = cv2.resize(img, size, interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector
+
+
+def image_label(file_name):
+    """Label of a reference image: file name up to the first '_'"""
+    return os.path.splitext(os.path.basename(file_name))[0].split('_')[0]
+
+
+class TemplateIndex:
+    """Templates of one gallery (bosses or heroes) as rows of one matrix"""
+
+    def __init__(self, size, min_score, labels=(), templates=None):
+        """
+        :param size: (width, height) of templates
+        :param min_score: minimal correlation of a match
+        :param labels: label of each template
+        :param templates: matrix of template vectors (rows)
+        """
+        self.size = tuple(size)
+        self.min_score = min_score
+        self.labels = list(labels)
+        self.templates = templates if templates is not None else \
+            np.zeros((0, self.size[0] * self.size[1] * 3), dtype=np.float32)
+
+    @classmethod
+    def from_folder(cls, folder, size, min_score):
+        """Index of all reference images of a folder"""
+        file_names = sorted(file_name for file_name in glob.glob(os.path.join(folder, "*"))
+                            if file_name.lower().endswith(GALLERY_EXTENSIONS))
+        index = cls(size, min_score)
+        for file_name in file_names:
+            img = cv2.imread(file_name)
+            if img is None:
+                logger.warning("TemplateIndex: can't read '%s'", file_name)
+                continue
+            index.add(image_label(file_name), img)
+        return index
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def signature(self):
+        """Hash of labels and templates (for cache keys)"""
+        digest = hashlib.sha1(repr((self.size, self.min_score, self.labels)).encode("utf-8"))
+        digest.update(self.templates.tobytes())
+        return digest.hexdigest()
+
+    def add(self, label, img):
+        self.labels.append(label)
+        self.templates = np.vstack((self.templates, template_vector(img, self.size)))
+
+    def scores(self, images):
+        """Correlations of images (rows) with all templates (columns)"""
+        vectors = np.array([template_vector(img, self.size) for img in images], dtype=np.float32)
+        return vectors @ self.templates.T
+
+    def match(self, images):
+        """
+        Best templates of images
+        :param images: list of BGR images
+        :return: list of TemplateMatch
+        """
+        if not images or not self.labels:
+            return [TemplateMatch("", 0.0) for _ in images]
+        scores = self.scores(images)
+        best = scores.argmax(axis=1)
+        return [TemplateMatch(self.labels[index] if score >= self.min_score else "", float(score))
+                for index, score in zip(best, scores[np.arange(len(images)), best])]
+
+
+def party_slots(party_img, slots):
+    """Splits party image into slots hero portraits of the same width"""
+    width = party_img.shape[1]
+    return [party_img[:, width * slot // slots:width * (slot + 1) // slots] for slot in range(slots)]
+
+
+def _gallery_field(config, kind, field, value_type, default):
+    value = config.get(field, default)
+    try:
+        if value_type is tuple:
+            width, height = (int(item) for item in value)
+            if width < 1 or height < 1:
+                raise ValueError
+            return width, height
+        return value_type(value)
+    except (TypeError, ValueError):
+        raise TemplateGalleryError(f"gallery '{kind}': field '{field}' is invalid: {value!r}") from None
+
+
+class TemplateGallery:
+    """Boss and heroes galleries of a gallery config file"""
+
+    def __init__(self, file_name):
+        """
+        Loads the config and builds template indexes. Raises TemplateGalleryError
+        :param file_name: gallery config (YAML). Folders are relative to it
+        """
+        self.file_name = file_name
+        try:
+            with open(file_name, encoding='utf-8') as config_file:
+                config = yaml.safe_load(config_file) or {}
+        except (OSError, yaml.YAMLError) as ex:
+            raise TemplateGalleryError(f"can't read gallery config '{file_name}': {ex}") from None
+
+        self.bosses = None          # TemplateIndex or None if there is no bosses gallery
+        self.heroes = None          # TemplateIndex or None if there is no heroes gallery
+        self.slots = 4              # Hero portraits in the party image
+        base_dir = os.path.dirname(os.path.abspath(file_name))
+        for kind in GALLERY_KINDS:
+            kind_config = config.get(kind)
+            if not kind_config:
+                continue
+            if 'folder' not in kind_config:
+                raise TemplateGalleryError(f"gallery '{kind}': field 'folder' is missing")
+            folder = os.path.join(base_dir, kind_config['folder'])
+            size = _gallery_field(kind_config, kind, 'size', tuple, DEFAULT_SIZES[kind])
+            min_score = _gallery_field(kind_config, kind, 'min_score', float, 0.6)
+            if kind == 'heroes':
+                self.slots = _gallery_field(kind_config, kind, 'slots', int, 4)
+            index = TemplateIndex.from_folder(folder, size, min_score)
+            if not len(index):
+                logger.warning("TemplateGallery: no reference images of %s in '%s'", kind, folder)
+                continue
+            logger.info("TemplateGallery: %d reference images of %s (%d labels) in '%s'",
+                        len(index), kind, len(set(index.labels)), folder)
+            setattr(self, kind, index)
+
+    @property
+    def signature(self):
+        """Hash of all templates (for cache keys)"""
+        return hashlib.sha1(":".join(index.signature if index is not None else "-"
+                                     for index in (self.bosses, self.heroes)).encode("utf-8")).hexdigest()
+
+    def recognize_bosses(self, boss_images):
+        """
+        Bosses of boss portraits (boss_img crops)
+        :return: list of TemplateMatch, label is "" if unknown or there is no bosses gallery
+        """
+        if self.bosses is None:
+            return [TemplateMatch("", 0.0) for _ in boss_images]
+        matches = self.bosses.match(boss_images)
+        for match in matches:
+            logger.debug("recognize_bosses: '%s' (%.2f)", match.label, match.score)
+        return matches
+
+    def recognize_parties(self, party_images):
+        """
+        Heroes of party images
+        :return: list of "hero, hero, ..." texts ("?" for unknown heroes), "" if there is no heroes gallery
+        """
+        if self.heroes is None:
+            return [""] * len(party_images)
+        portraits = [portrait for party_img in party_images for portrait in party_slots(party_img, self.slots)]
+        labels = [match.label or "?" for match in self.heroes.match(portraits)]
+        return [", ".join(labels[index:index + self.slots]) for index in range(0, len(labels), self.slots)]
+
+
+# Gallery used by recognize_screenshot in this process. None = bosses and heroes are not matched
+_template_gallery = None
+
+
+def set_template_gallery(gallery):
+    global _template_gallery
+    _template_gallery = gallery
+
+
+def get_template_gallery():
+    return _template_gallery
+
+
+def extract_references(files, dimensions_file, kind, max_similar=0.9, slots=4):
+    """
+    Different boss or hero crops of screenshots to make reference images of a gallery
+    :param files: screenshot file names
+    :param dimensions_file: DimensionsFile
+    :param kind: "bosses" or "heroes"
+    :param max_similar: a crop correlating with an already taken one at least this much is skipped
+    :param slots: hero portraits in the party image
+    :return: list of images
+    """
+    from .image_reco import find_hit_boxes, box_region
+
+    taken = TemplateIndex(DEFAULT_SIZES[kind], max_similar)
+    crops = []
+    for file_name in files:
+        img = cv2.imread(file_name)
+        crop_rects = dimensions_file.get_dimensions(img.shape[1], img.shape[0]) if img is not None else None
+        if crop_rects is None:
+            logger.warning("extract_references: skipping '%s'", file_name)
+            continue
+        window = crop_rects.hits_window.crop(img)
+        hit_rects = crop_rects.hit_image
+        for box in find_hit_boxes(window, hit_rects.min_width, hit_rects.min_height, debug=0):
+            if kind == 'bosses':
+                candidates = [box_region(window, box, hit_rects.boss_rect)]
+            else:
+                candidates = party_slots(box_region(window, box, hit_rects.party_rect), slots)
+            for crop in candidates:
+                if taken.match([crop])[0].label:
+                    continue
+                taken.add("taken", crop)
+                crops.append(crop.copy())
+    return crops
+
+
+if __name__ == "__main__":
+    from .dimensions import DimensionsFile
+
+    root_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+    parser = argparse.ArgumentParser(description="Tools for template galleries (gallery.yaml)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    extract_parser = subparsers.add_parser("extract", help="Save different boss or hero crops of screenshots "
+                                                           "to label them")
+    extract_parser.add_argument("inputs", nargs="+", help="Screenshot files (wildcards are allowed)")
+    extract_parser.add_argument("-k", "--kind", choices=GALLERY_KINDS, default="bosses")
+    extract_parser.add_argument("-o", "--output", required=True, help="Folder for crops")
+    extract_parser.add_argument("--max-similar", type=float, default=0.9,
+                                help="Skip crops correlating with a saved one at least this much")
+    match_parser = subparsers.add_parser("match", help="Match images with a gallery (to check min_score)")
+    match_parser.add_argument("inputs", nargs="+", help="Image files: boss or party crops (wildcards are allowed)")
+    match_parser.add_argument("-g", "--gallery", default=os.path.join(root_dir, "gallery.yaml"))
+    match_parser.add_argument("-k", "--kind", choices=GALLERY_KINDS, default="bosses")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    inputs = [file_name for user_input in args.inputs for file_name in sorted(glob.glob(user_input))]
+    if args.command == "extract":
+        crops = extract_references(inputs, DimensionsFile(os.path.join(root_dir, "dimensions.yaml")), args.kind,
+                                   args.max_similar)
+        os.makedirs(args.output, exist_ok=True)
+        for crop_index, crop in enumerate(crops):
+            cv2.imwrite(os.path.join(args.output, f"unknown_{crop_index + 1:03}.png"), crop)
+        print(f"{len(crops)} different {args.kind} crops saved to '{args.output}'")
+    else:
+        try:
+            gallery = TemplateGallery(args.gallery)
+        except TemplateGalleryError as ex:
+            parser.error(str(ex))
+        index = getattr(gallery, args.kind)
+        if index is None:
+            parser.error(f"'{args.gallery}' has no {args.kind} gallery")
+        for file_name in inputs:
+            img = cv2.imread(file_name)
+            if img is None:
+                continue
+            images = [img] if args.kind == 'bosses' else party_slots(img, gallery.slots)
+            print(file_name, ", ".join(f"{match.label or '?'} ({match.score:.2f})" for match in index.match(images)))
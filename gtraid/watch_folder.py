@@ -0,0 +1,219 @@
+"""
+Watch mode: screenshots are recognized as they appear in folders (gt.py --watch)
+
+Admins sync screenshots from phones into a shared folder during raid days. Instead of running gt.py over
+the whole folder again, gt.py --watch keeps running and recognizes only new files:
+
+1. FolderWatcher finds new and changed files. With watchdog (pip install watchdog) it gets file system
+   events (inotify on Linux, ReadDirectoryChangesW on Windows, FSEvents on macOS). Without it, or if
+   events can't be watched (network shares), folders are scanned every poll_interval seconds
+2. A file is ready when its size and modification time didn't change for settle_seconds, so files
+   which are still being copied or synced are not read half written
+3. Ready files go to process_files (worker pool, cache, OCR memo, see pipeline.py) in the order they
+   were taken, hits are written to the outputs and flushed
+4. ProcessedManifest appends each written file to a manifest file. After a restart files of the
+   manifest with the same size and modification time are skipped without reading them
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from .screenshot_time import screenshot_order_key
+
+logger = logging.getLogger(__name__)
+
+# Extensions of screenshots
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def file_identity(file_name):
+    """(size, modification time in ns) of a file or None if it doesn't exist"""
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ProcessedManifest:
+    """
+    Append-only file (JSON lines) with screenshots which hits are written to the outputs.
+    A file which is changed later (another size or modification time) is processed again
+    """
+
+    def __init__(self, file_name):
+        """Opens (creates) manifest file and loads processed files"""
+        self.file_name = file_name
+        self._processed = {}        # file name -> (size, mtime_ns)
+        if os.path.isfile(file_name):
+            with open(file_name, encoding='utf-8') as manifest_file:
+                for line in manifest_file:
+                    try:
+                        entry = json.loads(line)
+                        self._processed[entry['file']] = (entry['size'], entry['mtime_ns'])
+                    except (ValueError, KeyError):
+                        # The last line may be cut if the process was killed while writing it
+                        logger.warning("ProcessedManifest: skipping broken line in '%s': %r", file_name, line)
+        logger.info("ProcessedManifest: %d processed files in '%s'", len(self._processed), file_name)
+        self._file = open(file_name, "a", encoding='utf-8')
+
+    def __len__(self):
+        return len(self._processed)
+
+    def is_processed(self, file_name, identity):
+        return self._processed.get(file_name) == identity
+
+    def add(self, processed_file, identity):
+        """
+        Records a file which hits are written (and flushed). The record is on disk when add returns
+        :param processed_file: pipeline.ProcessedFile
+        :param identity: file_identity of the file when it was taken for processing
+        """
+        if identity is None:
+            return
+        self._processed[processed_file.file_name] = identity
+        self._file.write(json.dumps({'file': processed_file.file_name, 'size': identity[0], 'mtime_ns': identity[1],
+                                     'hits': len(processed_file.hit_records), 'error': processed_file.error or "",
+                                     'time': round(time.time(), 3)}, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class _EventHandler:
+    """watchdog event handler: collects paths of created, modified and moved files"""
+
+    def __init__(self, changed, lock):
+        self._changed = changed
+        self._lock = lock
+
+    def dispatch(self, event):
+        # Files opened or read (by recognition too) are not changed
+        if event.is_directory or event.event_type not in ('created', 'modified', 'moved', 'closed'):
+            return
+        path = getattr(event, 'dest_path', None) or event.src_path
+        with self._lock:
+            self._changed.add(os.fsdecode(path))
+
+
+class FolderWatcher:
+    """Finds new screenshots in folders (and their subfolders) and gives them when they are fully written"""
+
+    def __init__(self, folders, manifest, settle_seconds=2.0, poll_interval=10.0, use_events=True):
+        """
+        :param folders: list of folder names
+        :param manifest: ProcessedManifest. Its files are skipped
+        :param settle_seconds: a file is ready when it didn't change for this time
+        :param poll_interval: folders are scanned every poll_interval seconds if file events are not watched
+        :param use_events: watch file system events with watchdog (if it is installed)
+        """
+        self.folders = folders
+        self.manifest = manifest
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.identities = {}        # file name -> file_identity when it was taken for processing
+        self._candidates = {}       # file name -> (file_identity, time when it was seen with this identity)
+        self._changed = set()       # Paths from file system events
+        self._lock = threading.Lock()
+        self._observer = None
+        self._last_scan = 0.0
+
+        if use_events:
+            self._start_observer()
+        self._scan()
+
+    def _start_observer(self):
+        try:
+            from watchdog.observers import Observer
+        except ImportError:
+            logger.info("FolderWatcher: watchdog is not installed (pip install watchdog), scanning folders "
+                        "every %.0f s", self.poll_interval)
+            return
+        observer = Observer()
+        handler = _EventHandler(self._changed, self._lock)
+        try:
+            for folder in self.folders:
+                observer.schedule(handler, folder, recursive=True)
+            observer.start()
+        except OSError as ex:
+            logger.warning("FolderWatcher: can't watch file events (%s), scanning folders every %.0f s",
+                           ex, self.poll_interval)
+            return
+        logger.info("FolderWatcher: watching file events in %s", ", ".join(self.folders))
+        self._observer = observer
+
+    @property
+    def uses_events(self):
+        return self._observer is not None
+
+    def _scan(self):
+        """Adds all screenshots of the folders which are not in the manifest to candidates"""
+        count = 0
+        for folder in self.folders:
+            for dir_path, _, file_names in os.walk(folder):
+                for file_name in file_names:
+                    count += self._add_candidate(os.path.join(dir_path, file_name))
+        self._last_scan = time.monotonic()
+        if count:
+            logger.info("FolderWatcher: %d new or changed screenshots found", count)
+
+    def _add_candidate(self, file_name):
+        if not file_name.lower().endswith(IMAGE_EXTENSIONS) or file_name in self._candidates:
+            return False
+        identity = file_identity(file_name)
+        if identity is None or self.manifest.is_processed(file_name, identity) or \
+                self.identities.get(file_name) == identity:        # Taken for processing, not written yet
+            return False
+        self._candidates[file_name] = (identity, time.monotonic())
+        return True
+
+    def ready_files(self):
+        """
+        Screenshots which were not changed for settle_seconds, in the order they were taken.
+        They are not given again unless they change
+        """
+        with self._lock:
+            changed = list(self._changed)
+            self._changed.clear()
+        for file_name in changed:
+            self._candidates.pop(file_name, None)
+            self._add_candidate(file_name)
+        if not self.uses_events and time.monotonic() - self._last_scan >= self.poll_interval:
+            self._scan()
+
+        ready = []
+        now = time.monotonic()
+        for file_name, (identity, seen_time) in list(self._candidates.items()):
+            current = file_identity(file_name)
+            if current is None:
+                del self._candidates[file_name]                 # Deleted or moved away
+            elif current != identity or current[0] == 0:
+                self._candidates[file_name] = (current, now)    # Still being written
+            elif now - seen_time >= self.settle_seconds:
+                del self._candidates[file_name]
+                self.identities[file_name] = identity
+                ready.append(file_name)
+        return sorted(ready, key=screenshot_order_key)
+
+    def batches(self, tick=0.5, stop_event=None):
+        """
+        Generator of lists of ready files. Waits for new files until stop_event is set (or forever)
+        :param tick: how often candidates are checked, seconds
+        """
+        while stop_event is None or not stop_event.is_set():
+            files = self.ready_files()
+            if files:
+                logger.info("FolderWatcher: %d new screenshots", len(files))
+                yield files
+            else:
+                time.sleep(tick)
+
+    def close(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
@@ -1,33 +1,362 @@
-##############################################################################
-#
-# A simple example of some of the features of the XlsxWriter Python module.
-#
-# Copyright 2013-2021, John McNamara, jmcnamara@cpan.org
-#
+"""
+Excel output of recognized hits
+
+Each hit is a row: recognized name, damage and boss along with thumbnails of the hit box parts,
+so one can check and fix recognition results by eye. Fields recognized with low confidence are highlighted
+and confidences are in columns O:Q, so the unsure ones are checked first. With a roster (see roster.py)
+names which are not in it are highlighted and recognized names of snapped ones are in column R.
+
+xlsxwriter keeps all worksheet cells and inserted image buffers in memory until the workbook is closed.
+This is fine for a raid or two, but not for a season archive with thousands of screenshots.
+In streaming mode:
+- rows are written with xlsxwriter constant_memory option (each row is flushed to a temp file
+  as soon as the next row is started)
+- image thumbnails are spilled to a temp directory and inserted by file name,
+  so only file names are kept in memory until the workbook is closed
+- output may be split into several workbooks (by screenshot day and/or by number of rows)
+"""
+
+import io
+import logging
+import os
+import shutil
+import tempfile
+
 import xlsxwriter
 
+from .image_reco import HitSource
+from .output import CONFIDENCE_COLUMNS, OutputSink, parse_damage_number, boss_short_name, field_confidence
+from .roster import UNKNOWN
+from .screenshot_time import parse_screenshot_time
+
+logger = logging.getLogger(__name__)
+
+
+class XlsxSheet:
+    """One output workbook with a single hits worksheet"""
+
+    def __init__(self, file_name, streaming=False):
+        logger.info("XlsxOutput: creating '%s'", file_name)
+        self.file_name = file_name
+        self.streaming = streaming
+        self.workbook = xlsxwriter.Workbook(file_name, {'constant_memory': streaming})
+        self.worksheet = self.workbook.add_worksheet()
+        worksheet = self.worksheet
+
+        # Parsed name column
+        worksheet.set_column('A:A', 15)
+
+        # Damage column
+        worksheet.set_column('C:C', 15)
+
+        # Boss column
+        worksheet.set_column('H:H', 15)
+        worksheet.set_column('I:I', 15)
+
+        # Format output for a damage
+        self.damage_num_format = self.workbook.add_format({'num_format': '#,##0.', 'align': 'left'})
+        self.damage_exists_format = self.workbook.add_format({'num_format': '#,##0.', 'bg_color': '#ffb3b3', 'align': 'left'})   # #ffb3b3 - light red
+
+        # Format output for fields recognized with low confidence. #ffeb9c - light yellow
+        self.low_confidence_format = self.workbook.add_format({'bg_color': '#ffeb9c'})
+        self.damage_low_confidence_format = self.workbook.add_format({'num_format': '#,##0.', 'bg_color': '#ffeb9c',
+                                                                      'align': 'left'})
+        self.confidence_format = self.workbook.add_format({'num_format': '0.00'})
+
+        # Format output for names which are not in the roster. #f8cbad - light orange
+        self.unknown_name_format = self.workbook.add_format({'bg_color': '#f8cbad'})
+
+        # iterable showing current row to fill
+        self.cur_row = 1
+
+        # width for pictures column
+        self.max_name_width = 100
+        self.max_damage_width = 100
+        self.max_party_width = 100
+        self.max_boss_width = 50
+        self.max_hit_width = 100
+        self.max_LvBoss_width = 100
+
+        worksheet.set_column("B:B", self.max_name_width)      # Name image column
+        worksheet.set_column("D:D", self.max_damage_width)    # Damage image  column
+        worksheet.set_column("E:E", self.max_party_width)     # Party image column
+        worksheet.set_column("F:F", self.max_boss_width)      # Boss image column
+        worksheet.set_column("G:G", self.max_LvBoss_width)    # Testing Boss Text
+        worksheet.set_column("L:L", 400)
+        worksheet.set_column("J:J", self.max_hit_width)
+
+    @property
+    def rows_count(self):
+        return self.cur_row - 1
+
+    def write_sources(self, sources_by_row):
+        """
+        Writes other screenshots where deduplicated boxes were seen
+        :param sources_by_row: {row: "screenshot#hit, ..."}
+        """
+        if not sources_by_row:
+            return
+        if not self.streaming:
+            self.worksheet.set_column("M:M", 60)
+            for row, sources in sources_by_row.items():
+                self.worksheet.write(f'M{row}', sources)
+            return
+
+        # Rows of the hits worksheet are already flushed in constant_memory mode, use a separate worksheet
+        worksheet = self.workbook.add_worksheet("Duplicates")
+        worksheet.set_column("A:A", 10)
+        worksheet.set_column("B:B", 60)
+        worksheet.write('A1', "Row")
+        worksheet.write('B1', "Also seen in")
+        for index, row in enumerate(sorted(sources_by_row)):
+            worksheet.write_url(f'A{index + 2}', f"internal:Sheet1!A{row}", string=str(row))
+            worksheet.write(f'B{index + 2}', sources_by_row[row])
+
+    def close(self):
+        self.workbook.close()
+
+
+class XlsxOutput(OutputSink):
+    """Writes compact hit records (see pipeline.CompactHitRecord) to xlsx file(s)"""
+
+    name = "xlsx"
+    extension = ".xlsx"
+    needs_thumbnails = True
+
+    def __init__(self, file_name, streaming=False, max_rows=0, split_by_day=False, dedup_sources=False,
+                 min_confidence=None):
+        """
+        :param file_name: output file name
+        :param streaming: constant memory mode, images are spilled to a temp directory
+        :param max_rows: start a new workbook after this number of rows (0 - no limit)
+        :param split_by_day: separate workbook for each day (by screenshot time in its file name)
+        :param dedup_sources: write_duplicate_sources will be called. Otherwise full workbooks are closed
+                              right away, so memory doesn't grow with the number of workbooks
+        :param min_confidence: highlight name, damage and boss recognized with lower confidence (None - don't)
+        """
+        super().__init__(file_name)
+        self.streaming = streaming
+        self.max_rows = max_rows
+        self.split_by_day = split_by_day
+        self.dedup_sources = dedup_sources
+        self.min_confidence = min_confidence
+
+        self._spill_dir = tempfile.mkdtemp(prefix="gtraid_xlsx_") if streaming else ""
+        self._spilled_count = 0
+
+        self._open_sheets = {}       # shard key (day) -> [XlsxSheet, part number]
+        self._sheets = []            # Sheets which are not closed yet
+        self.file_names = []
+
+        # this map is used to track doublicated hits
+        self.damage_name_map = {}
+
+        # HitSource of a written box -> (XlsxSheet, row). Used for deduplicated boxes sources (if dedup_sources)
+        self.written_boxes = {}
+
+    def _shard_key(self, file_name):
+        if not self.split_by_day:
+            return ""
+        screenshot_time = parse_screenshot_time(file_name)
+        return screenshot_time.strftime("%Y-%m-%d") if screenshot_time else "no-date"
+
+    def _shard_file_name(self, key, part):
+        base_name, extension = os.path.splitext(self.file_name)
+        if key:
+            base_name += f"_{key}"
+        if self.max_rows:
+            base_name += f"_{part:03}"
+        return base_name + extension
+
+    def _get_sheet(self, file_name):
+        """Returns sheet to write hits of the screenshot, opens a new one if needed"""
+        key = self._shard_key(file_name)
+        sheet, part = self._open_sheets.get(key, (None, 0))
+        if sheet and self.max_rows and sheet.rows_count >= self.max_rows:
+            # Duplicates sources are written at the end, then the full sheet stays open till close()
+            if not self.dedup_sources:
+                sheet.close()
+                self._sheets.remove(sheet)
+            sheet = None
+        if sheet is None:
+            part += 1
+            sheet = XlsxSheet(self._shard_file_name(key, part), self.streaming)
+            self._open_sheets[key] = [sheet, part]
+            self._sheets.append(sheet)
+            self.file_names.append(sheet.file_name)
+        return sheet
+
+    def _image_source(self, thumbnail):
+        """Image file name (spilled to temp dir) in streaming mode or BytesIO"""
+        if not self.streaming:
+            return io.BytesIO(thumbnail.data)
+        self._spilled_count += 1
+        spill_name = os.path.join(self._spill_dir, f"{self._spilled_count}.jpg")
+        with open(spill_name, "wb") as spill_file:
+            spill_file.write(thumbnail.data)
+        return spill_name
+
+    def _insert_image(self, worksheet, cell, image_name, thumbnail, options=None):
+        options = dict(options or {})
+        source = self._image_source(thumbnail)
+        if isinstance(source, str):
+            options['description'] = image_name
+            worksheet.insert_image(cell, source, options)
+        else:
+            options['image_data'] = source
+            worksheet.insert_image(cell, image_name, options)
+
+    def write(self, processed_file):
+        """Writes all hits of a processed screenshot (pipeline.ProcessedFile)"""
+        image_base_name = processed_file.image_base_name
+        if not processed_file.hit_records:
+            return
+        sheet = self._get_sheet(processed_file.file_name)
+        worksheet = sheet.worksheet
+
+        # Iterate over hits
+        for hit_record in processed_file.hit_records:
+            if self.max_rows and sheet.rows_count >= self.max_rows:
+                sheet = self._get_sheet(processed_file.file_name)
+                worksheet = sheet.worksheet
+
+            cur_row = sheet.cur_row
+            hit_index = hit_record.hit_index
+            logger.debug("  %s %s", hit_record.name, hit_record.damage)
+
+            confidences = {field: field_confidence(hit_record, field) for field in CONFIDENCE_COLUMNS.values()}
+            unsure = {field for field, confidence in confidences.items()
+                      if self.min_confidence is not None and confidence is not None
+                      and confidence < self.min_confidence}
+
+            # Add name to worksheet
+            name_format = sheet.low_confidence_format if 'name' in unsure else None
+            if hit_record.name_status == UNKNOWN:
+                name_format = sheet.unknown_name_format
+            worksheet.write(f'A{cur_row}', hit_record.name, name_format)
+            worksheet.write(f'I{cur_row}', hit_record.boss)
+            # Parse damage and add to worksheet
+            if hit_record.damage:
+                try:
+                    damage = parse_damage_number(hit_record.damage)
+
+                    damage_name_pair = hit_record.damage + hit_record.name
+
+                    # There was no such damage before for this name?
+                    if damage_name_pair not in self.damage_name_map.keys():
+                        # Just add to the cell then
+                        self.damage_name_map[damage_name_pair] = damage
+                        worksheet.write_number(f'C{cur_row}', damage, sheet.damage_low_confidence_format
+                                               if 'damage' in unsure else sheet.damage_num_format)
+                    else:
+                        # Probably image overlap!
+                        worksheet.write(f'C{cur_row}', damage, sheet.damage_exists_format)
+                except ValueError as ex:
+                    logger.warning("can't convert damage '%s' to integer! %s", hit_record.damage, ex)
+            else:
+                logger.warning("Damage is empty for hit# %d name: '%s'", hit_index, hit_record.name)
+
+            if hit_record.boss:
+                worksheet.write(f'H{cur_row}', boss_short_name(hit_record.boss),
+                                sheet.low_confidence_format if 'boss' in unsure else None)
+
+            # NAME image
+            name_width, name_height = hit_record.name_img.width, hit_record.name_img.height
+            if name_width > sheet.max_name_width:
+                sheet.max_name_width = name_width
+                worksheet.set_column_pixels("B:B", sheet.max_name_width+10)
+            if hit_record.name_img.data:
+                self._insert_image(worksheet, f'B{cur_row}', f'name{cur_row}', hit_record.name_img, {'object_position': 1})
+
+            # Damage image
+            damage_width, damage_height = hit_record.damage_img.width, hit_record.damage_img.height
+            if damage_width > sheet.max_damage_width:
+                sheet.max_damage_width = damage_width
+                worksheet.set_column_pixels("D:D", sheet.max_damage_width+10)
+            if hit_record.damage_img.data:
+                self._insert_image(worksheet, f'D{cur_row}', f'damage{cur_row}', hit_record.damage_img)
+
+            # Party image
+            party_width, party_height = hit_record.party_img.width, hit_record.party_img.height
+            if party_width > sheet.max_party_width:
+                sheet.max_party_width = party_width
+                worksheet.set_column_pixels("E:E", sheet.max_party_width+10)
+            if hit_record.party_img.data:
+                self._insert_image(worksheet, f'E{cur_row}', f'party{cur_row}', hit_record.party_img)
+
+            # Boss image
+            boss_width, boss_height = hit_record.boss_img.width, hit_record.boss_img.height
+            if boss_width > sheet.max_boss_width:
+                sheet.max_boss_width = boss_width
+                worksheet.set_column_pixels("F:F", sheet.max_boss_width+10)
+            if hit_record.boss_img.data:
+                self._insert_image(worksheet, f'F{cur_row}', f'boss{cur_row}', hit_record.boss_img)
+
+            # lvBoss Text image lvBoss
+            lvBoss_width = hit_record.lvBoss_img.width
+            if lvBoss_width > sheet.max_LvBoss_width:
+                sheet.max_LvBoss_width = lvBoss_width
+                worksheet.set_column_pixels("G:G", sheet.max_LvBoss_width+10)
+            if hit_record.lvBoss_img.data:
+                self._insert_image(worksheet, f'G{cur_row}', f'boss{cur_row}', hit_record.lvBoss_img)
+
+            # Hit image
+            hit_image_scale = 0.3                       # we will scale in excel
+            hit_width = hit_record.hit_img.width*hit_image_scale
+            hit_height = hit_record.hit_img.height*hit_image_scale
+            if hit_width > sheet.max_hit_width:
+                sheet.max_hit_width = hit_width
+                worksheet.set_column_pixels("J:J", sheet.max_hit_width + 10)
+            if hit_record.hit_img.data:
+                self._insert_image(worksheet, f'J{cur_row}', f'hit{cur_row}', hit_record.hit_img,
+                                   {'x_scale': hit_image_scale, 'y_scale': hit_image_scale})
 
-# Create an new Excel file and add a worksheet.
-workbook = xlsxwriter.Workbook('demo.xlsx')
-worksheet = workbook.add_worksheet()
+            # Now what is row height?
+            row_height = max(name_height, damage_height, party_height, boss_height, hit_height)
+            worksheet.set_row(cur_row - 1, row_height)
 
-# Widen the first column to make the text clearer.
-worksheet.set_column('A:A', 20)
+            # Add file name
+            worksheet.write(f'L{cur_row}', image_base_name)
+            worksheet.write(f'K{cur_row}', hit_index)
 
-# Add a bold format to use to highlight cells.
-bold = workbook.add_format({'bold': True})
+            # Heroes recognized by the gallery (gt.py --gallery)
+            if hit_record.party:
+                worksheet.write(f'N{cur_row}', hit_record.party)
 
-# Write some simple text.
-worksheet.write('A1', 'Hello')
+            # Confidences of name, damage and boss
+            for column, field in zip("OPQ", CONFIDENCE_COLUMNS.values()):
+                if confidences[field] is not None:
+                    worksheet.write_number(f'{column}{cur_row}', confidences[field], sheet.confidence_format)
 
-# Text with formatting.
-worksheet.write('A2', 'World', bold)
+            # Recognized name which was snapped to the roster (gt.py --roster)
+            if hit_record.ocr_name:
+                worksheet.write(f'R{cur_row}', hit_record.ocr_name)
 
-# Write some numbers, with row/column notation.
-worksheet.write(2, 0, 123)
-worksheet.write(3, 0, 123.456)
+            if self.dedup_sources:
+                self.written_boxes[HitSource(processed_file.file_name, hit_index)] = (sheet, cur_row)
+            sheet.cur_row += 1
 
-# Insert an image.
-# worksheet.insert_image('B5', 'logo.png')
+    def write_duplicate_sources(self, deduplicator):
+        """Writes all screenshots where each unique box was seen (hit_dedup.HitDeduplicator)"""
+        sources_by_sheet = {}
+        for sources in deduplicator.sources:
+            sheet, row = self.written_boxes.get(sources[0], (None, 0))
+            if row and len(sources) > 1:
+                sources_by_sheet.setdefault(sheet, {})[row] = \
+                    ", ".join(f"{os.path.splitext(os.path.basename(source.file_name))[0]}"
+                              f"#{source.hit_index}" for source in sources[1:])
+        for sheet, sources_by_row in sources_by_sheet.items():
+            sheet.write_sources(sources_by_row)
 
-workbook.close()
\ No newline at end of file
+    def close(self):
+        """Closes all workbooks and removes spilled images"""
+        if not self.file_names:
+            # Keep the old behaviour: the output file is created even if nothing is recognized
+            self._sheets.append(XlsxSheet(self.file_name, self.streaming))
+            self.file_names.append(self.file_name)
+        for sheet in self._sheets:
+            sheet.close()
+        self._sheets = []
+        self._open_sheets = {}
+        if self._spill_dir:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
@@ -1,3 +1,4 @@
+import logging
 import os
 import cv2
 
@@ -8,6 +9,9 @@ from gtraid import recognize_screenshot, DimensionsFile
 
 if __name__ == "__main__":
 
+    # Show how the image is processed in details
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+
     # Set it to your tesseract
     pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 